@@ -1,17 +1,32 @@
 # File: app.py
 import os
 import io
+import hashlib
+import csv
+import json
+import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta
 from decimal import Decimal
-from flask import ( Flask, render_template, redirect, url_for, request, flash, send_file, jsonify, Response, session)
+from flask import ( Flask, render_template, redirect, url_for, request, flash, send_file, jsonify, Response, session, make_response, g, has_request_context, stream_with_context)
 from flask_mail import Mail, Message
-from itsdangerous import URLSafeTimedSerializer
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as SesionFlaskSQLAlchemy
+from sqlalchemy import event
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import with_loader_criteria
+from sqlalchemy.pool import QueuePool, NullPool
+from sqlalchemy.sql.dml import UpdateBase
 from flask_login import ( LoginManager, UserMixin, login_user, login_required, logout_user, current_user)
 from functools import wraps
+import click
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 import pandas as pd
+from openpyxl.utils import get_column_letter
 from flask_migrate import Migrate
 from xhtml2pdf import pisa
 
@@ -30,9 +45,127 @@ if database_url.startswith('postgres://'):
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Perfil SQLite (sucursales sin DATABASE_URL): WAL para que lectores y escritores no se bloqueen.
+# SQLITE_PERFIL=basico deja los valores por defecto de SQLite.
+if os.getenv('SQLITE_PERFIL', 'produccion') == 'basico':
+    app.config['SQLITE_PRAGMAS'] = {}
+else:
+    app.config['SQLITE_PRAGMAS'] = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', -64000)),  # negativo = KiB
+        'temp_store': 'MEMORY',
+        'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000)),  # ms
+    }
+# Segundos entre ejecuciones de PRAGMA optimize por proceso (0 = nunca)
+app.config['SQLITE_OPTIMIZE_INTERVALO'] = int(os.getenv('SQLITE_OPTIMIZE_INTERVALO', 3600))
+
+# Métricas del pool de conexiones (por proceso)
+_metricas_pool = {'checkouts': 0, 'espera_total_s': 0.0, 'espera_max_s': 0.0, 'agotamientos': 0}
+_metricas_pool_lock = threading.Lock()
+
+def registrar_espera_pool(segundos, agotado=False):
+    with _metricas_pool_lock:
+        if agotado:
+            _metricas_pool['agotamientos'] += 1
+            return
+        _metricas_pool['checkouts'] += 1
+        _metricas_pool['espera_total_s'] += segundos
+        _metricas_pool['espera_max_s'] = max(_metricas_pool['espera_max_s'], segundos)
+
+class PoolMedido(QueuePool):
+    """QueuePool que registra cuánto espera cada checkout y cuántas veces se agota el pool."""
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            conexion = super()._do_get()
+        except sa_exc.TimeoutError:
+            registrar_espera_pool(time.perf_counter() - inicio, agotado=True)
+            raise
+        registrar_espera_pool(time.perf_counter() - inicio)
+        return conexion
+
+def opciones_motor_bd(url):
+    """
+    Opciones del engine según la base de datos. En PostgreSQL el presupuesto DB_CONEXIONES_MAX
+    (límite del plan), menos DB_CONEXIONES_RESERVADAS para consola y tareas, se reparte entre los
+    WEB_CONCURRENCY workers de gunicorn; cada worker nunca abre más que su parte.
+    DB_POOL_MODO=transaccion usa NullPool para trabajar detrás de un pooler en modo transacción
+    (PgBouncer): la app no deja estado de sesión, los SET que use son SET LOCAL.
+    """
+    if not url.startswith('postgresql'):
+        return {} if url in ('sqlite://', 'sqlite:///:memory:') else {'poolclass': PoolMedido}
+    if os.getenv('DB_POOL_MODO', 'pool') == 'transaccion':
+        return {'poolclass': NullPool, 'pool_pre_ping': True}
+    presupuesto = int(os.getenv('DB_CONEXIONES_MAX', 20)) - int(os.getenv('DB_CONEXIONES_RESERVADAS', 3))
+    workers = max(1, int(os.getenv('WEB_CONCURRENCY', 1)))
+    return {
+        'poolclass': PoolMedido,
+        'pool_size': max(1, presupuesto // workers),
+        'max_overflow': 0,
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 300)),
+        'pool_pre_ping': True,
+    }
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opciones_motor_bd(database_url)
+
+# Réplica de solo lectura (opcional) para reportes y exportaciones marcados con @lectura_en_replica.
+# Si la réplica no responde o su retraso supera REPLICA_MAX_RETRASO_S se usa la base principal.
+replica_url = os.getenv('DATABASE_REPLICA_URL', '')
+if replica_url.startswith('postgres://'):
+    replica_url = replica_url.replace('postgres://', 'postgresql://', 1)
+if replica_url:
+    app.config['SQLALCHEMY_BINDS'] = {'replica': {'url': replica_url, **opciones_motor_bd(replica_url)}}
+app.config['REPLICA_MAX_RETRASO_S'] = float(os.getenv('REPLICA_MAX_RETRASO_S', 30))
+app.config['REPLICA_CHEQUEO_INTERVALO_S'] = float(os.getenv('REPLICA_CHEQUEO_INTERVALO_S', 15))
+
+# Las vistas de solo lectura corren en transacciones READ ONLY con un tiempo máximo por consulta
+# según su clase (ms; 0 = sin límite): 'exportacion' para exportar_*, 'reporte' para el resto
+app.config['STATEMENT_TIMEOUT_MS'] = {
+    'reporte': int(os.getenv('STATEMENT_TIMEOUT_REPORTE_MS', 15000)),
+    'exportacion': int(os.getenv('STATEMENT_TIMEOUT_EXPORTACION_MS', 60000)),
+}
 app.config['UPLOAD_FOLDER'] = os.path.join(basedir, 'comprobantes')
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Caché en disco de PDFs de liquidaciones (evicción LRU por tamaño total)
+app.config['LIQUIDACION_PDF_CACHE_DIR'] = os.getenv('LIQUIDACION_PDF_CACHE_DIR', os.path.join(basedir, 'cache', 'liquidaciones'))
+app.config['LIQUIDACION_PDF_CACHE_MAX_BYTES'] = int(os.getenv('LIQUIDACION_PDF_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+os.makedirs(app.config['LIQUIDACION_PDF_CACHE_DIR'], exist_ok=True)
+
+# Segundos de caché HTTP para reportes de meses cerrados (sus datos ya no cambian)
+app.config['REPORTES_CERRADOS_MAX_AGE'] = int(os.getenv('REPORTES_CERRADOS_MAX_AGE', 86400))
+
+# Colas de seguimiento: días desde el fin del viaje (postventa) o su inicio (marketing)
+# a partir de los cuales una reserva queda pendiente de contacto
+app.config['POSTVENTA_DIAS_TRAS_VIAJE'] = int(os.getenv('POSTVENTA_DIAS_TRAS_VIAJE', 2))
+app.config['MARKETING_DIAS_TRAS_VIAJE'] = int(os.getenv('MARKETING_DIAS_TRAS_VIAJE', 7))
+
+# Cobranza previa al viaje: días hacia adelante en que se revisan las salidas impagas
+app.config['COBRANZA_DIAS_ANTES_VIAJE'] = int(os.getenv('COBRANZA_DIAS_ANTES_VIAJE', 15))
+
+# Facturación mensual automática: cada empresa se factura con FACTURA_PORCENTAJE % de la suma
+# de FACTURA_CAMPO_MONTO de sus ventas del mes (comision_agencia, ganancia_total o precio_venta_total)
+app.config['FACTURA_CAMPO_MONTO'] = os.getenv('FACTURA_CAMPO_MONTO', 'comision_agencia')
+app.config['FACTURA_PORCENTAJE'] = Decimal(os.getenv('FACTURA_PORCENTAJE', '100'))
+
+# Conciliación de facturas: diferencia de monto tolerada y días de plazo de pago tras el fin del mes
+app.config['CONCILIACION_TOLERANCIA'] = float(os.getenv('CONCILIACION_TOLERANCIA', 1))
+app.config['FACTURA_DIAS_VENCIMIENTO'] = int(os.getenv('FACTURA_DIAS_VENCIMIENTO', 30))
+
+# Particionado mensual de la tabla reserva por fecha_venta (solo PostgreSQL)
+app.config['RESERVA_PARTICIONADA'] = os.getenv('RESERVA_PARTICIONADA', 'false').lower() == 'true'
+app.config['RESERVA_PARTICIONES_ADELANTE'] = int(os.getenv('RESERVA_PARTICIONES_ADELANTE', 3))
+
+# Archivo de reservas: las ventas de más de RESERVAS_ARCHIVO_MESES meses pasan a reserva_archivada
+# y sus comprobantes a la carpeta fría
+app.config['RESERVAS_ARCHIVO_MESES'] = int(os.getenv('RESERVAS_ARCHIVO_MESES', 24))
+app.config['COMPROBANTES_ARCHIVO_FOLDER'] = os.getenv('COMPROBANTES_ARCHIVO_FOLDER', os.path.join(basedir, 'comprobantes_archivo'))
+os.makedirs(app.config['COMPROBANTES_ARCHIVO_FOLDER'], exist_ok=True)
+
 # Configuración de Flask-Mail
 app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
 app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 587))
@@ -45,8 +178,159 @@ mail = Mail(app)
 serializer = URLSafeTimedSerializer(app.secret_key)
 
 # Configuración de SQLAlchemy y Flask-Migrate
-db = SQLAlchemy(app)
+class SesionEnrutada(SesionFlaskSQLAlchemy):
+    """Sesión que envía las lecturas de las vistas de solo lectura a la réplica; las escrituras siempre a la principal."""
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not isinstance(clause, UpdateBase)
+                and has_request_context() and g.get('usar_replica')):
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': SesionEnrutada})
 migrate = Migrate(app, db)
+
+@event.listens_for(Engine, 'connect')
+def aplicar_pragmas_sqlite(dbapi_connection, connection_record):
+    """Aplica el perfil SQLITE_PRAGMAS a cada conexión SQLite nueva."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, valor in app.config['SQLITE_PRAGMAS'].items():
+        cursor.execute(f"PRAGMA {pragma}={valor}")
+    cursor.close()
+
+_ultimo_optimize_sqlite = [time.monotonic()]
+
+@event.listens_for(Engine, 'checkout')
+def optimizar_sqlite(dbapi_connection, connection_record, connection_proxy):
+    """Ejecuta PRAGMA optimize como mucho una vez cada SQLITE_OPTIMIZE_INTERVALO segundos por proceso."""
+    intervalo = app.config['SQLITE_OPTIMIZE_INTERVALO']
+    if not intervalo or not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    ahora = time.monotonic()
+    if ahora - _ultimo_optimize_sqlite[0] < intervalo:
+        return
+    _ultimo_optimize_sqlite[0] = ahora
+    dbapi_connection.execute("PRAGMA optimize")
+
+# Estado de la réplica por proceso; se revisa como mucho cada REPLICA_CHEQUEO_INTERVALO_S
+_estado_replica = {'ok': False, 'retraso_s': None, 'revisado': None}
+
+def medir_retraso_replica(conexion):
+    """Segundos de retraso de la réplica (0 si está al día o si no es una réplica PostgreSQL)."""
+    if conexion.dialect.name != 'postgresql':
+        return 0.0
+    retraso = conexion.execute(db.text(
+        "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+    )).scalar()
+    return float(retraso or 0)
+
+def replica_disponible():
+    """Indica si hay réplica configurada, responde y su retraso está dentro de REPLICA_MAX_RETRASO_S."""
+    if 'replica' not in db.engines:
+        return False
+    ahora = time.monotonic()
+    revisado = _estado_replica['revisado']
+    if revisado is None or ahora - revisado >= app.config['REPLICA_CHEQUEO_INTERVALO_S']:
+        _estado_replica['revisado'] = ahora
+        try:
+            with db.engines['replica'].connect() as conexion:
+                retraso = medir_retraso_replica(conexion)
+            _estado_replica.update(ok=retraso <= app.config['REPLICA_MAX_RETRASO_S'], retraso_s=retraso)
+        except sa_exc.SQLAlchemyError as error:
+            app.logger.warning('Réplica no disponible, se usa la base principal: %s', error)
+            _estado_replica.update(ok=False, retraso_s=None)
+    return _estado_replica['ok']
+
+@app.before_request
+def elegir_base_lectura():
+    vista = app.view_functions.get(request.endpoint)
+    solo_lectura = getattr(vista, 'lectura_en_replica', False) and request.method == 'GET'
+    g.clase_lectura = None
+    if solo_lectura:
+        g.clase_lectura = 'exportacion' if request.endpoint.startswith('exportar_') else 'reporte'
+    g.usar_replica = solo_lectura and replica_disponible()
+
+@app.after_request
+def indicar_base_lectura(response):
+    if getattr(app.view_functions.get(request.endpoint), 'lectura_en_replica', False):
+        response.headers['X-Fuente-Datos'] = 'replica' if g.get('usar_replica') else 'principal'
+    return response
+
+@app.teardown_request
+def marcar_replica_caida(error):
+    # Si la vista falló leyendo de la réplica, las siguientes peticiones van a la principal hasta el próximo chequeo
+    if (error is not None and g.get('usar_replica') and isinstance(error, sa_exc.OperationalError)
+            and not es_consulta_cancelada(error)):
+        _estado_replica.update(ok=False, revisado=time.monotonic())
+
+@event.listens_for(SesionEnrutada, 'after_begin')
+def iniciar_transaccion_lectura(session, transaction, connection):
+    """En vistas de solo lectura: transacción READ ONLY y límite de tiempo según la clase de vista."""
+    if not has_request_context() or not g.get('clase_lectura'):
+        return
+    timeout_ms = app.config['STATEMENT_TIMEOUT_MS'].get(g.clase_lectura, 0)
+    if connection.dialect.name == 'postgresql':
+        # SET LOCAL dura solo la transacción: compatible con poolers en modo transacción
+        connection.exec_driver_sql("SET TRANSACTION READ ONLY")
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+    elif connection.dialect.name == 'sqlite':
+        # SQLite no tiene statement_timeout: se interrumpe la consulta al vencer el plazo de la transacción
+        conexion_sqlite = connection.connection.dbapi_connection
+        conexion_sqlite.execute("PRAGMA query_only = ON")
+        if timeout_ms:
+            limite = time.monotonic() + timeout_ms / 1000
+            conexion_sqlite.set_progress_handler(lambda: time.monotonic() > limite, 10000)
+
+@event.listens_for(Engine, 'checkin')
+def restablecer_conexion_sqlite(dbapi_connection, connection_record):
+    """Quita el modo solo lectura y el plazo de la conexión SQLite al devolverla al pool."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.set_progress_handler(None, 0)
+        dbapi_connection.execute("PRAGMA query_only = OFF")
+
+def es_consulta_cancelada(error):
+    """Indica si el error es una consulta cancelada por tiempo (PostgreSQL 57014 o SQLite interrumpido)."""
+    original = getattr(error, 'orig', None)
+    codigo = getattr(original, 'pgcode', None) or getattr(original, 'sqlstate', None)
+    return codigo == '57014' or (isinstance(original, sqlite3.OperationalError) and 'interrupted' in str(original))
+
+# Una exportación cancelada vuelve a la página del reporte que la enlaza (con los mismos filtros)
+# en vez de reintentarse: sin filtros sería aún más costosa.
+PAGINA_DE_EXPORTACION = {
+    'exportar_antiguedad_cobranza': 'reporte_antiguedad_cobranza',
+    'exportar_catalogos': 'catalogos',
+    'exportar_conciliacion_facturas': 'contabilidad_empresas',
+    'exportar_contratos': 'contratos',
+    'exportar_empresas': 'empresas_asociadas',
+    'exportar_facturas': 'contabilidad_empresas',
+    'exportar_proveedores': 'proveedores',
+    'exportar_reporte_detalle_ventas': 'reporte_detalle_ventas',
+    'exportar_reservas': 'gestionar_reservas',
+    'exportar_reservas_admin': 'admin_reservas',
+    'exportar_reservas_usuario': 'gestionar_reservas',
+    'exportar_usuarios': 'admin_panel',
+}
+
+@app.errorhandler(sa_exc.OperationalError)
+def consulta_demasiado_lenta(error):
+    if not es_consulta_cancelada(error):
+        raise error
+    db.session.rollback()
+    mensaje = 'La consulta tardó demasiado. Acota el filtro (por ejemplo, un mes o una empresa) e inténtalo de nuevo.'
+    app.logger.warning('Consulta cancelada por tiempo en %s: %s', request.path, error.orig)
+    if request.path.startswith('/api/'):
+        return jsonify({'success': False, 'message': mensaje}), 422
+    flash(mensaje, 'warning')
+    pagina = PAGINA_DE_EXPORTACION.get(request.endpoint)
+    if pagina:
+        return redirect(url_for(pagina, **request.args))
+    # Sin filtros la vista vuelve a su periodo por defecto; si ya era así, al panel del rol
+    if request.args:
+        return redirect(url_for(request.endpoint, **(request.view_args or {})))
+    inicio = ruta_inicio_por_rol(current_user) if current_user.is_authenticated else 'index'
+    return redirect(url_for(inicio if inicio != request.endpoint else 'index'))
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
 
@@ -84,8 +368,12 @@ class Empresa(db.Model):
     tiene_productos = db.Column(db.Enum(*PRODUCTOS_OPTIONS, name='productos_options'), default='no')
 
 class SoftDeleteMixin:
-    """Mixin para implementar borrado lógico en modelos."""
-    activo = db.Column(db.Boolean, default=True)
+    """
+    Mixin para implementar borrado lógico en modelos. Las consultas excluyen por defecto los
+    registros inactivos (ver excluir_inactivos); para verlos, usar con_inactivos() o la opción
+    de ejecución incluir_inactivos=True.
+    """
+    activo = db.Column(db.Boolean, default=True, server_default=db.true())
 
     def delete(self):
         """Marca el registro como inactivo (borrado lógico)."""
@@ -105,6 +393,34 @@ class SoftDeleteMixin:
         """Devuelve solo los registros activos."""
         return cls.query.filter_by(activo=True)
 
+    @classmethod
+    def con_inactivos(cls):
+        """Consulta sin el filtro por defecto de registros activos."""
+        return cls.query.execution_options(incluir_inactivos=True)
+
+@event.listens_for(SesionEnrutada, 'do_orm_execute')
+def excluir_inactivos(execute_state):
+    """Alcance por defecto: los SELECT del ORM solo ven filas activas de los modelos con borrado lógico."""
+    if (execute_state.is_select
+            and not execute_state.is_column_load
+            and not execute_state.is_relationship_load
+            and not execute_state.execution_options.get('incluir_inactivos', False)):
+        execute_state.statement = execute_state.statement.options(
+            with_loader_criteria(SoftDeleteMixin, lambda cls: cls.activo == True, include_aliases=True)  # noqa: E712
+        )
+
+def indices_activos(tabla, *indices):
+    """
+    Índices parciales (solo filas activas) para modelos con borrado lógico: cada elemento de
+    `indices` es la tupla de columnas de un índice. El predicado se escribe como lo compara
+    cada motor (activo en PostgreSQL, activo = 1 en SQLite) para que el planificador lo use.
+    """
+    return tuple(
+        db.Index(f"ix_{tabla}_activo_{'_'.join(columnas)}", *columnas,
+                 postgresql_where=db.text('activo'), sqlite_where=db.text('activo = 1'))
+        for columnas in indices
+    )
+
 class Usuario(UserMixin, db.Model):
     """Modelo para usuarios del sistema."""
     id = db.Column(db.Integer, primary_key=True)
@@ -142,8 +458,32 @@ class Usuario(UserMixin, db.Model):
         """Verifica la contraseña ingresada."""
         return check_password_hash(self.password_hash, password_plain)
 
+# Costo neto y ganancia de una reserva: columnas generadas por la base de datos
+COLUMNAS_NETO_RESERVA = (
+    'hotel_neto', 'vuelo_neto', 'traslado_neto', 'seguro_neto',
+    'circuito_neto', 'crucero_neto', 'excursion_neto', 'paquete_neto'
+)
+EXPRESION_TOTAL_NETO = ' + '.join(f'COALESCE({col}, 0)' for col in COLUMNAS_NETO_RESERVA)
+EXPRESION_GANANCIA = f'COALESCE(precio_venta_total, 0) - ({EXPRESION_TOTAL_NETO})'
+
+# Reserva con algo pendiente: venta sin cobrar al pasajero o sin pagar al proveedor.
+# Es el predicado del índice parcial ix_reserva_impaga_fecha_viaje; las consultas deben usar
+# este mismo texto para que el planificador pueda elegir el índice.
+RESERVA_IMPAGA_SQL = "(venta_cobrada = 'No Cobrada' OR estado_pago = 'No Pagado')"
+
 class Reserva(db.Model):
     """Modelo para reservas realizadas por usuarios."""
+    __table_args__ = (
+        db.Index('ix_reserva_empresa_fecha_venta', 'empresa_id', 'fecha_venta'),
+        # Colas de postventa y marketing: pendientes por estado, en orden de vencimiento
+        db.Index('ix_reserva_postventa_fecha_fin_viaje', 'postventa', 'fecha_fin_viaje'),
+        db.Index('ix_reserva_opinion_fecha_viaje', 'opinion', 'fecha_viaje'),
+        # Cobranza antes del viaje: solo las reservas impagas, en orden de salida
+        db.Index('ix_reserva_impaga_fecha_viaje', 'fecha_viaje',
+                 postgresql_where=db.text(RESERVA_IMPAGA_SQL), sqlite_where=db.text(RESERVA_IMPAGA_SQL)),
+        # Los ids no se reutilizan al archivar (SQLite reutiliza el mayor rowid borrado sin AUTOINCREMENT)
+        {'sqlite_autoincrement': True},
+    )
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
     fecha_viaje = db.Column(db.Date, nullable=True, index=True)
@@ -155,7 +495,7 @@ class Reserva(db.Model):
     telefono_pasajero = db.Column(db.String(100), index=True)
     mail_pasajero = db.Column(db.String(100), index=True)
     precio_venta_total = db.Column(db.Numeric(12,2), default=Decimal('0.00'), index=True)
-    precio_venta_neto = db.Column(db.Numeric(12,2), default=Decimal('0.00'), index=True)
+    precio_venta_neto = db.Column(db.Numeric(12,2), db.Computed(EXPRESION_TOTAL_NETO, persisted=True), index=True)
     hotel_neto = db.Column(db.Numeric(12,2), default=Decimal('0.00'), index=True)
     vuelo_neto = db.Column(db.Numeric(12,2), default=Decimal('0.00'), index=True)
     traslado_neto = db.Column(db.Numeric(12,2), default=Decimal('0.00'), index=True)
@@ -164,7 +504,7 @@ class Reserva(db.Model):
     crucero_neto = db.Column(db.Numeric(12,2), default=Decimal('0.00'), index=True)
     excursion_neto = db.Column(db.Numeric(12,2), default=Decimal('0.00'), index=True)
     paquete_neto = db.Column(db.Numeric(12,2), default=Decimal('0.00'), index=True)
-    ganancia_total =  db.Column(db.Numeric(12,2), default=Decimal('0.00'), index=True)
+    ganancia_total = db.Column(db.Numeric(12,2), db.Computed(EXPRESION_GANANCIA, persisted=True), index=True)
     comision_ejecutivo = db.Column(db.Numeric(12,2), default=Decimal('0.00'), index=True)
     comision_agencia = db.Column(db.Numeric(12,2), default=Decimal('0.00'), index=True)
     bonos = db.Column(db.Numeric(12,2), default=Decimal('0.00'), index=True)
@@ -184,21 +524,66 @@ class Reserva(db.Model):
     experiencia = db.Column(db.Text, nullable=True)
     seguimiento = db.Column(db.Text, nullable=True)
     usuario = db.relationship('Usuario', backref=db.backref('reservas', lazy=True))
-    empresa_id = db.Column(db.Integer, db.ForeignKey('empresa.id'), nullable=True)
+    empresa_id = db.Column(db.Integer, db.ForeignKey('empresa.id'), nullable=True, index=True)
     empresa = db.relationship('Empresa', backref=db.backref('reservas', lazy=True))
 
+def columnas_archivo(tabla):
+    """Copia las columnas de `tabla` para su tabla de archivo (los Enum pasan a texto y sin índices)."""
+    columnas = []
+    for col in tabla.columns:
+        tipo = db.String(50) if isinstance(col.type, db.Enum) else col.type
+        claves = [db.ForeignKey(fk.target_fullname) for fk in col.foreign_keys]
+        columnas.append(db.Column(col.name, tipo, *claves, primary_key=col.primary_key,
+                                  nullable=col.nullable, autoincrement=False))
+    return columnas
+
+class ReservaArchivada(db.Model):
+    """Reservas antiguas movidas fuera de la tabla reserva. Mismas columnas; solo lectura."""
+    __table__ = db.Table(
+        'reserva_archivada', db.metadata,
+        *columnas_archivo(Reserva.__table__),
+        db.Column('fecha_archivado', db.DateTime, nullable=False, server_default=db.func.now()),
+        db.Index('ix_reserva_archivada_empresa_fecha_venta', 'empresa_id', 'fecha_venta'),
+        # MAX(fecha_venta) de modelos_reserva en cada reporte: el índice compuesto no sirve sin empresa
+        db.Index('ix_reserva_archivada_fecha_venta', 'fecha_venta'),
+        db.Index('ix_reserva_archivada_fecha_viaje', 'fecha_viaje'),
+        db.Index('ix_reserva_archivada_usuario_id', 'usuario_id'),
+    )
+    usuario = db.relationship('Usuario')
+    empresa = db.relationship('Empresa')
+
+# Búsqueda de texto completo (PostgreSQL): el mismo texto SQL define el índice GIN y la consulta,
+# así el planificador reconoce la expresión indexada. El nombre pesa más (A) que el resto (B).
+def vector_busqueda_sql(principal, *secundarias):
+    resto = " || ' ' || ".join(f"coalesce({col}, '')" for col in secundarias)
+    return (f"setweight(to_tsvector('spanish', coalesce({principal}, '')), 'A') || "
+            f"setweight(to_tsvector('spanish', {resto}), 'B')")
+
+CAMPOS_BUSQUEDA_PROVEEDOR = ('nombre', 'tipo_proveedor', 'servicio', 'condiciones_comerciales', 'donde_opera')
+CAMPOS_BUSQUEDA_CONTRATO = ('nombre', 'descripcion', 'condiciones')
+CAMPOS_BUSQUEDA_CATALOGO = ('nombre', 'descripcion', 'que_incluye')
+VECTOR_BUSQUEDA_PROVEEDOR = vector_busqueda_sql(*CAMPOS_BUSQUEDA_PROVEEDOR)
+VECTOR_BUSQUEDA_CONTRATO = vector_busqueda_sql(*CAMPOS_BUSQUEDA_CONTRATO)
+VECTOR_BUSQUEDA_CATALOGO = vector_busqueda_sql(*CAMPOS_BUSQUEDA_CATALOGO)
+
 class Proveedor(SoftDeleteMixin, db.Model):
     """Modelo para productos ofrecidos por la empresa."""
+    __table_args__ = (
+        db.Index('ix_proveedor_busqueda', db.text(f"({VECTOR_BUSQUEDA_PROVEEDOR})"),
+                 postgresql_using='gin').ddl_if(dialect='postgresql'),
+        *indices_activos('proveedor', ('nombre', 'id'), ('empresa_id', 'nombre', 'id'),
+                         ('tipo_proveedor',), ('fecha_vigencia',)),
+    )
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False, index=True)
     pais_ciudad = db.Column(db.String(100), nullable=True, index=True)
     direccion = db.Column(db.String(200), nullable=True, index=True)
     tipo_proveedor = db.Column(db.String(100), nullable=True, index=True)
-    servicio = db.Column(db.Text, nullable=True, index=True)
+    servicio = db.Column(db.Text, nullable=True)
     contacto_principal_nombre = db.Column(db.String(100), nullable=True, index=True)
     contacto_principal_email = db.Column(db.String(100), nullable=True, index=True)
     contacto_principal_telefono = db.Column(db.String(100), nullable=True, index=True)
-    condiciones_comerciales = db.Column(db.Text, nullable=True, index=True)
+    condiciones_comerciales = db.Column(db.Text, nullable=True)
     donde_opera = db.Column(db.String(100), nullable=True, index=True)
     ultima_negociacion = db.Column(db.Date, nullable=True, index=True)
     fecha_vigencia = db.Column(db.Date, nullable=True, index=True)
@@ -208,37 +593,53 @@ class Proveedor(SoftDeleteMixin, db.Model):
 
 class Contrato(SoftDeleteMixin, db.Model):
     """Modelo para contratos asociados a proveedor."""
+    __table_args__ = (
+        db.Index('ix_contrato_busqueda', db.text(f"({VECTOR_BUSQUEDA_CONTRATO})"),
+                 postgresql_using='gin').ddl_if(dialect='postgresql'),
+        *indices_activos('contrato', ('nombre', 'id'), ('proveedor_id',), ('fecha_fin',)),
+    )
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False, index=True)
-    descripcion = db.Column(db.Text, nullable=True, index=True)
+    descripcion = db.Column(db.Text, nullable=True)
     fecha_inicio = db.Column(db.Date, nullable=True, index=True)
     fecha_fin = db.Column(db.Date, nullable=True, index=True)
     estado = db.Column(db.Enum(*ESTADO_OPTIONS, name='estado_contrato'), default='Activo')
-    condiciones = db.Column(db.Text, nullable=True, index=True)
+    condiciones = db.Column(db.Text, nullable=True)
     comprobante_venta = db.Column(db.String(200))
     comprobante_pdf = db.Column(db.LargeBinary)
+    tiene_comprobante = db.column_property(comprobante_pdf.isnot(None))
     proveedor_id = db.Column(db.Integer, db.ForeignKey('proveedor.id'), nullable=False)
     proveedor = db.relationship('Proveedor', backref=db.backref('contratos', lazy=True))
 
 class Catalogo(SoftDeleteMixin, db.Model):
     """Modelo para catálogos de proveedor."""
+    __table_args__ = (
+        db.Index('ix_catalogo_busqueda', db.text(f"({VECTOR_BUSQUEDA_CATALOGO})"),
+                 postgresql_using='gin').ddl_if(dialect='postgresql'),
+        *indices_activos('catalogo', ('nombre', 'id'), ('proveedor_id',), ('fecha_fin',)),
+    )
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False, index=True)
-    descripcion = db.Column(db.Text, nullable=True, index=True)
+    descripcion = db.Column(db.Text, nullable=True)
     fecha_inicio = db.Column(db.Date, nullable=True, index=True)
     fecha_fin = db.Column(db.Date, nullable=True, index=True)
     estado = db.Column(db.Enum(*ESTADO_OPTIONS, name='estado_catalogo'), default='Activo')
     costo_base = db.Column(db.Numeric(12, 2), default=Decimal('0.00'), index=True)
     precio_venta_sugerido = db.Column(db.Numeric(12, 2), default=Decimal('0.00'), index=True)
     comision_estimada = db.Column(db.Numeric(12,2), default=Decimal('0.00'), index=True)
-    que_incluye = db.Column(db.Text, nullable=True, index=True)
+    que_incluye = db.Column(db.Text, nullable=True)
     comprobante_venta = db.Column(db.String(200))
     comprobante_pdf = db.Column(db.LargeBinary)
+    tiene_comprobante = db.column_property(comprobante_pdf.isnot(None))
     proveedor_id = db.Column(db.Integer, db.ForeignKey('proveedor.id'), nullable=False)
     proveedor = db.relationship('Proveedor', backref=db.backref('catalogos', lazy=True))
 
 class Factura(db.Model):
     """Modelo para facturas mensuales de empresas."""
+    __table_args__ = (
+        # Búsqueda de la factura de cada empresa en un mes (generación mensual, conciliación)
+        db.Index('ix_factura_empresa_mes', 'empresa_id', 'mes'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     empresa_id = db.Column(db.Integer, db.ForeignKey('empresa.id'), nullable=False)
     empresa = db.relationship('Empresa', backref=db.backref('facturas', lazy=True))
@@ -249,6 +650,103 @@ class Factura(db.Model):
     metodo_pago = db.Column(db.String(50), nullable=True, index=True)
     observaciones = db.Column(db.Text, nullable=True, index=True)
 
+class Liquidacion(db.Model):
+    """Modelo para liquidaciones cerradas (snapshot por usuario y periodo)."""
+    __table_args__ = (db.UniqueConstraint('usuario_id', 'periodo', name='uq_liquidacion_usuario_periodo'),)
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False, index=True)
+    usuario = db.relationship('Usuario', backref=db.backref('liquidaciones', lazy=True))
+    empresa_id = db.Column(db.Integer, db.ForeignKey('empresa.id'), nullable=True, index=True)
+    periodo = db.Column(db.String(7), nullable=False, index=True)  # YYYY-MM
+    num_reservas = db.Column(db.Integer, default=0)
+    precio_venta_total = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    honorarios_brutos = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    sueldo = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    bonos = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    descuentos = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    retencion_sii = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    total_liquido = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    boleta_sii = db.Column(db.String(50), nullable=True)
+    fecha_cierre = db.Column(db.DateTime, default=datetime.now)
+
+    def montos(self):
+        """Devuelve los montos de la liquidación con las mismas claves que calcular_liquidacion."""
+        return {
+            'num_reservas': self.num_reservas or 0,
+            'precio_venta_total': self.precio_venta_total or Decimal('0'),
+            'honorarios_brutos': self.honorarios_brutos or Decimal('0'),
+            'sueldo': self.sueldo or Decimal('0'),
+            'bonos': self.bonos or Decimal('0'),
+            'descuentos': self.descuentos or Decimal('0'),
+            'retencion_sii': self.retencion_sii or Decimal('0'),
+            'total_liquido': self.total_liquido or Decimal('0'),
+        }
+
+class CierreMes(db.Model):
+    """Modelo para el cierre mensual de una empresa (snapshot inmutable de sus reportes)."""
+    __table_args__ = (db.UniqueConstraint('empresa_id', 'periodo', name='uq_cierre_mes_empresa_periodo'),)
+    id = db.Column(db.Integer, primary_key=True)
+    empresa_id = db.Column(db.Integer, db.ForeignKey('empresa.id'), nullable=False, index=True)
+    empresa = db.relationship('Empresa', backref=db.backref('cierres', lazy=True))
+    periodo = db.Column(db.String(7), nullable=False, index=True)  # YYYY-MM
+    fecha_cierre = db.Column(db.DateTime, default=datetime.now)
+    cerrado_por_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=True)
+    # Contadores de estados_de_venta
+    num_ventas = db.Column(db.Integer, default=0)
+    num_ventas_cobradas = db.Column(db.Integer, default=0)
+    num_ventas_emitidas = db.Column(db.Integer, default=0)
+    num_ventas_pagadas = db.Column(db.Integer, default=0)
+    # Línea del balance_mensual
+    precio_venta_neto = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    ingresos_agentes = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    egresos_comision = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    detalles = db.relationship('CierreMesDetalle', backref='cierre', lazy=True, order_by='CierreMesDetalle.id')
+    ranking = db.relationship('CierreMesRanking', backref='cierre', lazy=True, order_by='CierreMesRanking.id')
+
+class CierreMesDetalle(db.Model):
+    """Modelo para las filas de reserva congeladas en un cierre mensual."""
+    id = db.Column(db.Integer, primary_key=True)
+    cierre_id = db.Column(db.Integer, db.ForeignKey('cierre_mes.id'), nullable=False, index=True)
+    reserva_id = db.Column(db.Integer, nullable=True)
+    ejecutivo = db.Column(db.String(200))
+    producto = db.Column(db.String(100))
+    destino = db.Column(db.String(100))
+    localizadores = db.Column(db.Text, nullable=True)
+    nombre_pasajero = db.Column(db.String(100))
+    telefono_pasajero = db.Column(db.String(100))
+    mail_pasajero = db.Column(db.String(100))
+    fecha_viaje = db.Column(db.Date, nullable=True)
+    estado_pago = db.Column(db.String(20))
+    venta_cobrada = db.Column(db.String(20))
+    venta_emitida = db.Column(db.String(20))
+    precio_venta_total = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    hotel_neto = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    vuelo_neto = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    traslado_neto = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    seguro_neto = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    circuito_neto = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    crucero_neto = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    excursion_neto = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    paquete_neto = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    bonos = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    ganancia_total = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    comision_ejecutivo = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+    comision_agencia = db.Column(db.Numeric(12, 2), default=Decimal('0.00'))
+
+class CierreMesRanking(db.Model):
+    """Modelo para el ranking de ejecutivos congelado en un cierre mensual."""
+    id = db.Column(db.Integer, primary_key=True)
+    cierre_id = db.Column(db.Integer, db.ForeignKey('cierre_mes.id'), nullable=False, index=True)
+    ejecutivo = db.Column(db.String(200))
+    correo_ejecutivo = db.Column(db.String(100))
+    rol_ejecutivo = db.Column(db.String(20))
+    num_ventas = db.Column(db.Integer, default=0)
+    total_ventas = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    total_costos = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    total_comisiones = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    total_bonos = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    total_ganancia = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+
 # =====================
 # LOGIN MANAGER Y DECORADORES
 # =====================
@@ -272,6 +770,11 @@ def inject_global_functions():
         empresa_seleccionada=empresa_seleccionada
     )
 
+def lectura_en_replica(f):
+    """Marca una vista de solo lectura: sus consultas GET van a la réplica si está disponible."""
+    f.lectura_en_replica = True
+    return f
+
 def rol_required(*roles):
     def decorator(f):
         @wraps(f)
@@ -459,6 +962,8 @@ def editar_usuario_existente(usuario, form, usuario_actual):
     usuario.correo_personal = form.get('correo_personal', '').strip()
     usuario.correo = form['correo'].strip()
     usuario.direccion = form.get('direccion', '').strip()
+    comision_cambio = safe_decimal(usuario.comision) != safe_decimal(comision)
+    empresa_cambio = usuario.empresa_id != empresa_id
     usuario.comision = comision
     usuario.sueldo = safe_decimal(form.get('sueldo', '0').strip())
     usuario.rol = rol_nuevo
@@ -467,6 +972,10 @@ def editar_usuario_existente(usuario, form, usuario_actual):
     usuario.estado = form.get('estado', 'Activo').strip()
     usuario.empresa_id = empresa_id
     db.session.commit()
+    if empresa_cambio:
+        asignar_empresa_reservas(usuario.id)
+    if comision_cambio:
+        recalcular_comisiones_reservas(usuario.id)
     return True, "Usuario modificado correctamente."
 
 def puede_eliminar_usuario(usuario):
@@ -541,110 +1050,111 @@ def safe_decimal(val):
     except Exception:
         return Decimal('0.00')
 
+FORMATOS_FECHA_FORMULARIO = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d')
+
+def parsear_fecha_formulario(valor):
+    """Convierte una fecha de formulario (varios formatos aceptados) a date, o None si no es válida."""
+    valor = (valor or '').strip()
+    if not valor:
+        return None
+    # Camino rápido: los <input type="date"> siempre envían AAAA-MM-DD
+    if len(valor) == 10 and valor[4] == '-' and valor[7] == '-':
+        try:
+            return datetime.fromisoformat(valor).date()
+        except ValueError:
+            pass
+    for fmt in FORMATOS_FECHA_FORMULARIO:
+        try:
+            return datetime.strptime(valor, fmt).date()
+        except Exception:
+            continue
+    return None
+
+class PlanFormulario:
+    """
+    Cómo se copia un formulario a un modelo, calculado una sola vez por modelo: columnas de monto,
+    de texto y de fecha con su conversor, opciones de los Enum y largo máximo de los String.
+    """
+    __slots__ = ('modelo', 'numericos', 'textos', 'fechas', 'opciones', 'largos', 'asignaciones')
+
+    def __init__(self, modelo, exclude=(), date_fields=()):
+        columnas = [col for col in modelo.__table__.columns if col.name not in exclude]
+        self.modelo = modelo
+        self.numericos = tuple(col.name for col in columnas if isinstance(col.type, (db.Float, db.Numeric)))
+        self.textos = tuple(col.name for col in columnas if isinstance(col.type, (db.String, db.Text, db.Enum)))
+        self.fechas = tuple(date_fields)
+        self.opciones = {col.name: tuple(col.type.enums) for col in columnas if isinstance(col.type, db.Enum)}
+        self.largos = {col.name: col.type.length for col in columnas
+                       if isinstance(col.type, db.String) and col.type.length}
+        # (campo, conversor, valor si falta); las fechas van al final y pisan a un texto homónimo
+        self.asignaciones = (
+            tuple((campo, safe_decimal, 0) for campo in self.numericos)
+            + tuple((campo, str.strip, '') for campo in self.textos)
+            + tuple((campo, parsear_fecha_formulario, '') for campo in self.fechas)
+        )
+
+    def valores(self, form):
+        """Valores ya convertidos del formulario, sin tocar ningún objeto (sirve para lotes)."""
+        get = form.get
+        return {campo: convertir(get(campo, defecto)) for campo, convertir, defecto in self.asignaciones}
+
+    def aplicar(self, obj, form):
+        for campo, valor in self.valores(form).items():
+            setattr(obj, campo, valor)
+
+_planes_formulario = {}
+
+def plan_formulario(modelo, exclude=None, date_fields=None):
+    """PlanFormulario del modelo para esas exclusiones y fechas (se calcula la primera vez)."""
+    clave = (modelo, frozenset(exclude or ()), tuple(date_fields or ()))
+    plan = _planes_formulario.get(clave)
+    if plan is None:
+        plan = _planes_formulario.setdefault(clave, PlanFormulario(modelo, clave[1], clave[2]))
+    return plan
+
 def get_campos_por_tipo():
     """Devuelve los campos de Reserva agrupados por tipo."""
-    float_types = (db.Float, db.Numeric)
-    str_types = (db.String, db.Text, db.Enum)
-    campos_float = []
-    campos_str = []
-    for col in Reserva.__table__.columns:
-        if isinstance(col.type, float_types):
-            campos_float.append(col.name)
-        elif isinstance(col.type, str_types):
-            campos_str.append(col.name)
-    return campos_float, campos_str
+    plan = plan_formulario(Reserva)
+    return list(plan.numericos), list(plan.textos)
 
 def set_model_fields(obj, form, exclude=None, date_fields=None, handle_pdf=False):
-    if exclude is None:
-        exclude = set()
-    if date_fields is None:
-        date_fields = []
-
-    # Detecta tipos de campos
-    float_types = (db.Float, db.Numeric)
-    str_types = (db.String, db.Text, db.Enum)
-    campos_float = []
-    campos_str = []
-    for col in obj.__table__.columns:
-        if col.name in exclude:
-            continue
-        if isinstance(col.type, float_types):
-            campos_float.append(col.name)
-        elif isinstance(col.type, str_types):
-            campos_str.append(col.name)
-
-    for campo in campos_float:
-        valor = safe_decimal(form.get(campo, 0))
-        setattr(obj, campo, valor)
-
-    for campo in campos_str:
-        setattr(obj, campo, form.get(campo, '').strip())
-
-    # Manejo especial para campos de fecha
-    for campo_fecha in date_fields:
-        fecha_val = form.get(campo_fecha, '').strip()
-        fecha_date = None
-        if fecha_val:
-            for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d'):
-                try:
-                    fecha_date = datetime.strptime(fecha_val, fmt).date()
-                    break
-                except Exception:
-                    continue
-        setattr(obj, campo_fecha, fecha_date)
+    plan_formulario(type(obj), exclude, date_fields).aplicar(obj, form)
+
+EXCLUIDOS_PRODUCTO = {'id', 'producto_id', 'producto', 'comprobante_pdf'}
+PLAN_RESERVA = plan_formulario(
+    Reserva,
+    exclude={'empresa_id', 'usuario_id', 'usuario', 'comprobante_pdf', 'comprobante_venta',
+             'comision_ejecutivo', 'comision_agencia', 'ganancia_total', 'precio_venta_neto'},
+    date_fields=['fecha_venta', 'fecha_fin_viaje', 'fecha_viaje']
+)
+PLAN_PROVEEDOR = plan_formulario(Proveedor, exclude={'id', 'empresa_id', 'empresa'}, date_fields=['fecha_venta'])
+PLAN_CONTRATO = plan_formulario(Contrato, exclude=EXCLUIDOS_PRODUCTO, date_fields=['fecha_venta'])
+PLAN_CATALOGO = plan_formulario(Catalogo, exclude=EXCLUIDOS_PRODUCTO, date_fields=['fecha_venta', 'mes'])
+PLAN_FACTURA = plan_formulario(Factura, exclude={'id', 'empresa_id', 'empresa'}, date_fields=['fecha_pago', 'mes'])
 
 def set_reserva_fields(reserva, form):
-    # Cálculo de comisiones antes de setear campos
-    if reserva.usuario:
-        comision_ejecutivo, comision_agencia, ganancia_total, _, precio_venta_neto = calcular_comisiones(reserva, reserva.usuario)
-        reserva.comision_ejecutivo = comision_ejecutivo
-        reserva.comision_agencia = comision_agencia
-        reserva.ganancia_total = ganancia_total
-        reserva.precio_venta_neto = precio_venta_neto
-    else:
+    if not reserva.usuario:
         flash('Error: La reserva no tiene un usuario asociado.', 'danger')
         return
-    set_model_fields(
-        reserva,
-        form,
-        exclude={'empresa_id', 'usuario_id', 'usuario', 'comprobante_pdf', 'comprobante_venta'},
-        date_fields=['fecha_venta', 'fecha_fin_viaje', 'fecha_viaje'],
-        handle_pdf=True
-    )
+    PLAN_RESERVA.aplicar(reserva, form)
+    reserva.empresa_id = reserva.usuario.empresa_id
+    # Cálculo de comisiones con los montos ya actualizados; los reportes leen estos valores guardados.
+    # precio_venta_neto y ganancia_total los calcula la base de datos.
+    comision_ejecutivo, comision_agencia, _, _, _ = calcular_comisiones(reserva, reserva.usuario)
+    reserva.comision_ejecutivo = comision_ejecutivo
+    reserva.comision_agencia = comision_agencia
 
 def set_proveedor_fields(proveedor, form):
-    set_model_fields(
-        proveedor,
-        form,
-        exclude={'id', 'empresa_id', 'empresa'},
-        date_fields=['fecha_venta']
-    )
+    PLAN_PROVEEDOR.aplicar(proveedor, form)
 
 def set_contrato_fields(contrato, form):
-    set_model_fields(
-        contrato,
-        form,
-        exclude={'id', 'producto_id', 'producto', 'comprobante_pdf'},
-        date_fields=['fecha_venta'],
-        handle_pdf=True
-    )
+    PLAN_CONTRATO.aplicar(contrato, form)
 
 def set_catalogo_fields(catalogo, form):
-    set_model_fields(
-        catalogo,
-        form,
-        exclude={'id', 'producto_id', 'producto', 'comprobante_pdf'},
-        date_fields=['fecha_venta', 'mes'],
-        handle_pdf=True
-    )
+    PLAN_CATALOGO.aplicar(catalogo, form)
 
 def set_factura_fields(factura, form):
-    set_model_fields(
-        factura,
-        form,
-        exclude={'id', 'empresa_id', 'empresa'},
-        date_fields=['fecha_pago', 'mes']
-    )
+    PLAN_FACTURA.aplicar(factura, form)
 
 def allowed_file(filename):
     """Verifica si el archivo tiene una extensión permitida (actualmente solo PDF)."""
@@ -679,6 +1189,89 @@ def guardar_comprobante(file, objeto):
         return nombre_final, contenido_binario, None
     return None, None, None
 
+_version_plantillas = {}
+
+def version_plantilla(nombre_plantilla):
+    """Devuelve un hash corto del código fuente de una plantilla (cambia si la plantilla se modifica)."""
+    if nombre_plantilla not in _version_plantillas or app.debug:
+        source, _, _ = app.jinja_loader.get_source(app.jinja_env, nombre_plantilla)
+        _version_plantillas[nombre_plantilla] = hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+    return _version_plantillas[nombre_plantilla]
+
+def clave_cache_liquidacion_pdf(datos, reservas):
+    """
+    Calcula la clave de caché de un PDF de liquidación.
+    Incluye la versión de la plantilla, todos los valores renderizados y la huella
+    de las reservas del periodo, de modo que cualquier cambio genera una clave nueva.
+    """
+    usuario = datos['usuario']
+    empresa = datos['empresa']
+    huella = {
+        'plantilla': version_plantilla('liquidacion_pdf.html'),
+        'periodo': datos['periodo'],
+        'boleta_sii': datos['boleta_sii'],
+        'fecha_pago': datos['fecha_pago'],
+        'honorarios_brutos': str(datos['honorarios_brutos']),
+        'sueldo': str(datos['sueldo']),
+        'bonos': str(datos['bonos']),
+        'descuentos': str(datos['descuentos']),
+        'retencion_sii': str(datos['retencion_sii']),
+        'total_liquido': str(datos['total_liquido']),
+        'usuario': [usuario.id, usuario.rut, usuario.nombre, usuario.apellidos,
+                    usuario.banco, usuario.cuenta_bancaria],
+        'empresa': [empresa.id, empresa.logo, empresa.nombre, empresa.razon_social,
+                    empresa.direccion] if empresa else None,
+        'reservas': sorted(
+            [r.id, str(r.comision_ejecutivo), str(r.bonos), str(r.fecha_venta)] for r in reservas
+        ),
+    }
+    contenido = json.dumps(huella, sort_keys=True, default=str)
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+def leer_cache_liquidacion_pdf(clave):
+    """Devuelve el PDF cacheado (bytes) o None. Marca el archivo como usado recientemente."""
+    ruta = os.path.join(app.config['LIQUIDACION_PDF_CACHE_DIR'], f"{clave}.pdf")
+    try:
+        with open(ruta, 'rb') as f:
+            contenido = f.read()
+        os.utime(ruta, None)
+        return contenido
+    except OSError:
+        return None
+
+def guardar_cache_liquidacion_pdf(clave, contenido):
+    """Guarda el PDF en la caché y aplica la evicción LRU por tamaño."""
+    directorio = app.config['LIQUIDACION_PDF_CACHE_DIR']
+    ruta = os.path.join(directorio, f"{clave}.pdf")
+    ruta_tmp = f"{ruta}.{os.getpid()}.tmp"
+    try:
+        with open(ruta_tmp, 'wb') as f:
+            f.write(contenido)
+        os.replace(ruta_tmp, ruta)
+    except OSError as e:
+        print(f"Error al guardar PDF en caché: {e}")
+        return
+    podar_cache_liquidacion_pdf()
+
+def podar_cache_liquidacion_pdf():
+    """Elimina los PDFs usados hace más tiempo hasta quedar bajo el tamaño máximo configurado."""
+    directorio = app.config['LIQUIDACION_PDF_CACHE_DIR']
+    max_bytes = app.config['LIQUIDACION_PDF_CACHE_MAX_BYTES']
+    archivos = []
+    for entrada in os.scandir(directorio):
+        if entrada.is_file() and entrada.name.endswith('.pdf'):
+            stat = entrada.stat()
+            archivos.append((stat.st_mtime, stat.st_size, entrada.path))
+    total = sum(tamano for _, tamano, _ in archivos)
+    for _, tamano, ruta in sorted(archivos):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(ruta)
+            total -= tamano
+        except OSError:
+            continue
+
 def send_reset_email(user, reset_url):
     msg = Message("Restablecer contraseña", sender=app.config['MAIL_USERNAME'], recipients=[user.correo])
     msg.body = f'''Hola {user.username},
@@ -755,19 +1348,9 @@ def obtener_datos_reporte_detalle_ventas(selected_mes_str):
         ejecutivo_id = reserva.nombre_ejecutivo or ''
         correo_ejecutivo = reserva.correo_ejecutivo or ''
         rol_ejecutivo = reserva.usuario.rol
-        comision_ejecutivo_porcentaje = safe_decimal(reserva.usuario.comision) / Decimal('100.0')
-        total_neto = (
-            reserva.hotel_neto +
-            reserva.vuelo_neto +
-            reserva.traslado_neto +
-            reserva.seguro_neto +
-            reserva.circuito_neto +
-            reserva.crucero_neto +
-            reserva.excursion_neto +
-            reserva.paquete_neto
-        )
-        ganancia_bruta = reserva.precio_venta_total - total_neto
-        comision_usuario = ganancia_bruta * comision_ejecutivo_porcentaje
+        total_neto = reserva.precio_venta_neto or Decimal('0')
+        ganancia_bruta = reserva.ganancia_total or Decimal('0')
+        comision_usuario = reserva.comision_ejecutivo or Decimal('0')
         ganancia_neta = ganancia_bruta - comision_usuario
         bonos = reserva.bonos or 0.0
 
@@ -844,17 +1427,12 @@ def obtener_datos_control_gestion_clientes(selected_mes_str, selected_empresa_id
         today = datetime.now()
         year, month = today.year, today.month
         selected_mes_str = today.strftime('%Y-%m')
-    reservas_query = Reserva.query.join(Usuario)
-    reservas_query = reservas_query.filter(
-        db.extract('year', Reserva.fecha_viaje) == year,
-        db.extract('month', Reserva.fecha_viaje) == month,
-        Usuario.rol.in_(['ejecutivo', 'analista', 'controling'])
+    empresa_id = selected_empresa_id if current_user.rol in ['master', 'admin'] else None
+    reservas = reservas_del_periodo(
+        empresa_id, year, month, roles=['ejecutivo', 'analista', 'controling'], campo_fecha='fecha_viaje',
+        usuario_id=selected_ejecutivo_id
     )
-    if selected_empresa_id and current_user.rol in ['master', 'admin']:
-        reservas_query = reservas_query.filter(Usuario.empresa_id == int(selected_empresa_id))
-    if selected_ejecutivo_id:
-        reservas_query = reservas_query.filter(Reserva.usuario_id == selected_ejecutivo_id)
-    reservas = reservas_query.order_by(Reserva.fecha_venta.desc()).all()
+    reservas.sort(key=lambda r: r.fecha_venta or datetime.min.date(), reverse=True)
     return {
         "reservas": reservas,
         "empresas": empresas,
@@ -894,31 +1472,21 @@ def obtener_datos_ranking_ejecutivos(selected_mes_str, selected_empresa_id, empr
         today = datetime.now()
         start_date, end_date = today, today
 
-    reservas_query = Reserva.query.join(Usuario).filter(
-        Reserva.fecha_venta >= start_date.strftime('%Y-%m-%d'),
-        Reserva.fecha_venta <= end_date.strftime('%Y-%m-%d')
-    )
-    if selected_empresa_id:
-        reservas_query = reservas_query.filter(Usuario.empresa_id == int(selected_empresa_id))
+    reservas = []
+    for modelo in modelos_reserva('fecha_venta', start_date.date()):
+        reservas.extend(reservas_de_empresa(selected_empresa_id, modelo=modelo).filter(
+            modelo.fecha_venta >= start_date.strftime('%Y-%m-%d'),
+            modelo.fecha_venta <= end_date.strftime('%Y-%m-%d')
+        ).all())
 
     reporte_data_dict = {}
-    for reserva in reservas_query.all():
+    for reserva in reservas:
         ejecutivo_id = reserva.nombre_ejecutivo or ''
         correo_ejecutivo = reserva.correo_ejecutivo or ''
         rol_ejecutivo = reserva.usuario.rol
-        comision_ejecutivo_porcentaje = safe_decimal(reserva.usuario.comision) / Decimal('100.0')
-        total_neto = (
-            reserva.hotel_neto +
-            reserva.vuelo_neto +
-            reserva.traslado_neto +
-            reserva.seguro_neto +
-            reserva.circuito_neto +
-            reserva.crucero_neto +
-            reserva.excursion_neto +
-            reserva.paquete_neto
-        )
-        ganancia_bruta = reserva.precio_venta_total - total_neto
-        comision_usuario = ganancia_bruta * comision_ejecutivo_porcentaje
+        total_neto = reserva.precio_venta_neto or Decimal('0')
+        ganancia_bruta = reserva.ganancia_total or Decimal('0')
+        comision_usuario = reserva.comision_ejecutivo or Decimal('0')
         ganancia_neta = ganancia_bruta - comision_usuario
         bonos = reserva.bonos or 0.0
 
@@ -961,49 +1529,692 @@ def obtener_datos_ranking_ejecutivos(selected_mes_str, selected_empresa_id, empr
         'selected_empresa_id': selected_empresa_id
     }
 
-def obtener_datos_postventa(empresas, selected_postventa):
-    reservas_query = Reserva.query
-    # Filtrar por postventa si se selecciona
-    if selected_postventa:
-        reservas_query = reservas_query.filter(Reserva.postventa == selected_postventa)
-    reservas = reservas_query.order_by(Reserva.fecha_viaje.desc()).all()
-    reservas_data = []
-    for r in reservas:
-        reservas_data.append({
-            'id': r.id,
-            'nombre_pasajero': r.nombre_pasajero,
-            'destino': r.destino,
-            'fecha_viaje': r.fecha_viaje,
-            'telefono_pasajero': r.telefono_pasajero,
-            'mail_pasajero': r.mail_pasajero,
-            'postventa': getattr(r, 'postventa', ''),
-            'estado_postventa': getattr(r, 'estado_postventa', ''),
-            'seguimiento': getattr(r, 'seguimiento', ''),
-        })
+# Cola -> (campo de estado, fecha desde la que corre el plazo, columnas que muestra la lista)
+COLAS_SEGUIMIENTO = {
+    'postventa': ('postventa', 'fecha_fin_viaje', (
+        'nombre_pasajero', 'destino', 'fecha_viaje', 'fecha_fin_viaje', 'telefono_pasajero',
+        'mail_pasajero', 'postventa', 'estado_postventa', 'seguimiento')),
+    'marketing': ('opinion', 'fecha_viaje', (
+        'nombre_pasajero', 'destino', 'fecha_viaje', 'telefono_pasajero', 'mail_pasajero',
+        'opinion', 'experiencia')),
+}
+COLA_POR_PAGINA = 50
+
+def cola_seguimiento(cola, estado=None, dias=0, empresa_id=None, cursor=None, limite=COLA_POR_PAGINA):
+    """
+    Reservas de la cola de postventa o marketing cuyo plazo venció: la fecha de la cola
+    (fin de viaje o inicio de viaje) quedó hace al menos `dias` días. Se ordenan de la más
+    atrasada a la más reciente por (fecha, id) y se paginan por cursor, de modo que cada página
+    recorre solo su tramo del índice (estado, fecha) y no carga el resto de la tabla.
+    Devuelve (reservas, cursor de la página siguiente o None).
+    """
+    campo_estado, campo_fecha, columnas = COLAS_SEGUIMIENTO[cola]
+    columna_fecha = getattr(Reserva, campo_fecha)
+    vence = datetime.now().date() - timedelta(days=dias)
+    consulta = Reserva.query.options(
+        db.load_only(*(getattr(Reserva, c) for c in columnas))
+    ).filter(columna_fecha <= vence)
+    if estado:
+        consulta = consulta.filter(getattr(Reserva, campo_estado) == estado)
+    if empresa_id:
+        consulta = consulta.filter(Reserva.empresa_id == empresa_id)
+    if cursor:
+        fecha, ultimo_id = serializer.loads(cursor, salt=f'cursor-{cola}')
+        fecha = datetime.strptime(fecha, '%Y-%m-%d').date()
+        consulta = consulta.filter(db.tuple_(columna_fecha, Reserva.id) > (fecha, ultimo_id))
+    reservas = consulta.order_by(columna_fecha, Reserva.id).limit(limite + 1).all()
+    siguiente = None
+    if len(reservas) > limite:
+        reservas = reservas[:limite]
+        ultima = reservas[-1]
+        siguiente = serializer.dumps([getattr(ultima, campo_fecha).isoformat(), ultima.id], salt=f'cursor-{cola}')
+    return reservas, siguiente
+
+def filtros_cola_desde_request(clave_dias):
+    """
+    (dias, empresa_id) de la URL para las colas de postventa y marketing: los días se acotan a
+    0-365 y la empresa solo la eligen master/admin; un empresa_id no numérico se ignora.
+    """
+    dias = min(max(request.args.get('dias', app.config[clave_dias], type=int), 0), 365)
+    selected_empresa_id = request.args.get('empresa_id', '').strip() if current_user.rol in ['master', 'admin'] else ''
+    return dias, selected_empresa_id if selected_empresa_id.isdigit() else ''
+
+def datos_cola_seguimiento(cola, empresas, estado, dias, selected_empresa_id, cursor):
+    """Contexto común de las plantillas de postventa y marketing. estado='todas' no filtra por estado."""
+    campo_estado = COLAS_SEGUIMIENTO[cola][0]
+    reservas, siguiente = cola_seguimiento(
+        cola, None if estado == 'todas' else estado, dias,
+        empresa_en_alcance(selected_empresa_id), cursor
+    )
+    filtros = {campo_estado: estado, 'dias': dias}
+    if selected_empresa_id:
+        filtros['empresa_id'] = selected_empresa_id
     return {
-        'reservas': reservas_data,
+        'reservas': reservas,
+        'siguiente': siguiente,
+        'filtros': filtros,
         'empresas': empresas,
-        'selected_postventa': selected_postventa,
+        'selected_empresa_id': selected_empresa_id,
+        'dias': dias,
     }
 
+def obtener_datos_postventa(empresas, selected_postventa, dias, selected_empresa_id='', cursor=None):
+    contexto = datos_cola_seguimiento('postventa', empresas, selected_postventa, dias, selected_empresa_id, cursor)
+    contexto['selected_postventa'] = selected_postventa
+    return contexto
+
 
 def calcular_comisiones(reserva, usuario):
+    """Misma fórmula que las columnas generadas, para calcular antes de guardar (sin ir a la base)."""
     comision_ejecutivo_porcentaje = safe_decimal(usuario.comision) / Decimal('100.0')
-    precio_venta_neto = (
-        reserva.hotel_neto +
-        reserva.vuelo_neto +
-        reserva.traslado_neto +
-        reserva.seguro_neto +
-        reserva.circuito_neto +
-        reserva.crucero_neto +
-        reserva.excursion_neto +
-        reserva.paquete_neto
-    )
-    ganancia_total = reserva.precio_venta_total - precio_venta_neto
+    precio_venta_neto = sum((safe_decimal(getattr(reserva, col)) for col in COLUMNAS_NETO_RESERVA), Decimal('0'))
+    ganancia_total = safe_decimal(reserva.precio_venta_total) - precio_venta_neto
     comision_ejecutivo = ganancia_total * comision_ejecutivo_porcentaje
     comision_agencia = ganancia_total - comision_ejecutivo
     return comision_ejecutivo, comision_agencia, ganancia_total, comision_ejecutivo_porcentaje, precio_venta_neto
 
+RETENCION_SII = Decimal('0.13')
+
+def obtener_rango_mes(año, mes):
+    """Devuelve (primer día del mes, primer día del mes siguiente) como fechas."""
+    inicio = datetime(año, mes, 1).date()
+    fin = datetime(año + 1, 1, 1).date() if mes == 12 else datetime(año, mes + 1, 1).date()
+    return inicio, fin
+
+def montos_liquidacion(honorarios_brutos, sueldo, bonos, descuentos, precio_venta_total=0, num_reservas=0):
+    """Aplica la retención SII y calcula el total líquido de una liquidación."""
+    honorarios_brutos = safe_decimal(honorarios_brutos)
+    sueldo = safe_decimal(sueldo)
+    bonos = safe_decimal(bonos)
+    descuentos = safe_decimal(descuentos)
+    retencion_sii = Decimal(round((honorarios_brutos + bonos) * RETENCION_SII))
+    return {
+        'num_reservas': num_reservas,
+        'precio_venta_total': safe_decimal(precio_venta_total),
+        'honorarios_brutos': honorarios_brutos,
+        'sueldo': sueldo,
+        'bonos': bonos,
+        'descuentos': descuentos,
+        'retencion_sii': retencion_sii,
+        'total_liquido': honorarios_brutos + sueldo + bonos - descuentos - retencion_sii,
+    }
+
+def calcular_liquidacion(usuario, año, mes, bonos=None, descuentos=None):
+    """
+    Calcula la liquidación de un usuario para un mes a partir de sus reservas.
+    Si no se indican bonos se usan los bonos de las reservas; los descuentos son 0 por defecto.
+    Devuelve (montos, reservas).
+    """
+    inicio, fin = obtener_rango_mes(año, mes)
+    reservas = Reserva.query.filter(
+        Reserva.usuario_id == usuario.id,
+        Reserva.fecha_venta >= inicio,
+        Reserva.fecha_venta < fin
+    ).all()
+    if bonos is None:
+        bonos = sum((r.bonos or Decimal('0') for r in reservas), Decimal('0'))
+    montos = montos_liquidacion(
+        honorarios_brutos=sum((r.comision_ejecutivo or Decimal('0') for r in reservas), Decimal('0')),
+        sueldo=usuario.sueldo or 0,
+        bonos=bonos,
+        descuentos=descuentos or 0,
+        precio_venta_total=sum((r.precio_venta_total or Decimal('0') for r in reservas), Decimal('0')),
+        num_reservas=len(reservas)
+    )
+    return montos, reservas
+
+def obtener_liquidacion_cerrada(usuario_id, periodo):
+    """Devuelve el snapshot de liquidación cerrada para el usuario y periodo, o None."""
+    return Liquidacion.query.filter_by(usuario_id=usuario_id, periodo=periodo).first()
+
+def cerrar_periodo_liquidaciones(año, mes, empresa_id=None, ajustes=None):
+    """
+    Cierra el periodo indicado: guarda un snapshot de liquidación por cada usuario
+    liquidable (ejecutivo, controling, analista) que aún no tenga una.
+    Los montos del mes se agregan en una sola consulta agrupada por usuario.
+    `ajustes` es un dict {usuario_id: {'bonos': ..., 'descuentos': ...}}.
+    Devuelve la cantidad de liquidaciones creadas.
+    """
+    ajustes = ajustes or {}
+    periodo = f"{año:04d}-{mes:02d}"
+    inicio, fin = obtener_rango_mes(año, mes)
+
+    usuarios_query = Usuario.query.filter(Usuario.rol.in_(['ejecutivo', 'controling', 'analista']))
+    if empresa_id:
+        usuarios_query = usuarios_query.filter(Usuario.empresa_id == int(empresa_id))
+    usuarios = usuarios_query.all()
+    if not usuarios:
+        return 0
+
+    ya_cerrados = {
+        uid for (uid,) in db.session.query(Liquidacion.usuario_id).filter(
+            Liquidacion.periodo == periodo,
+            Liquidacion.usuario_id.in_([u.id for u in usuarios])
+        )
+    }
+    agregados = {
+        fila.usuario_id: fila for fila in db.session.query(
+            Reserva.usuario_id,
+            db.func.count(Reserva.id).label('num_reservas'),
+            db.func.coalesce(db.func.sum(Reserva.precio_venta_total), 0).label('precio_venta_total'),
+            db.func.coalesce(db.func.sum(Reserva.comision_ejecutivo), 0).label('honorarios_brutos'),
+            db.func.coalesce(db.func.sum(Reserva.bonos), 0).label('bonos')
+        ).filter(
+            Reserva.fecha_venta >= inicio,
+            Reserva.fecha_venta < fin,
+            Reserva.usuario_id.in_([u.id for u in usuarios])
+        ).group_by(Reserva.usuario_id)
+    }
+
+    creadas = 0
+    for usuario in usuarios:
+        if usuario.id in ya_cerrados:
+            continue
+        fila = agregados.get(usuario.id)
+        ajuste = ajustes.get(usuario.id, {})
+        bonos = ajuste.get('bonos')
+        if bonos in (None, ''):
+            bonos = fila.bonos if fila else 0
+        montos = montos_liquidacion(
+            honorarios_brutos=fila.honorarios_brutos if fila else 0,
+            sueldo=usuario.sueldo or 0,
+            bonos=bonos,
+            descuentos=ajuste.get('descuentos') or 0,
+            precio_venta_total=fila.precio_venta_total if fila else 0,
+            num_reservas=fila.num_reservas if fila else 0
+        )
+        db.session.add(Liquidacion(
+            usuario_id=usuario.id,
+            empresa_id=usuario.empresa_id,
+            periodo=periodo,
+            **montos
+        ))
+        creadas += 1
+    db.session.commit()
+    return creadas
+
+CAMPOS_DETALLE_VENTAS = (
+    'precio_venta_total', 'hotel_neto', 'vuelo_neto', 'traslado_neto', 'seguro_neto',
+    'circuito_neto', 'crucero_neto', 'excursion_neto', 'paquete_neto',
+    'bonos', 'ganancia_total', 'comision_ejecutivo', 'comision_agencia'
+)
+
+def contar_si(condicion):
+    """SUM(CASE WHEN condicion THEN 1 ELSE 0 END), portable entre SQLite y PostgreSQL."""
+    return db.func.coalesce(db.func.sum(db.case((condicion, 1), else_=0)), 0)
+
+def estado_normalizado(columna):
+    """lower(trim(columna)) como texto: cuenta igual los estados guardados con otra capitalización o espacios."""
+    return db.func.lower(db.func.trim(db.cast(columna, db.String)))
+
+def obtener_resumen_ventas_mes(año, mes, empresa_id=None, roles=None):
+    """
+    Totales de dinero y contadores de estado (pagado/cobrada/emitida) de las ventas del mes,
+    calculados en una sola consulta agregada (una más sobre el archivo si el mes lo necesita).
+    """
+    inicio, fin = obtener_rango_mes(año, mes)
+    num_ventas = pagadas = cobradas = emitidas = 0
+    total_ventas = total_costos = comision_ejecutivos = 0.0
+    for modelo in modelos_reserva('fecha_venta', inicio):
+        query = db.session.query(
+            db.func.count(modelo.id).label('num_ventas'),
+            db.func.coalesce(db.func.sum(modelo.precio_venta_total), 0).label('total_ventas'),
+            db.func.coalesce(db.func.sum(modelo.precio_venta_neto), 0).label('total_costos'),
+            db.func.coalesce(db.func.sum(modelo.comision_ejecutivo), 0).label('comision_ejecutivos'),
+            contar_si(estado_normalizado(modelo.estado_pago) == 'pagado').label('pagadas'),
+            contar_si(estado_normalizado(modelo.venta_cobrada) == 'cobrada').label('cobradas'),
+            contar_si(estado_normalizado(modelo.venta_emitida) == 'emitida').label('emitidas')
+        ).filter(
+            modelo.fecha_venta >= inicio,
+            modelo.fecha_venta < fin
+        )
+        if empresa_id:
+            query = query.filter(modelo.empresa_id == int(empresa_id))
+        if roles:
+            query = query.join(Usuario, modelo.usuario_id == Usuario.id).filter(Usuario.rol.in_(roles))
+        fila = query.one()
+        num_ventas += fila.num_ventas or 0
+        total_ventas += float(fila.total_ventas or 0)
+        total_costos += float(fila.total_costos or 0)
+        comision_ejecutivos += float(fila.comision_ejecutivos or 0)
+        pagadas += int(fila.pagadas or 0)
+        cobradas += int(fila.cobradas or 0)
+        emitidas += int(fila.emitidas or 0)
+    return {
+        'num_ventas': num_ventas,
+        'total_ventas': total_ventas,
+        'total_costos': total_costos,
+        'ganancia_total': total_ventas - total_costos,
+        'comision_ejecutivos': comision_ejecutivos,
+        'comision_agencia': total_ventas - total_costos - comision_ejecutivos,
+        'pagadas': pagadas,
+        'cobradas': cobradas,
+        'emitidas': emitidas,
+        'datos_estado_pago': [pagadas, num_ventas - pagadas],
+        'datos_venta_cobrada': [cobradas, num_ventas - cobradas],
+        'datos_venta_emitida': [emitidas, num_ventas - emitidas],
+    }
+
+def obtener_cierre_mes(empresa_id, año, mes):
+    """Devuelve el cierre de la empresa para el mes indicado, o None si el mes sigue abierto."""
+    if not empresa_id:
+        return None
+    return CierreMes.query.filter_by(empresa_id=int(empresa_id), periodo=f"{año:04d}-{mes:02d}").first()
+
+def mes_cerrado(empresa_id, fecha):
+    """Indica si el mes de `fecha` está cerrado para la empresa (las reservas de ese mes no se editan)."""
+    if not empresa_id or not fecha:
+        return False
+    return db.session.query(
+        CierreMes.query.filter_by(empresa_id=empresa_id, periodo=fecha.strftime('%Y-%m')).exists()
+    ).scalar()
+
+def reserva_bloqueada(reserva):
+    """Indica si la reserva pertenece a un mes cerrado de su empresa."""
+    return mes_cerrado(reserva.empresa_id, reserva.fecha_venta)
+
+def empresa_en_alcance(selected_empresa_id):
+    """Empresa a la que se limita un reporte: la seleccionada (master/admin) o la propia (controling)."""
+    if current_user.rol in ['master', 'admin']:
+        return int(selected_empresa_id) if selected_empresa_id else None
+    return current_user.empresa_id
+
+def reservas_de_empresa(empresa_id=None, año=None, mes=None, roles=None, campo_fecha='fecha_venta', modelo=None):
+    """
+    Consulta de reservas de una empresa filtrando directamente por Reserva.empresa_id.
+    Con año y mes agrega el rango [inicio, fin) sobre `campo_fecha`, de modo que la búsqueda
+    por empresa y mes de venta usa el índice (empresa_id, fecha_venta).
+    Solo se une con Usuario cuando hay que filtrar por roles.
+    `modelo` permite consultar ReservaArchivada con los mismos filtros.
+    """
+    modelo = modelo or Reserva
+    query = modelo.query
+    if empresa_id:
+        query = query.filter(modelo.empresa_id == int(empresa_id))
+    if año and mes:
+        inicio, fin = obtener_rango_mes(año, mes)
+        columna = getattr(modelo, campo_fecha)
+        query = query.filter(columna >= inicio, columna < fin)
+    if roles:
+        query = query.join(Usuario, modelo.usuario_id == Usuario.id).filter(Usuario.rol.in_(roles))
+    return query
+
+def modelos_reserva(campo_fecha='fecha_venta', inicio=None):
+    """
+    Modelos a consultar para un periodo que empieza en `inicio`: solo Reserva, o también
+    ReservaArchivada si hay reservas archivadas con `campo_fecha` en o después de `inicio`.
+    """
+    if inicio is None:
+        return [Reserva]
+    maximo = db.session.query(db.func.max(getattr(ReservaArchivada, campo_fecha))).scalar()
+    if maximo is not None and maximo >= inicio:
+        return [Reserva, ReservaArchivada]
+    return [Reserva]
+
+def reservas_del_periodo(empresa_id=None, año=None, mes=None, roles=None, campo_fecha='fecha_venta', usuario_id=None):
+    """Lista de reservas del mes como reservas_de_empresa, sumando el archivo solo si el mes lo necesita."""
+    inicio = obtener_rango_mes(año, mes)[0] if año and mes else None
+    reservas = []
+    for modelo in modelos_reserva(campo_fecha, inicio):
+        query = reservas_de_empresa(empresa_id, año, mes, roles, campo_fecha, modelo=modelo)
+        if usuario_id:
+            query = query.filter(modelo.usuario_id == usuario_id)
+        reservas.extend(query.order_by(modelo.id).all())
+    return reservas
+
+def asignar_empresa_reservas(usuario_id=None):
+    """
+    Copia en Reserva.empresa_id la empresa del usuario dueño de cada reserva
+    (UPDATE ... FROM usuario). Sirve para el relleno inicial y cuando un usuario cambia de empresa.
+    Devuelve la cantidad de reservas actualizadas.
+    """
+    stmt = db.update(Reserva).where(
+        Reserva.usuario_id == Usuario.id,
+        Reserva.empresa_id.is_distinct_from(Usuario.empresa_id)
+    ).values(empresa_id=Usuario.empresa_id).execution_options(synchronize_session=False)
+    if usuario_id:
+        stmt = stmt.where(Reserva.usuario_id == usuario_id)
+    actualizadas = db.session.execute(stmt).rowcount or 0
+    db.session.commit()
+    return actualizadas
+
+def cerrar_mes_empresa(empresa_id, año, mes, usuario_id=None):
+    """
+    Congela las cifras del mes para una empresa: filas del detalle de ventas,
+    contadores de estados de venta, ranking de ejecutivos y la línea del balance.
+    Devuelve el CierreMes creado, o None si el mes ya estaba cerrado.
+    """
+    if obtener_cierre_mes(empresa_id, año, mes):
+        return None
+    reservas = reservas_del_periodo(empresa_id, año, mes, roles=['ejecutivo', 'analista', 'controling'])
+
+    cierre = CierreMes(empresa_id=empresa_id, periodo=f"{año:04d}-{mes:02d}", cerrado_por_id=usuario_id)
+    ranking = {}
+    for reserva in reservas:
+        comision_ejecutivo = reserva.comision_ejecutivo or Decimal('0')
+        comision_agencia = reserva.comision_agencia or Decimal('0')
+        ganancia_total = reserva.ganancia_total or Decimal('0')
+        total_neto = reserva.precio_venta_neto or Decimal('0')
+        bonos = reserva.bonos or Decimal('0')
+        ejecutivo = reserva.nombre_ejecutivo or f"{reserva.usuario.nombre} {reserva.usuario.apellidos}"
+        cierre.detalles.append(CierreMesDetalle(
+            reserva_id=reserva.id,
+            ejecutivo=ejecutivo,
+            producto=reserva.producto,
+            destino=reserva.destino,
+            localizadores=reserva.localizadores,
+            nombre_pasajero=reserva.nombre_pasajero,
+            telefono_pasajero=reserva.telefono_pasajero,
+            mail_pasajero=reserva.mail_pasajero,
+            fecha_viaje=reserva.fecha_viaje,
+            estado_pago=reserva.estado_pago,
+            venta_cobrada=reserva.venta_cobrada,
+            venta_emitida=reserva.venta_emitida,
+            precio_venta_total=reserva.precio_venta_total,
+            hotel_neto=reserva.hotel_neto,
+            vuelo_neto=reserva.vuelo_neto,
+            traslado_neto=reserva.traslado_neto,
+            seguro_neto=reserva.seguro_neto,
+            circuito_neto=reserva.circuito_neto,
+            crucero_neto=reserva.crucero_neto,
+            excursion_neto=reserva.excursion_neto,
+            paquete_neto=reserva.paquete_neto,
+            bonos=bonos,
+            ganancia_total=ganancia_total,
+            comision_ejecutivo=comision_ejecutivo,
+            comision_agencia=comision_agencia
+        ))
+
+        clave = reserva.nombre_ejecutivo or ''
+        if clave not in ranking:
+            ranking[clave] = CierreMesRanking(
+                ejecutivo=clave,
+                correo_ejecutivo=reserva.correo_ejecutivo or '',
+                rol_ejecutivo=reserva.usuario.rol,
+                num_ventas=0,
+                total_ventas=Decimal('0'),
+                total_costos=Decimal('0'),
+                total_comisiones=Decimal('0'),
+                total_bonos=Decimal('0'),
+                total_ganancia=Decimal('0')
+            )
+        fila = ranking[clave]
+        fila.num_ventas += 1
+        fila.total_ventas += reserva.precio_venta_total or Decimal('0')
+        fila.total_costos += total_neto
+        fila.total_comisiones += comision_ejecutivo
+        fila.total_bonos += bonos
+        fila.total_ganancia += comision_agencia
+
+    detalles = cierre.detalles
+    cierre.ranking.extend(ranking.values())
+    cierre.num_ventas = len(detalles)
+    cierre.num_ventas_cobradas = sum(1 for d in detalles if (d.venta_cobrada or '').strip().lower() == 'cobrada')
+    cierre.num_ventas_emitidas = sum(1 for d in detalles if (d.venta_emitida or '').strip().lower() == 'emitida')
+    cierre.num_ventas_pagadas = sum(1 for d in detalles if (d.estado_pago or '').strip().lower() == 'pagado')
+    cierre.precio_venta_neto = sum((d.ganancia_total for d in detalles), Decimal('0'))
+    cierre.ingresos_agentes = sum((d.comision_agencia for d in detalles), Decimal('0'))
+    cierre.egresos_comision = sum((d.comision_ejecutivo for d in detalles), Decimal('0'))
+    db.session.add(cierre)
+    db.session.commit()
+    return cierre
+
+def respuesta_periodo_cerrado(html, *cierres):
+    """Respuesta con caché HTTP de larga duración para reportes servidos desde cierres (inmutables)."""
+    response = make_response(html)
+    response.cache_control.private = True
+    response.cache_control.max_age = app.config['REPORTES_CERRADOS_MAX_AGE']
+    firma = '|'.join(f"{c.id}:{c.fecha_cierre.isoformat()}" for c in cierres)
+    response.set_etag(hashlib.sha256(f"{firma}|{request.full_path}|{current_user.id}".encode('utf-8')).hexdigest())
+    return response.make_conditional(request)
+
+RECALCULO_COMISIONES_LOTE = int(os.getenv('RECALCULO_COMISIONES_LOTE', 5000))
+
+def recalcular_comisiones_reservas(usuario_id=None, tamano_lote=None):
+    """
+    Recalcula en bloque comision_ejecutivo y comision_agencia sobre la ganancia_total
+    (columna generada) con la comisión actual de cada usuario. Trabaja por rangos de id, con un único
+    UPDATE ... FROM usuario por lote. Las reservas de meses cerrados no se tocan.
+    Devuelve la cantidad de reservas actualizadas.
+    """
+    tamano_lote = tamano_lote or RECALCULO_COMISIONES_LOTE
+    rango = db.session.query(db.func.min(Reserva.id), db.func.max(Reserva.id))
+    if usuario_id:
+        rango = rango.filter(Reserva.usuario_id == usuario_id)
+    id_min, id_max = rango.one()
+    if id_min is None:
+        return 0
+
+    ganancia = db.func.coalesce(Reserva.ganancia_total, 0)
+    comision = ganancia * db.func.coalesce(Usuario.comision, 0) / 100
+    filtros = [Reserva.usuario_id == Usuario.id]
+    if usuario_id:
+        filtros.append(Reserva.usuario_id == usuario_id)
+    # Mantener estables las cifras de los meses cerrados
+    cerrados = []
+    for cierre in CierreMes.query.all():
+        año, mes = map(int, cierre.periodo.split('-'))
+        inicio, fin = obtener_rango_mes(año, mes)
+        cerrados.append(db.and_(
+            Reserva.empresa_id == cierre.empresa_id,
+            Reserva.fecha_venta >= inicio,
+            Reserva.fecha_venta < fin
+        ))
+    if cerrados:
+        filtros.append(db.not_(db.or_(*cerrados)))
+
+    actualizadas = 0
+    for desde in range(id_min, id_max + 1, tamano_lote):
+        stmt = db.update(Reserva).where(
+            Reserva.id >= desde,
+            Reserva.id < desde + tamano_lote,
+            *filtros
+        ).values(
+            comision_ejecutivo=comision,
+            comision_agencia=ganancia - comision
+        ).execution_options(synchronize_session=False)
+        actualizadas += db.session.execute(stmt).rowcount or 0
+        db.session.commit()
+    return actualizadas
+
+# =====================
+# COLUMNAS GENERADAS DE RESERVA
+# =====================
+COLUMNAS_GENERADAS_RESERVA = {
+    'precio_venta_neto': EXPRESION_TOTAL_NETO,
+    'ganancia_total': EXPRESION_GANANCIA,
+}
+
+def convertir_columnas_generadas_reserva():
+    """
+    Convierte precio_venta_neto y ganancia_total de bases creadas antes de que fueran columnas
+    generadas: borra la columna normal y la vuelve a agregar como GENERATED ALWAYS, con su índice.
+    En PostgreSQL queda STORED; SQLite solo permite agregar columnas VIRTUAL con ALTER TABLE,
+    que se calculan al leer pero igual se pueden indexar. Devuelve las columnas convertidas.
+    """
+    actuales = {col['name']: col for col in db.inspect(db.engine).get_columns('reserva')}
+    pendientes = [nombre for nombre in COLUMNAS_GENERADAS_RESERVA if not actuales.get(nombre, {}).get('computed')]
+    if not pendientes:
+        return []
+    almacenamiento = 'STORED' if es_postgresql() else 'VIRTUAL'
+    conexion = db.session.connection()
+    for nombre in pendientes:
+        indices = [indice for indice in Reserva.__table__.indexes if nombre in indice.columns]
+        for indice in indices:
+            conexion.exec_driver_sql(f"DROP INDEX IF EXISTS {indice.name}")
+        if nombre in actuales:
+            conexion.exec_driver_sql(f"ALTER TABLE reserva DROP COLUMN {nombre}")
+        conexion.exec_driver_sql(
+            f"ALTER TABLE reserva ADD COLUMN {nombre} NUMERIC(12, 2) "
+            f"GENERATED ALWAYS AS ({COLUMNAS_GENERADAS_RESERVA[nombre]}) {almacenamiento}"
+        )
+        for indice in indices:
+            indice.create(conexion)
+    db.session.commit()
+    return pendientes
+
+# =====================
+# PARTICIONES DE RESERVA (PostgreSQL)
+# =====================
+def es_postgresql():
+    return db.engine.dialect.name == 'postgresql'
+
+def columnas_reserva_sql():
+    """Columnas de reserva que se pueden insertar (sin las generadas), separadas por coma."""
+    return ', '.join(col.name for col in Reserva.__table__.columns if col.computed is None)
+
+def nombre_particion_reserva(año, mes):
+    return f"reserva_y{año:04d}m{mes:02d}"
+
+def reserva_esta_particionada():
+    """Indica si la tabla reserva ya es una tabla particionada (relkind 'p')."""
+    if not es_postgresql():
+        return False
+    relkind = db.session.execute(db.text(
+        "SELECT relkind FROM pg_class WHERE oid = to_regclass('reserva')"
+    )).scalar()
+    return relkind == 'p'
+
+def crear_particion_reserva(año, mes):
+    """
+    Crea la partición mensual de reserva si no existe. Las filas de ese mes que hubieran
+    caído en la partición por defecto se mueven a la nueva antes de adjuntarla.
+    Devuelve True si la partición se creó.
+    """
+    nombre = nombre_particion_reserva(año, mes)
+    if db.session.execute(db.text("SELECT to_regclass(:nombre)"), {'nombre': nombre}).scalar():
+        return False
+    inicio, fin = obtener_rango_mes(año, mes)
+    db.session.execute(db.text(f"CREATE TABLE {nombre} (LIKE reserva INCLUDING DEFAULTS INCLUDING GENERATED)"))
+    columnas = columnas_reserva_sql()
+    db.session.execute(db.text(
+        "WITH movidas AS ("
+        " DELETE FROM reserva_default WHERE fecha_venta >= :inicio AND fecha_venta < :fin RETURNING *"
+        f") INSERT INTO {nombre} ({columnas}) SELECT {columnas} FROM movidas"
+    ), {'inicio': inicio, 'fin': fin})
+    db.session.execute(db.text(
+        f"ALTER TABLE reserva ATTACH PARTITION {nombre} "
+        f"FOR VALUES FROM ('{inicio.isoformat()}') TO ('{fin.isoformat()}')"
+    ))
+    return True
+
+def crear_particiones_reserva(desde=None, meses_adelante=None):
+    """
+    Asegura una partición por mes desde `desde` (por defecto, la venta más antigua)
+    hasta `meses_adelante` meses después del mes actual. No confirma la transacción.
+    Devuelve cuántas se crearon.
+    """
+    if meses_adelante is None:
+        meses_adelante = app.config['RESERVA_PARTICIONES_ADELANTE']
+    hoy = datetime.now().date()
+    desde = desde or db.session.query(db.func.min(Reserva.fecha_venta)).scalar() or hoy
+    año, mes = desde.year, desde.month
+    ultimo = hoy.year * 12 + hoy.month - 1 + meses_adelante
+    creadas = 0
+    while año * 12 + mes - 1 <= ultimo:
+        if crear_particion_reserva(año, mes):
+            creadas += 1
+        año, mes = (año + 1, 1) if mes == 12 else (año, mes + 1)
+    return creadas
+
+def particionar_tabla_reserva():
+    """
+    Migra la tabla reserva (sin particionar) a una tabla particionada por rango mensual de fecha_venta.
+    Como la clave de partición debe formar parte de toda restricción única, la clave primaria pasa a
+    ser (id, fecha_venta) y fecha_venta queda NOT NULL: las reservas sin fecha de venta no se admiten
+    en la tabla particionada y, si existe alguna, la migración se cancela sin cambios para que se
+    complete antes. La partición por defecto recibe las fechas fuera de los meses creados.
+    Se ejecuta en una sola transacción. Devuelve False si la tabla ya estaba particionada.
+    """
+    if not es_postgresql():
+        raise RuntimeError('El particionado de reservas requiere PostgreSQL.')
+    if reserva_esta_particionada():
+        return False
+
+    def ejecutar(sql):
+        return db.session.execute(db.text(sql))
+
+    # El bloqueo evita que entre una reserva sin fecha entre la verificación y la copia
+    ejecutar("LOCK TABLE reserva IN SHARE ROW EXCLUSIVE MODE")
+    sin_fecha = ejecutar("SELECT id FROM reserva WHERE fecha_venta IS NULL ORDER BY id").scalars().all()
+    if sin_fecha:
+        db.session.rollback()
+        muestra = ', '.join(str(reserva_id) for reserva_id in sin_fecha[:20])
+        raise RuntimeError(f'{len(sin_fecha)} reserva(s) sin fecha_venta (ids: {muestra}); '
+                           'asígnales la fecha de venta antes de particionar.')
+    desde = ejecutar("SELECT min(fecha_venta) FROM reserva").scalar()
+    ejecutar("ALTER TABLE reserva RENAME TO reserva_sin_particion")
+    ejecutar("CREATE TABLE reserva (LIKE reserva_sin_particion INCLUDING DEFAULTS INCLUDING GENERATED) "
+             "PARTITION BY RANGE (fecha_venta)")
+    ejecutar("ALTER TABLE reserva ALTER COLUMN fecha_venta SET NOT NULL")
+    secuencia = ejecutar("SELECT pg_get_serial_sequence('reserva_sin_particion', 'id')").scalar()
+    if secuencia:
+        ejecutar(f"ALTER SEQUENCE {secuencia} OWNED BY reserva.id")
+    ejecutar("CREATE TABLE reserva_default PARTITION OF reserva DEFAULT")
+    crear_particiones_reserva(desde=desde)
+    columnas = columnas_reserva_sql()
+    ejecutar(f"INSERT INTO reserva ({columnas}) SELECT {columnas} FROM reserva_sin_particion")
+    ejecutar("DROP TABLE reserva_sin_particion")
+    ejecutar("ALTER TABLE reserva ADD PRIMARY KEY (id, fecha_venta)")
+    ejecutar("ALTER TABLE reserva ADD FOREIGN KEY (usuario_id) REFERENCES usuario (id)")
+    ejecutar("ALTER TABLE reserva ADD FOREIGN KEY (empresa_id) REFERENCES empresa (id)")
+    for indice in Reserva.__table__.indexes:
+        indice.create(db.session.connection())
+    db.session.commit()
+    return True
+
+def desacoplar_particion_reserva(año, mes):
+    """Separa la partición del mes de la tabla reserva; la tabla queda intacta para archivarla o eliminarla."""
+    nombre = nombre_particion_reserva(año, mes)
+    db.session.execute(db.text(f"ALTER TABLE reserva DETACH PARTITION {nombre}"))
+    db.session.commit()
+    return nombre
+
+# =====================
+# ARCHIVO DE RESERVAS
+# =====================
+RESERVAS_ARCHIVO_LOTE = int(os.getenv('RESERVAS_ARCHIVO_LOTE', 1000))
+
+def fecha_corte_archivo(meses=None):
+    """Primer día del mes de hace `meses` meses; las ventas anteriores a esa fecha se archivan."""
+    meses = app.config['RESERVAS_ARCHIVO_MESES'] if meses is None else meses
+    hoy = datetime.now().date()
+    indice = hoy.year * 12 + hoy.month - 1 - meses
+    return datetime(indice // 12, indice % 12 + 1, 1).date()
+
+def archivar_reservas(antes_de=None, tamano_lote=None):
+    """
+    Mueve a reserva_archivada las reservas con fecha_venta anterior a `antes_de`
+    (por defecto, el corte de RESERVAS_ARCHIVO_MESES), por lotes: INSERT ... SELECT, DELETE
+    y commit por lote. Después de cada lote mueve sus comprobantes a la carpeta fría.
+    Devuelve la cantidad de reservas archivadas.
+    """
+    antes_de = antes_de or fecha_corte_archivo()
+    tamano_lote = tamano_lote or RESERVAS_ARCHIVO_LOTE
+    tabla = Reserva.__table__
+    columnas = [col.name for col in tabla.columns]
+    archivadas = 0
+    while True:
+        ids = [fila.id for fila in db.session.query(Reserva.id).filter(
+            Reserva.fecha_venta < antes_de
+        ).order_by(Reserva.id).limit(tamano_lote)]
+        if not ids:
+            break
+        comprobantes = [fila.comprobante_venta for fila in db.session.query(Reserva.comprobante_venta).filter(
+            Reserva.id.in_(ids), Reserva.comprobante_venta.isnot(None)
+        )]
+        db.session.execute(ReservaArchivada.__table__.insert().from_select(
+            columnas, db.select(*[tabla.c[nombre] for nombre in columnas]).where(tabla.c.id.in_(ids))
+        ))
+        db.session.execute(db.delete(Reserva).where(Reserva.id.in_(ids)).execution_options(synchronize_session=False))
+        db.session.commit()
+        for nombre in comprobantes:
+            origen = os.path.join(app.config['UPLOAD_FOLDER'], nombre)
+            if os.path.exists(origen):
+                os.replace(origen, os.path.join(app.config['COMPROBANTES_ARCHIVO_FOLDER'], nombre))
+        archivadas += len(ids)
+    return archivadas
+
 # =====================
 # RUTAS DE FLASK
 # =====================
@@ -1317,7 +2528,7 @@ def empresas_asociadas():
     empresas = Empresa.query.all()
     return render_template('empresas_asociadas.html', empresas=empresas)
 
-@app.route('/admin/contabilidad')
+@app.route('/admin/contabilidad', methods=['GET', 'POST'])
 @login_required
 @rol_required('admin', 'master')
 def contabilidad_empresas():
@@ -1356,13 +2567,26 @@ def contabilidad_empresas():
     
     facturas = query.all()
     empresas = Empresa.query.all()
+    # Mes propuesto para la generación automática: el mes anterior
+    mes_facturacion = (fecha_actual.replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+
+    # Conciliación: al enviar su formulario (POST, con extracto bancario opcional) o con ?conciliar=1
+    conciliacion = None
+    if request.method == 'POST' or request.args.get('conciliar'):
+        try:
+            conciliacion = conciliacion_desde_request()
+        except ValueError as e:
+            flash(str(e), 'danger')
     
     return render_template('contabilidad_empresas.html', 
                          facturas=facturas, 
                          empresas=empresas,
                          meses_anteriores=meses_anteriores,
                          selected_mes_str=selected_mes_str,
-                         selected_empresa_id=selected_empresa_id)
+                         selected_empresa_id=selected_empresa_id,
+                         mes_facturacion=mes_facturacion,
+                         conciliacion=conciliacion,
+                         columnas_conciliacion=COLUMNAS_CONCILIACION)
 
 # Endpoint para mostrar la liquidación de sueldo
 @app.route('/liquidacion/<int:usuario_id>/<periodo>')
@@ -1372,32 +2596,21 @@ def ver_liquidacion(usuario_id, periodo):
     """Muestra la liquidación de sueldo para un usuario y periodo (YYYY-MM)"""
     usuario = Usuario.query.get_or_404(usuario_id)
     año, mes = map(int, periodo.split('-'))
-    reservas = Reserva.query.filter(
-        Reserva.usuario_id == usuario_id,
-        db.extract('year', Reserva.fecha_venta) == año,
-        db.extract('month', Reserva.fecha_venta) == mes
-    ).all()
-    from decimal import Decimal
-    honorarios_brutos = sum([r.comision_ejecutivo or 0 for r in reservas])
-    # Obtener sueldo, bonos y descuentos desde liquidaciones.html/backend
-    # Buscar datos en liquidaciones_data (opcional: podrías usar una consulta directa si tienes la empresa y mes)
-    from flask import request
-    sueldo = getattr(usuario, 'sueldo', 0)
-    bonos = request.args.get('bonos', None)
-    descuentos = request.args.get('descuentos', None)
-    # Si no vienen por query, calcular por defecto
-    if bonos is None:
-        bonos = sum([r.bonos or 0 for r in reservas])
-    else:
-        bonos = float(bonos)
-    if descuentos is None:
-        descuentos = 0
+    # Los periodos cerrados se muestran directamente desde el snapshot
+    liquidacion = obtener_liquidacion_cerrada(usuario_id, periodo)
+    if liquidacion:
+        montos = liquidacion.montos()
+        fecha_pago = liquidacion.fecha_cierre.strftime('%d-%m-%Y')
+        boleta_sii = liquidacion.boleta_sii or ''
     else:
-        descuentos = float(descuentos)
-    retencion_sii = round((honorarios_brutos + bonos) * Decimal('0.13'))
-    total_liquido = honorarios_brutos + sueldo + bonos - descuentos - retencion_sii
-    fecha_pago = datetime.now().strftime('%d-%m-%Y')
-    boleta_sii = ''  # Se puede pedir como input en el futuro
+        # Bonos y descuentos pueden venir como ajuste desde liquidaciones.html
+        montos, _ = calcular_liquidacion(
+            usuario, año, mes,
+            bonos=request.args.get('bonos', None),
+            descuentos=request.args.get('descuentos', None)
+        )
+        fecha_pago = datetime.now().strftime('%d-%m-%Y')
+        boleta_sii = ''  # Se puede pedir como input en el futuro
     # Obtener empresa asociada al usuario
     empresa = usuario.empresa if hasattr(usuario, 'empresa') and usuario.empresa else None
     # Valores por defecto para banco y cuenta_bancaria
@@ -1411,13 +2624,14 @@ def ver_liquidacion(usuario_id, periodo):
         empresa=empresa,
         periodo=periodo,
         boleta_sii=boleta_sii,
-        honorarios_brutos=honorarios_brutos,
-        sueldo=sueldo,
-        retencion_sii=retencion_sii,
-        bonos=bonos,
-        descuentos=descuentos,
-        total_liquido=total_liquido,
-        fecha_pago=fecha_pago
+        honorarios_brutos=montos['honorarios_brutos'],
+        sueldo=montos['sueldo'],
+        retencion_sii=montos['retencion_sii'],
+        bonos=montos['bonos'],
+        descuentos=montos['descuentos'],
+        total_liquido=montos['total_liquido'],
+        fecha_pago=fecha_pago,
+        liquidacion_cerrada=liquidacion
     )
 
 # Endpoint para descargar la liquidación como PDF
@@ -1428,44 +2642,49 @@ def ver_liquidacion(usuario_id, periodo):
 def descargar_liquidacion_pdf(usuario_id, periodo):
     usuario = Usuario.query.get_or_404(usuario_id)
     año, mes = map(int, periodo.split('-'))
-    reservas = Reserva.query.filter(
-        Reserva.usuario_id == usuario_id,
-        db.extract('year', Reserva.fecha_venta) == año,
-        db.extract('month', Reserva.fecha_venta) == mes
-    ).all()
-    from decimal import Decimal
-    honorarios_brutos = sum([r.comision_ejecutivo or 0 for r in reservas])
-    bonos = sum([r.bonos or 0 for r in reservas])
-    descuentos = 0
-    retencion_sii = round((honorarios_brutos + bonos) * Decimal('0.13'))
-    total_liquido = honorarios_brutos + bonos - descuentos - retencion_sii
-    fecha_pago = datetime.now().strftime('%d-%m-%Y')
-    boleta_sii = ''
+    liquidacion = obtener_liquidacion_cerrada(usuario_id, periodo)
+    if liquidacion:
+        montos = liquidacion.montos()
+        reservas = []
+        fecha_pago = liquidacion.fecha_cierre.strftime('%d-%m-%Y')
+        boleta_sii = liquidacion.boleta_sii or ''
+    else:
+        montos, reservas = calcular_liquidacion(
+            usuario, año, mes,
+            bonos=request.args.get('bonos', None),
+            descuentos=request.args.get('descuentos', None)
+        )
+        fecha_pago = datetime.now().strftime('%d-%m-%Y')
+        boleta_sii = ''
     empresa = usuario.empresa if hasattr(usuario, 'empresa') and usuario.empresa else None
-    rendered = render_template(
-        'liquidacion_pdf.html',
+    datos = dict(
         usuario=usuario,
         empresa=empresa,
         periodo=periodo,
         boleta_sii=boleta_sii,
-        honorarios_brutos=honorarios_brutos,
-        sueldo=usuario.sueldo or 0,
-        retencion_sii=retencion_sii,
-        bonos=bonos,
-        descuentos=descuentos,
-        total_liquido=total_liquido,
+        honorarios_brutos=montos['honorarios_brutos'],
+        sueldo=montos['sueldo'],
+        retencion_sii=montos['retencion_sii'],
+        bonos=montos['bonos'],
+        descuentos=montos['descuentos'],
+        total_liquido=montos['total_liquido'],
         fecha_pago=fecha_pago
     )
-    # Convertir HTML a PDF usando xhtml2pdf
-    from io import BytesIO
-    pdf_buffer = BytesIO()
-    pisa_status = pisa.CreatePDF(rendered, dest=pdf_buffer)
-    if pisa_status.err:
-        return 'Error generando PDF', 500
-    pdf_buffer.seek(0)
+    # Reutilizar el PDF si ya se generó con exactamente los mismos datos
+    clave = clave_cache_liquidacion_pdf(datos, reservas)
+    pdf = leer_cache_liquidacion_pdf(clave)
+    if pdf is None:
+        rendered = render_template('liquidacion_pdf.html', **datos)
+        # Convertir HTML a PDF usando xhtml2pdf
+        pdf_buffer = io.BytesIO()
+        pisa_status = pisa.CreatePDF(rendered, dest=pdf_buffer)
+        if pisa_status.err:
+            return 'Error generando PDF', 500
+        pdf = pdf_buffer.getvalue()
+        guardar_cache_liquidacion_pdf(clave, pdf)
     filename = f"liquidacion_{usuario.nombre}_{usuario.apellidos}_{periodo}.pdf"
     return Response(
-        pdf_buffer.read(),
+        pdf,
         mimetype='application/pdf',
         headers={
             'Content-Disposition': f'attachment; filename={filename}'
@@ -1571,7 +2790,354 @@ def eliminar_factura(id):
     flash('Factura eliminada correctamente.', 'success')
     return redirect(url_for('contabilidad_empresas'))
 
+CAMPOS_MONTO_FACTURA = ('comision_agencia', 'ganancia_total', 'precio_venta_total')
+
+def periodo_sql(columna):
+    """Mes 'YYYY-MM' de una columna de fecha, en la función de cada motor."""
+    if es_postgresql():
+        return db.func.to_char(columna, 'YYYY-MM')
+    return db.func.strftime('%Y-%m', columna)
+
+def montos_facturables(inicio, fin, empresa_id=None):
+    """
+    Base facturable por empresa y mes de venta en [inicio, fin): filas (empresa_id, periodo,
+    num_ventas, base) con la suma de FACTURA_CAMPO_MONTO, en una consulta agrupada que incluye
+    el archivo si el rango llega a meses archivados.
+    """
+    campo = app.config['FACTURA_CAMPO_MONTO']
+    if campo not in CAMPOS_MONTO_FACTURA:
+        raise ValueError(f'FACTURA_CAMPO_MONTO inválido: {campo}')
+    partes = []
+    for modelo in modelos_reserva('fecha_venta', inicio):
+        parte = db.select(
+            modelo.empresa_id, periodo_sql(modelo.fecha_venta).label('periodo'),
+            getattr(modelo, campo).label('monto'),
+        ).where(modelo.fecha_venta >= inicio, modelo.fecha_venta < fin, modelo.empresa_id.isnot(None))
+        if empresa_id:
+            parte = parte.where(modelo.empresa_id == empresa_id)
+        partes.append(parte)
+    ventas = (db.union_all(*partes) if len(partes) > 1 else partes[0]).subquery()
+    consulta = db.select(
+        ventas.c.empresa_id, ventas.c.periodo, db.func.count().label('num_ventas'),
+        db.func.coalesce(db.func.sum(ventas.c.monto), 0).label('base'),
+    ).group_by(ventas.c.empresa_id, ventas.c.periodo)
+    return db.session.execute(consulta).all()
+
+def montos_facturables_mes(año, mes, empresa_id=None):
+    """{empresa_id: (num_ventas, base)} de las ventas del mes (por fecha_venta)."""
+    inicio, fin = obtener_rango_mes(año, mes)
+    return {
+        fila.empresa_id: (fila.num_ventas, safe_decimal(fila.base))
+        for fila in montos_facturables(inicio, fin, empresa_id)
+    }
+
+def generar_facturas_mes(año, mes, empresa_id=None):
+    """
+    Crea o actualiza la factura del mes de cada empresa con ventas, en una sola transacción.
+    Es idempotente: las facturas no pagadas se actualizan al monto calculado y las pagadas no se
+    tocan. Las empresas se bloquean (FOR UPDATE en PostgreSQL) para que dos ejecuciones simultáneas
+    no dupliquen facturas. Devuelve {'creadas', 'actualizadas', 'sin_cambios', 'pagadas'}.
+    """
+    mes_fecha = datetime(año, mes, 1).date()
+    porcentaje = app.config['FACTURA_PORCENTAJE'] / Decimal('100')
+    resultado = dict.fromkeys(('creadas', 'actualizadas', 'sin_cambios', 'pagadas'), 0)
+
+    empresas = Empresa.query.order_by(Empresa.id)
+    if empresa_id:
+        empresas = empresas.filter(Empresa.id == empresa_id)
+    empresa_ids = [e.id for e in empresas.with_for_update()]
+    montos = montos_facturables_mes(año, mes, empresa_id)
+
+    # Si hay facturas repetidas del mes (cargadas a mano), se usa la primera
+    existentes = {}
+    for factura in Factura.query.filter(
+        Factura.mes == mes_fecha, Factura.empresa_id.in_(empresa_ids)
+    ).order_by(Factura.id):
+        existentes.setdefault(factura.empresa_id, factura)
+
+    for eid in empresa_ids:
+        num_ventas, base = montos.get(eid, (0, Decimal('0')))
+        monto = (base * porcentaje).quantize(Decimal('0.01'))
+        factura = existentes.get(eid)
+        if factura is None:
+            if not num_ventas:
+                continue
+            db.session.add(Factura(
+                empresa_id=eid, mes=mes_fecha, monto=monto, estado='No Pagado',
+                observaciones=f'Generada automáticamente: {num_ventas} venta(s) de {año:04d}-{mes:02d}'
+            ))
+            resultado['creadas'] += 1
+        elif factura.estado == 'Pagado':
+            resultado['pagadas'] += 1
+        elif safe_decimal(factura.monto) != monto:
+            factura.monto = monto
+            resultado['actualizadas'] += 1
+        else:
+            resultado['sin_cambios'] += 1
+    db.session.commit()
+    return resultado
+
+@app.route('/admin/facturas/generar', methods=['POST'])
+@login_required
+@rol_required('admin', 'master')
+def generar_facturas():
+    """Genera (o actualiza) las facturas del mes de todas las empresas, o de la seleccionada"""
+    mes_param = request.form.get('mes', '')
+    empresa_param = request.form.get('empresa_id', '')
+    try:
+        año, mes = map(int, mes_param.split('-'))
+    except ValueError:
+        flash('Formato de mes inválido.', 'danger')
+        return redirect(url_for('contabilidad_empresas'))
+    resultado = generar_facturas_mes(año, mes, int(empresa_param) if empresa_param else None)
+    flash(
+        f"Facturas de {mes_param}: {resultado['creadas']} creadas, {resultado['actualizadas']} actualizadas, "
+        f"{resultado['sin_cambios']} sin cambios y {resultado['pagadas']} pagadas sin modificar.",
+        'success'
+    )
+    return redirect(url_for('contabilidad_empresas', mes=f"{mes_param} ({obtener_nombre_mes(mes)})",
+                            empresa_id=empresa_param))
+
+@app.cli.command('generar-facturas')
+@click.argument('periodo')
+@click.option('--empresa-id', type=int, default=None, help='Generar solo la factura de esta empresa.')
+def generar_facturas_command(periodo, empresa_id):
+    """Genera o actualiza las facturas del mes YYYY-MM (idempotente)."""
+    año, mes = map(int, periodo.split('-'))
+    resultado = generar_facturas_mes(año, mes, empresa_id)
+    click.echo(f"Facturas {periodo}: " + ', '.join(f"{v} {k.replace('_', ' ')}" for k, v in resultado.items()))
+
+# =====================
+# CONCILIACIÓN DE FACTURAS
+# =====================
+# Nombres de columna aceptados en el extracto bancario (en minúsculas y sin espacios extremos)
+COLUMNAS_EXTRACTO_BANCO = {
+    'fecha': ('fecha', 'fecha movimiento', 'fecha_movimiento', 'date'),
+    'monto': ('monto', 'abono', 'abonos', 'importe', 'deposito', 'depósito', 'amount'),
+    'descripcion': ('descripcion', 'descripción', 'glosa', 'detalle', 'referencia', 'description'),
+}
+
+def parsear_monto_banco(texto):
+    """
+    Monto de un extracto bancario como float: acepta '$ 1.234.567', '1.234,50', '1234.50' o '-500'.
+    Un punto seguido de exactamente tres dígitos se toma como separador de miles.
+    """
+    if texto is None or (isinstance(texto, float) and pd.isna(texto)):
+        return None
+    if isinstance(texto, (int, float)):
+        return float(texto)
+    limpio = str(texto).replace('$', '').replace(' ', '').strip()
+    if not limpio:
+        return None
+    if ',' in limpio:
+        limpio = limpio.replace('.', '').replace(',', '.')
+    elif limpio.count('.') > 1 or (limpio.count('.') == 1 and len(limpio.split('.')[1]) == 3):
+        limpio = limpio.replace('.', '')
+    try:
+        return float(limpio)
+    except ValueError:
+        return None
+
+def leer_extracto_banco(archivo):
+    """
+    Lee el CSV del banco (separador detectado) y devuelve un DataFrame con fecha, monto y
+    descripcion, solo con los abonos (montos positivos). Lanza ValueError si falta la columna de monto.
+    """
+    extracto = pd.read_csv(archivo, sep=None, engine='python', dtype=str, encoding='utf-8-sig')
+    extracto.columns = [str(c).strip().lower() for c in extracto.columns]
+    columnas = {}
+    for destino, alias in COLUMNAS_EXTRACTO_BANCO.items():
+        encontrada = next((c for c in extracto.columns if c in alias), None)
+        if encontrada:
+            columnas[encontrada] = destino
+    if 'monto' not in columnas.values():
+        raise ValueError('El extracto debe tener una columna de monto (monto, abono o importe).')
+    extracto = extracto[list(columnas)].rename(columns=columnas)
+    extracto['monto'] = extracto['monto'].map(parsear_monto_banco)
+    if 'fecha' in extracto:
+        extracto['fecha'] = pd.to_datetime(extracto['fecha'], dayfirst=True, errors='coerce').dt.date
+    else:
+        extracto['fecha'] = None
+    if 'descripcion' not in extracto:
+        extracto['descripcion'] = ''
+    return extracto[extracto['monto'] > 0].reset_index(drop=True)
+
+def emparejar_por_monto(izquierda, derecha, orden_izquierda, orden_derecha):
+    """
+    Emparejamiento uno a uno por monto (hash join de pandas): la n-ésima fila con un monto se
+    empareja con la n-ésima del otro lado con el mismo monto, según el orden indicado.
+    """
+    izquierda = izquierda.sort_values(orden_izquierda).copy()
+    derecha = derecha.sort_values(orden_derecha).copy()
+    for tabla in (izquierda, derecha):
+        tabla['clave_monto'] = tabla['monto'].round(2)
+        tabla['ocurrencia'] = tabla.groupby('clave_monto').cumcount()
+    return izquierda.merge(derecha, on=['clave_monto', 'ocurrencia'], how='outer',
+                           suffixes=('', '_banco'), indicator=True)
+
+def conciliar_facturas(inicio, fin, empresa_id=None, extracto=None):
+    """
+    Concilia las facturas de los meses [inicio, fin) con la base facturable de las ventas de cada
+    empresa (misma fórmula que generar_facturas_mes). Las ventas y las facturas se leen con una
+    consulta cada una y se cruzan en pandas por (empresa, mes). Marca diferencias de monto,
+    empresas con ventas sin factura, facturas sin ventas, facturas repetidas y facturas vencidas
+    impagas. Con `extracto` (DataFrame de leer_extracto_banco) cruza además cada factura con los
+    abonos del banco por monto.
+    Devuelve {'meses': DataFrame, 'banco': DataFrame o None, 'resumen': dict}.
+    """
+    hoy = pd.Timestamp(datetime.now().date())
+    porcentaje = float(app.config['FACTURA_PORCENTAJE']) / 100
+    tolerancia = app.config['CONCILIACION_TOLERANCIA']
+
+    ventas = pd.DataFrame(
+        [tuple(fila) for fila in montos_facturables(inicio, fin, empresa_id)],
+        columns=['empresa_id', 'periodo', 'num_ventas', 'base']
+    )
+    ventas['esperado'] = (ventas['base'].astype(float) * porcentaje).round(2)
+
+    consulta = db.select(
+        Factura.id, Factura.empresa_id, periodo_sql(Factura.mes).label('periodo'),
+        Factura.monto, Factura.estado, Factura.fecha_pago,
+    ).where(Factura.mes >= inicio, Factura.mes < fin)
+    if empresa_id:
+        consulta = consulta.where(Factura.empresa_id == empresa_id)
+    facturas = pd.DataFrame(
+        [tuple(fila) for fila in db.session.execute(consulta)],
+        columns=['factura_id', 'empresa_id', 'periodo', 'monto', 'estado', 'fecha_pago']
+    )
+    facturas['monto'] = facturas['monto'].astype(float)
+    vencimiento = (pd.to_datetime(facturas['periodo'] + '-01') + pd.offsets.MonthBegin(1)
+                   + pd.Timedelta(days=app.config['FACTURA_DIAS_VENCIMIENTO']))
+    facturas['vencida'] = (facturas['estado'] != 'Pagado') & (vencimiento < hoy)
+
+    por_mes = facturas.groupby(['empresa_id', 'periodo'], as_index=False).agg(
+        facturado=('monto', 'sum'), num_facturas=('factura_id', 'count'),
+        impagas=('estado', lambda e: int((e != 'Pagado').sum())), vencidas=('vencida', 'sum'),
+        facturas=('factura_id', lambda ids: ', '.join(map(str, ids))),
+    )
+    meses = ventas.merge(por_mes, on=['empresa_id', 'periodo'], how='outer', indicator=True)
+    for columna in ('num_ventas', 'base', 'esperado', 'facturado', 'num_facturas', 'impagas', 'vencidas'):
+        # Tras el outer merge las columnas de un lado vacío quedan como object: a float antes de rellenar
+        meses[columna] = meses[columna].astype(float).fillna(0)
+    meses['facturas'] = meses['facturas'].fillna('')
+    meses['diferencia'] = (meses['facturado'] - meses['esperado']).round(2)
+
+    def incidencias(fila):
+        encontradas = []
+        if fila['_merge'] == 'left_only':
+            encontradas.append('Ventas sin factura')
+        elif fila['_merge'] == 'right_only':
+            encontradas.append('Factura sin ventas')
+        elif abs(fila['diferencia']) > tolerancia:
+            encontradas.append('Diferencia de monto')
+        if fila['num_facturas'] > 1:
+            encontradas.append('Facturas repetidas')
+        if fila['vencidas']:
+            encontradas.append('Vencida impaga')
+        return ', '.join(encontradas)
+
+    meses['incidencias'] = meses.apply(incidencias, axis=1) if len(meses) else ''
+    nombres = dict(db.session.query(Empresa.id, Empresa.nombre))
+    meses['empresa'] = meses['empresa_id'].map(nombres).fillna('Sin empresa')
+    meses = meses.drop(columns='_merge').sort_values(['periodo', 'empresa']).reset_index(drop=True)
+
+    banco = None
+    if extracto is not None:
+        banco = emparejar_por_monto(facturas, extracto, ['periodo', 'factura_id'], ['fecha'])
+        estado_banco = {
+            'left_only': 'Factura sin abono en el banco',
+            'right_only': 'Abono sin factura',
+            'both': 'Conciliada',
+        }
+        banco['resultado'] = banco['_merge'].map(estado_banco).astype(str)
+        banco.loc[(banco['_merge'] == 'both') & (banco['estado'] != 'Pagado'), 'resultado'] = 'Pagada en banco, marcada No Pagado'
+        banco.loc[(banco['_merge'] == 'left_only') & (banco['estado'] != 'Pagado'), 'resultado'] = 'Impaga'
+        banco['empresa'] = banco['empresa_id'].map(nombres)
+        banco['monto'] = banco['monto'].fillna(banco['monto_banco'])
+        banco['factura_id'] = banco['factura_id'].astype('Int64')
+        banco = banco[['resultado', 'factura_id', 'empresa', 'periodo', 'estado', 'monto',
+                       'fecha', 'descripcion']].rename(columns={'fecha': 'fecha_banco'})
+        # Celdas vacías como None (no NaN) para la plantilla y el Excel
+        banco = banco.astype(object).where(banco.notna(), None)
+
+    resumen = {
+        'meses': len(meses),
+        'con_incidencias': int((meses['incidencias'] != '').sum()) if len(meses) else 0,
+        'esperado': float(meses['esperado'].sum()),
+        'facturado': float(meses['facturado'].sum()),
+        'vencidas': int(facturas['vencida'].sum()),
+    }
+    if banco is not None:
+        resumen['banco'] = banco['resultado'].value_counts().to_dict()
+    return {'meses': meses, 'banco': banco, 'resumen': resumen}
+
+COLUMNAS_CONCILIACION = {
+    'periodo': 'Mes', 'empresa': 'Empresa', 'num_ventas': 'Ventas', 'esperado': 'Monto esperado',
+    'facturado': 'Monto facturado', 'diferencia': 'Diferencia', 'num_facturas': 'Facturas',
+    'facturas': 'IDs factura', 'impagas': 'Impagas', 'vencidas': 'Vencidas', 'incidencias': 'Incidencias',
+}
+
+def conciliacion_desde_request():
+    """
+    Lee el rango (desde/hasta en YYYY-MM, por defecto los últimos 12 meses), la empresa y el extracto
+    bancario opcional del formulario y ejecuta la conciliación. Lanza ValueError con un mensaje para el usuario.
+    """
+    datos = request.values
+    hoy = datetime.now().date()
+    desde = datos.get('desde') or (hoy.replace(day=1) - timedelta(days=335)).strftime('%Y-%m')
+    hasta = datos.get('hasta') or hoy.strftime('%Y-%m')
+    try:
+        inicio = obtener_rango_mes(*map(int, desde.split('-')))[0]
+        fin = obtener_rango_mes(*map(int, hasta.split('-')))[1]
+    except (TypeError, ValueError):
+        raise ValueError('Formato de mes inválido en la conciliación.')
+    if fin <= inicio:
+        raise ValueError('El mes "hasta" debe ser igual o posterior al mes "desde".')
+    empresa_id = int(datos['empresa_id']) if datos.get('empresa_id') else None
+    extracto = None
+    archivo = request.files.get('extracto_banco')
+    if archivo and archivo.filename:
+        try:
+            extracto = leer_extracto_banco(archivo)
+        except (ValueError, csv.Error, pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+            raise ValueError(f'No se pudo leer el extracto bancario: {e}')
+    conciliacion = conciliar_facturas(inicio, fin, empresa_id, extracto)
+    conciliacion.update(desde=desde, hasta=hasta, empresa_id=datos.get('empresa_id', ''))
+    return conciliacion
+
+@app.route('/exportar_conciliacion_facturas', methods=['GET', 'POST'])
+@lectura_en_replica
+@login_required
+@rol_required('admin', 'master')
+def exportar_conciliacion_facturas():
+    """Exportar a Excel la conciliación de facturas (y el cruce con el banco si se subió el extracto)"""
+    try:
+        conciliacion = conciliacion_desde_request()
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('contabilidad_empresas'))
+    hojas = {'Conciliación': conciliacion['meses'][list(COLUMNAS_CONCILIACION)].rename(columns=COLUMNAS_CONCILIACION)}
+    if conciliacion['banco'] is not None:
+        hojas['Banco'] = conciliacion['banco']
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for nombre, df in hojas.items():
+            df.to_excel(writer, sheet_name=nombre, index=False)
+            worksheet = writer.sheets[nombre]
+            for idx, col in enumerate(df.columns):
+                max_length = max(df[col].astype(str).map(len).max() if len(df) else 0, len(col)) + 2
+                worksheet.column_dimensions[get_column_letter(idx + 1)].width = min(max_length, 50)
+    output.seek(0)
+    filename = f"conciliacion_facturas_{conciliacion['desde'].replace('-', '_')}_{conciliacion['hasta'].replace('-', '_')}.xlsx"
+    return send_file(
+        output,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=filename
+    )
+
 @app.route('/exportar_empresas')
+@lectura_en_replica
 @login_required
 @rol_required('admin', 'master')
 def exportar_empresas():
@@ -1609,6 +3175,7 @@ def exportar_empresas():
     )
 
 @app.route('/exportar_facturas')
+@lectura_en_replica
 @login_required
 @rol_required('admin', 'master')
 def exportar_facturas():
@@ -1661,7 +3228,7 @@ def exportar_facturas():
                 df[col].astype(str).map(len).max(),
                 len(col)
             ) + 2
-            worksheet.column_dimensions[chr(65 + idx)].width = min(max_length, 50)
+            worksheet.column_dimensions[get_column_letter(idx + 1)].width = min(max_length, 50)
     
     output.seek(0)
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -1684,6 +3251,7 @@ def exportar_facturas():
     )
 
 @app.route('/exportar_reservas_admin')
+@lectura_en_replica
 @login_required
 @rol_required('admin', 'master', 'controling', 'ejecutivo', 'analista')
 def exportar_reservas_admin():
@@ -1693,29 +3261,42 @@ def exportar_reservas_admin():
     fecha_venta_param = request.args.get('fecha_venta', '')
     fecha_viaje_param = request.args.get('fecha_viaje', '')
     
-    # Construir consulta base igual que en admin_reservas
-    query = Reserva.query.join(Usuario)
-    
-    # Aplicar filtros basados en el rol del usuario
-    if current_user.rol in ['ejecutivo', 'analista']:
-        query = query.filter(Reserva.usuario_id == current_user.id)
-    elif current_user.rol == 'controling':
-        query = query.filter(Usuario.empresa_id == current_user.empresa_id)
-    
-    # Aplicar filtros adicionales
-    if empresa_param and empresa_param.strip() and current_user.rol in ['master', 'admin']:
-        query = query.filter(Usuario.empresa_id == int(empresa_param))
-    
-    if usuario_param and usuario_param.strip() and current_user.rol in ['master', 'admin', 'controling']:
-        query = query.filter(Reserva.usuario_id == int(usuario_param))
-    
-    if fecha_venta_param and fecha_venta_param.strip():
-        query = query.filter(db.func.date(Reserva.fecha_venta) == fecha_venta_param)
-    
-    if fecha_viaje_param and fecha_viaje_param.strip():
-        query = query.filter(db.func.date(Reserva.fecha_viaje) == fecha_viaje_param)
-    
-    reservas = query.order_by(Reserva.fecha_venta.desc()).all()
+    # Los filtros de fecha vienen como 'YYYY-MM' (input type=month), igual que en admin_reservas
+    rangos = {}
+    for campo, valor in (('fecha_venta', fecha_venta_param), ('fecha_viaje', fecha_viaje_param)):
+        if valor and valor.strip():
+            year, month = map(int, valor.strip().split('-'))
+            rangos[campo] = obtener_rango_mes(year, month)
+
+    # Las reservas archivadas se incluyen solo si el filtro de fecha llega al periodo archivado
+    modelos = [Reserva]
+    for campo, (inicio, _) in rangos.items():
+        if ReservaArchivada in modelos_reserva(campo, inicio):
+            modelos = [Reserva, ReservaArchivada]
+
+    reservas = []
+    for modelo in modelos:
+        # Construir consulta base igual que en admin_reservas
+        query = modelo.query
+
+        # Aplicar filtros basados en el rol del usuario
+        if current_user.rol in ['ejecutivo', 'analista']:
+            query = query.filter(modelo.usuario_id == current_user.id)
+        elif current_user.rol == 'controling':
+            query = query.filter(modelo.empresa_id == current_user.empresa_id)
+
+        # Aplicar filtros adicionales
+        if empresa_param and empresa_param.strip() and current_user.rol in ['master', 'admin']:
+            query = query.filter(modelo.empresa_id == int(empresa_param))
+
+        if usuario_param and usuario_param.strip() and current_user.rol in ['master', 'admin', 'controling']:
+            query = query.filter(modelo.usuario_id == int(usuario_param))
+
+        for campo, (inicio, fin) in rangos.items():
+            columna = getattr(modelo, campo)
+            query = query.filter(columna >= inicio, columna < fin)
+
+        reservas.extend(query.order_by(modelo.fecha_venta.desc()).all())
     
     # Preparar datos para Excel: incluir todos los campos de la clase Reserva
     data = []
@@ -1750,7 +3331,7 @@ def exportar_reservas_admin():
                 df[col].astype(str).map(len).max(),
                 len(col)
             ) + 2
-            worksheet.column_dimensions[chr(65 + idx)].width = min(max_length, 50)
+            worksheet.column_dimensions[get_column_letter(idx + 1)].width = min(max_length, 50)
     
     output.seek(0)
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -1788,11 +3369,12 @@ def admin_reservas():
     usuario_param = request.args.get('usuario_id', '')
     fecha_venta_param = request.args.get('fecha_venta', '')
     fecha_viaje_param = request.args.get('fecha_viaje', '')
+    margen_param = request.args.get('margen', '')
     page = request.args.get('page', 1, type=int)
     per_page = 10
     
     # Construir consulta base
-    query = Reserva.query.join(Usuario)
+    query = Reserva.query
     
     # Aplicar filtros basados en el rol del usuario
     if current_user.rol in ['ejecutivo', 'analista']:
@@ -1800,12 +3382,12 @@ def admin_reservas():
         query = query.filter(Reserva.usuario_id == current_user.id)
     elif current_user.rol == 'controling':
         # Solo ver reservas de su empresa
-        query = query.filter(Usuario.empresa_id == current_user.empresa_id)
+        query = query.filter(Reserva.empresa_id == current_user.empresa_id)
     
     # Aplicar filtros adicionales
     selected_empresa_id = empresa_param
     if empresa_param and current_user.rol in ['master', 'admin']:
-        query = query.filter(Usuario.empresa_id == int(empresa_param))
+        query = query.filter(Reserva.empresa_id == int(empresa_param))
     
     selected_usuario_id = usuario_param
     if usuario_param and current_user.rol in ['master', 'admin', 'controling']:
@@ -1815,15 +3397,20 @@ def admin_reservas():
     if fecha_venta_param:
         # fecha_venta_param viene como 'YYYY-MM' del input type=month
         year, month = map(int, fecha_venta_param.split('-'))
-        query = query.filter(db.extract('year', Reserva.fecha_venta) == year,
-                             db.extract('month', Reserva.fecha_venta) == month)
+        inicio, fin = obtener_rango_mes(year, month)
+        query = query.filter(Reserva.fecha_venta >= inicio, Reserva.fecha_venta < fin)
 
     selected_fecha_viaje = fecha_viaje_param
     if fecha_viaje_param:
         # fecha_viaje_param viene como 'YYYY-MM' del input type=month
         year, month = map(int, fecha_viaje_param.split('-'))
-        query = query.filter(db.extract('year', Reserva.fecha_viaje) == year,
-                             db.extract('month', Reserva.fecha_viaje) == month)
+        inicio, fin = obtener_rango_mes(year, month)
+        query = query.filter(Reserva.fecha_viaje >= inicio, Reserva.fecha_viaje < fin)
+
+    # Ventas con margen negativo: filtro directo sobre la columna generada ganancia_total
+    selected_margen = margen_param
+    if margen_param == 'negativo':
+        query = query.filter(Reserva.ganancia_total < 0)
     
     # Obtener datos para los filtros
     empresas = []
@@ -1847,7 +3434,8 @@ def admin_reservas():
                          selected_empresa_id=selected_empresa_id,
                          selected_usuario_id=selected_usuario_id,
                          selected_fecha_venta=selected_fecha_venta,
-                         selected_fecha_viaje=selected_fecha_viaje)
+                         selected_fecha_viaje=selected_fecha_viaje,
+                         selected_margen=selected_margen)
 
 # =====================
 # ADMIN / GESTION
@@ -1873,12 +3461,20 @@ def control_gestion_clientes():
 @rol_required('admin', 'master', 'controling')
 @empresa_tiene_gestion_required
 def postventa():
-    selected_postventa = request.args.get('postventa', '')
+    # Por defecto, la cola de pendientes: viajes terminados sin postventa
+    selected_postventa = request.args.get('postventa', 'no')
+    dias, selected_empresa_id = filtros_cola_desde_request('POSTVENTA_DIAS_TRAS_VIAJE')
     empresas = Empresa.query.all()
-    contexto = obtener_datos_postventa(empresas, selected_postventa)
+    try:
+        contexto = obtener_datos_postventa(empresas, selected_postventa, dias, selected_empresa_id,
+                                           request.args.get('cursor') or None)
+    except BadSignature:
+        flash('El enlace de paginación no es válido; se muestra la primera página.', 'warning')
+        return redirect(url_for('postventa', postventa=selected_postventa, dias=dias, empresa_id=selected_empresa_id or None))
     return render_template('postventa.html', **contexto)
 
 @app.route('/ranking_ejecutivos')
+@lectura_en_replica
 @login_required
 @rol_required('admin', 'master', 'controling')
 @empresa_tiene_gestion_required
@@ -1886,6 +3482,38 @@ def ranking_ejecutivos():
     selected_mes_str = request.args.get('mes', '')
     selected_empresa_id = request.args.get('empresa_id', '')
     empresas = Empresa.query.all()
+    # Mes cerrado: servir el ranking congelado en el snapshot
+    cierre = None
+    if selected_empresa_id and '-' in selected_mes_str:
+        try:
+            year, month = map(int, selected_mes_str.split('-'))
+            cierre = obtener_cierre_mes(selected_empresa_id, year, month)
+        except ValueError:
+            cierre = None
+    if cierre:
+        ranking_data = [{
+            'ejecutivo': r.ejecutivo,
+            'num_ventas': r.num_ventas,
+            'ganancia_bruta': float(r.total_ganancia or 0),
+        } for r in cierre.ranking]
+        totales = {
+            'total_ventas_global': float(sum(r.total_ventas or 0 for r in cierre.ranking)),
+            'total_costos_global': float(sum(r.total_costos or 0 for r in cierre.ranking)),
+            'total_comisiones_global': float(sum(r.total_comisiones or 0 for r in cierre.ranking)),
+            'total_bonos_global': float(sum(r.total_bonos or 0 for r in cierre.ranking)),
+            'total_ganancia_neta_global': float(sum(r.total_ganancia or 0 for r in cierre.ranking)),
+            'total_ventas_realizadas_global': sum(r.num_ventas or 0 for r in cierre.ranking)
+        }
+        html = render_template(
+            'ranking_ejecutivos.html',
+            ranking_data=ranking_data,
+            empresas=empresas,
+            selected_mes_str=selected_mes_str,
+            selected_empresa_id=selected_empresa_id,
+            meses_anteriores=obtener_meses_anteriores(),
+            totales=totales
+        )
+        return respuesta_periodo_cerrado(html, cierre)
     contexto = obtener_datos_ranking_ejecutivos(selected_mes_str, selected_empresa_id, empresas)
     # Adaptar los datos para la plantilla: ranking_data debe ser una lista de dicts con las claves esperadas
     ranking_data = []
@@ -1906,6 +3534,7 @@ def ranking_ejecutivos():
     )
 
 @app.route('/reporte_detalle_ventas')
+@lectura_en_replica
 @login_required
 @rol_required('admin', 'master', 'controling')
 def reporte_detalle_ventas():
@@ -1923,18 +3552,39 @@ def reporte_detalle_ventas():
         today = datetime.now()
         year, month = today.year, today.month
         selected_mes_str = today.strftime('%Y-%m')
+    # Meses anteriores para el filtro (últimos 12 meses)
+    fecha_actual = datetime.now()
+    meses_anteriores = []
+    for i in range(12):
+        fecha_mes = fecha_actual - timedelta(days=30*i)
+        mes_str = fecha_mes.strftime('%Y-%m')
+        mes_nombre = obtener_nombre_mes(fecha_mes.month)
+        meses_anteriores.append(f"{mes_str} ({mes_nombre})")
+
+    # Mes cerrado: servir directamente desde el snapshot
+    cierre = obtener_cierre_mes(empresa_en_alcance(selected_empresa_id), year, month)
+    if cierre:
+        datos_comisiones = [dict(
+            ejecutivo=d.ejecutivo,
+            producto=d.producto,
+            **{campo: getattr(d, campo) for campo in CAMPOS_DETALLE_VENTAS}
+        ) for d in cierre.detalles]
+        totales = {campo: float(sum(getattr(d, campo) or 0 for d in cierre.detalles)) for campo in CAMPOS_DETALLE_VENTAS}
+        html = render_template('reporte_detalle_ventas.html',
+            datos_comisiones=datos_comisiones,
+            totales=totales,
+            selected_mes_str=selected_mes_str,
+            meses_anteriores=meses_anteriores,
+            empresas=empresas,
+            selected_empresa_id=selected_empresa_id,
+            cierre=cierre
+        )
+        return respuesta_periodo_cerrado(html, cierre)
+
     # Filtrar reservas por empresa y mes
-    reservas_query = Reserva.query.join(Usuario)
-    reservas_query = reservas_query.filter(
-        db.extract('year', Reserva.fecha_venta) == year,
-        db.extract('month', Reserva.fecha_venta) == month,
-        Usuario.rol.in_(['ejecutivo', 'analista', 'controling'])
+    reservas = reservas_del_periodo(
+        empresa_en_alcance(selected_empresa_id), year, month, roles=ROLES_ESTADOS_DE_VENTA
     )
-    if selected_empresa_id and current_user.rol in ['master', 'admin']:
-        reservas_query = reservas_query.filter(Usuario.empresa_id == int(selected_empresa_id))
-    elif current_user.rol == 'controling':
-        reservas_query = reservas_query.filter(Usuario.empresa_id == current_user.empresa_id)
-    reservas = reservas_query.all()
     print(f"[DEBUG reporte_detalle_ventas] Total reservas filtradas: {len(reservas)}")
     for r in reservas:
         print(f"[DEBUG reporte_detalle_ventas] Reserva: id={r.id}, usuario_id={r.usuario_id}, nombre_ejecutivo={getattr(r, 'nombre_ejecutivo', None)}, username={(r.usuario.username if r.usuario else None)}, rol={(r.usuario.rol if r.usuario else None)}")
@@ -1957,7 +3607,9 @@ def reporte_detalle_ventas():
         'comision_agencia': 0.0
     }
     for reserva in reservas:
-        comision_ejecutivo, comision_agencia, ganancia_total, comision_ejecutivo_porcentaje, _ = calcular_comisiones(reserva, reserva.usuario)
+        comision_ejecutivo = reserva.comision_ejecutivo or 0
+        comision_agencia = reserva.comision_agencia or 0
+        ganancia_total = reserva.ganancia_total or 0
         bonos = reserva.bonos or 0.0
         # Obtener nombre del ejecutivo
         if getattr(reserva, 'nombre_ejecutivo', None):
@@ -1968,6 +3620,7 @@ def reporte_detalle_ventas():
             ejecutivo = ''
         datos_comisiones.append({
             'ejecutivo': ejecutivo,
+            'producto': reserva.producto,
             'reserva': reserva,
             'precio_venta_total': reserva.precio_venta_total,
             'hotel_neto': reserva.hotel_neto,
@@ -1996,24 +3649,18 @@ def reporte_detalle_ventas():
         totales['ganancia_total'] += float(ganancia_total or 0)
         totales['comision_ejecutivo'] += float(comision_ejecutivo or 0)
         totales['comision_agencia'] += float(comision_agencia or 0)
-    # Meses anteriores para el filtro (últimos 12 meses)
-    fecha_actual = datetime.now()
-    meses_anteriores = []
-    for i in range(12):
-        fecha_mes = fecha_actual - timedelta(days=30*i)
-        mes_str = fecha_mes.strftime('%Y-%m')
-        mes_nombre = obtener_nombre_mes(fecha_mes.month)
-        meses_anteriores.append(f"{mes_str} ({mes_nombre})")
     return render_template('reporte_detalle_ventas.html',
         datos_comisiones=datos_comisiones,
         totales=totales,
         selected_mes_str=selected_mes_str,
         meses_anteriores=meses_anteriores,
         empresas=empresas,
-        selected_empresa_id=selected_empresa_id
+        selected_empresa_id=selected_empresa_id,
+        cierre=None
     )
 
 @app.route('/reporte_ventas_general_mensual')
+@lectura_en_replica
 @login_required
 @rol_required('admin', 'master', 'controling')
 @empresa_tiene_gestion_required
@@ -2021,9 +3668,101 @@ def reporte_ventas_general_mensual():
     selected_mes_str = request.args.get('mes', '')
     selected_empresa_id = request.args.get('empresa_id', '')
     empresas = Empresa.query.all()
-    contexto = obtener_datos_reporte_ventas_general_mensual(selected_mes_str, selected_empresa_id, empresas)
+    contexto = obtener_datos_reporte_ventas_general_mensual(selected_mes_str, empresa_en_alcance(selected_empresa_id), empresas)
+    contexto['selected_empresa_id'] = selected_empresa_id
     return render_template('reporte_ventas_general_mensual.html', **contexto)
 
+@app.route('/api/resumen_estados_venta')
+@lectura_en_replica
+@login_required
+@rol_required('admin', 'master', 'controling')
+@empresa_tiene_gestion_required
+def api_resumen_estados_venta():
+    """Totales y contadores de estado de ventas del mes (JSON para los gráficos)"""
+    selected_mes_str = request.args.get('mes', '')
+    selected_empresa_id = request.args.get('empresa_id', '')
+    try:
+        year, month = map(int, selected_mes_str.split('-'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Formato de mes inválido (YYYY-MM).'}), 400
+    resumen = obtener_resumen_ventas_mes(year, month, empresa_en_alcance(selected_empresa_id))
+    return jsonify({'success': True, 'mes': selected_mes_str, **resumen})
+
+@app.route('/api/estados_de_venta/transicion', methods=['POST'])
+@login_required
+@rol_required('admin', 'master', 'controling')
+@empresa_tiene_gestion_required
+def transicion_estados_venta():
+    """
+    Cambia en bloque estado_pago / venta_cobrada / venta_emitida de las ventas del mes:
+    {"mes": "YYYY-MM", "empresa_id": ..., "ids": [...] | "todas": true, "cambios": {"estado_pago": "Pagado"}}.
+    Un solo UPDATE con el mismo alcance que la página (empresa, mes de venta y roles); los meses
+    cerrados no se tocan. Devuelve los contadores del mes ya actualizados.
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'El cuerpo debe ser un objeto JSON.'}), 400
+    try:
+        year, month = map(int, str(data.get('mes', '')).split('-'))
+        inicio, fin = obtener_rango_mes(year, month)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Formato de mes inválido (YYYY-MM).'}), 400
+    cambios = data.get('cambios') or {}
+    if not isinstance(cambios, dict):
+        return jsonify({'success': False, 'message': 'Los cambios deben ser un objeto {campo: estado}.'}), 400
+    valores = {campo: valor for campo, valor in cambios.items() if valor}
+    for campo, valor in valores.items():
+        if valor not in TRANSICIONES_ESTADO_VENTA.get(campo, ()):
+            return jsonify({'success': False, 'message': f'Cambio inválido: {campo} = {valor}.'}), 400
+    if not valores:
+        return jsonify({'success': False, 'message': 'No hay estados para cambiar.'}), 400
+    ids = data.get('ids') or []
+    if not data.get('todas') and not ids:
+        return jsonify({'success': False, 'message': 'Selecciona al menos una venta.'}), 400
+    try:
+        ids = [int(reserva_id) for reserva_id in ids]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Identificadores de venta inválidos.'}), 400
+
+    try:
+        empresa_id = empresa_en_alcance(data.get('empresa_id') or '')
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Empresa inválida.'}), 400
+    if mes_cerrado(empresa_id, inicio):
+        return jsonify({'success': False, 'message': 'El mes está cerrado; sus estados no se pueden cambiar.'}), 409
+
+    condiciones = [
+        Reserva.fecha_venta >= inicio,
+        Reserva.fecha_venta < fin,
+        Reserva.usuario_id.in_(db.select(Usuario.id).where(Usuario.rol.in_(ROLES_ESTADOS_DE_VENTA))),
+    ]
+    if empresa_id:
+        condiciones.append(Reserva.empresa_id == empresa_id)
+    else:
+        # Todas las empresas: saltar las que ya cerraron este mes
+        cerradas = db.select(CierreMes.empresa_id).where(CierreMes.periodo == f"{year:04d}-{month:02d}")
+        condiciones.append(db.or_(Reserva.empresa_id.is_(None), Reserva.empresa_id.notin_(cerradas)))
+    if not data.get('todas'):
+        condiciones.append(Reserva.id.in_(ids))
+    actualizadas = db.session.execute(
+        db.update(Reserva).where(*condiciones).values(**valores).execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+
+    conteo = obtener_resumen_ventas_mes(year, month, empresa_id, roles=ROLES_ESTADOS_DE_VENTA)
+    return jsonify({
+        'success': True,
+        'message': f'{actualizadas} venta(s) actualizada(s).',
+        'actualizadas': actualizadas,
+        'cambios': valores,
+        'resumen': {
+            'num_ventas': conteo['num_ventas'],
+            'num_ventas_cobradas': conteo['cobradas'],
+            'num_ventas_emitidas': conteo['emitidas'],
+            'num_ventas_pagadas': conteo['pagadas'],
+        },
+    })
+
 def obtener_datos_reporte_ventas_general_mensual(selected_mes_str, selected_empresa_id, empresas):
     meses_anteriores = obtener_meses_anteriores()
     # Soportar input tipo YYYY-MM (input type="month")
@@ -2058,75 +3797,17 @@ def obtener_datos_reporte_ventas_general_mensual(selected_mes_str, selected_empr
             'selected_empresa_id': selected_empresa_id
         }
 
-    reservas_query = Reserva.query.join(Usuario).filter(
-        Reserva.fecha_venta >= start_date.strftime('%Y-%m-%d'),
-        Reserva.fecha_venta <= end_date.strftime('%Y-%m-%d')
-    )
-    if selected_empresa_id:
-        reservas_query = reservas_query.filter(Usuario.empresa_id == int(selected_empresa_id))
-
-    total_ventas_mes = 0.0
-    total_costos_mes = 0.0
-    comision_total_ejecutivos = 0.0
-    comision_total_agencia = 0.0
-    pagado = 0
-    no_pagado = 0
-    cobrada = 0
-    no_cobrada = 0
-    emitida = 0
-    no_emitida = 0
-
-    for reserva in reservas_query.all():
-        comision_ejecutivo, comision_agencia, ganancia_total, _, _ = calcular_comisiones(reserva, reserva.usuario)
-        total_neto = (
-            reserva.hotel_neto +
-            reserva.vuelo_neto +
-            reserva.traslado_neto +
-            reserva.seguro_neto +
-            reserva.circuito_neto +
-            reserva.crucero_neto +
-            reserva.excursion_neto +
-            reserva.paquete_neto
-        )
-        comision_usuario = comision_ejecutivo
-        ganancia_neta = ganancia_total - comision_usuario
-
-        total_ventas_mes += float(reserva.precio_venta_total or 0)
-        total_costos_mes += float(total_neto or 0)
-        comision_total_ejecutivos += float(comision_usuario)
-        comision_total_agencia += float(ganancia_neta)
-
-        # Estado de pago
-        if (reserva.estado_pago or '').strip().lower() == 'pagado':
-            pagado += 1
-        else:
-            no_pagado += 1
-        # Venta cobrada
-        if (reserva.venta_cobrada or '').strip().lower() == 'cobrada':
-            cobrada += 1
-        else:
-            no_cobrada += 1
-        # Venta emitida
-        if (reserva.venta_emitida or '').strip().lower() == 'emitida':
-            emitida += 1
-        else:
-            no_emitida += 1
-
-    ganancia_total_mes = total_ventas_mes - total_costos_mes
-
-    datos_estado_pago = [pagado, no_pagado]
-    datos_venta_cobrada = [cobrada, no_cobrada]
-    datos_venta_emitida = [emitida, no_emitida]
+    resumen = obtener_resumen_ventas_mes(start_date.year, start_date.month, selected_empresa_id)
 
     return {
-        'ganancia_total_mes': ganancia_total_mes,
-        'comision_total_ejecutivos': comision_total_ejecutivos,
-        'comision_total_agencia': comision_total_agencia,
+        'ganancia_total_mes': resumen['ganancia_total'],
+        'comision_total_ejecutivos': resumen['comision_ejecutivos'],
+        'comision_total_agencia': resumen['comision_agencia'],
         'selected_mes_str': selected_mes_str,
         'meses_anteriores': meses_anteriores,
-        'datos_estado_pago': datos_estado_pago,
-        'datos_venta_cobrada': datos_venta_cobrada,
-        'datos_venta_emitida': datos_venta_emitida,
+        'datos_estado_pago': resumen['datos_estado_pago'],
+        'datos_venta_cobrada': resumen['datos_venta_cobrada'],
+        'datos_venta_emitida': resumen['datos_venta_emitida'],
         'empresas': empresas,
         'selected_empresa_id': selected_empresa_id
     }
@@ -2136,33 +3817,22 @@ def obtener_datos_reporte_ventas_general_mensual(selected_mes_str, selected_empr
 @rol_required('admin', 'master' ,'controling')
 @empresa_tiene_gestion_required
 def marketing():
-    selected_opinion = request.args.get('opinion', '')
+    # Por defecto, la cola de pendientes: viajes ya iniciados sin opinión
+    selected_opinion = request.args.get('opinion', 'no')
+    dias, selected_empresa_id = filtros_cola_desde_request('MARKETING_DIAS_TRAS_VIAJE')
     empresas = Empresa.query.all()
-    contexto = obtener_datos_marketing(selected_opinion, empresas)
+    try:
+        contexto = obtener_datos_marketing(selected_opinion, empresas, dias, selected_empresa_id,
+                                           request.args.get('cursor') or None)
+    except BadSignature:
+        flash('El enlace de paginación no es válido; se muestra la primera página.', 'warning')
+        return redirect(url_for('marketing', opinion=selected_opinion, dias=dias, empresa_id=selected_empresa_id or None))
     return render_template('marketing.html', **contexto)
 
-def obtener_datos_marketing(selected_opinion, empresas):
-    reservas_query = Reserva.query
-    if selected_opinion:
-        reservas_query = reservas_query.filter(Reserva.opinion == selected_opinion)
-    reservas = reservas_query.order_by(Reserva.fecha_viaje.desc()).all()
-    reservas_data = []
-    for r in reservas:
-        reservas_data.append({
-            'id': r.id,
-            'nombre_pasajero': r.nombre_pasajero,
-            'destino': r.destino,
-            'fecha_viaje': r.fecha_viaje,
-            'telefono_pasajero': r.telefono_pasajero,
-            'mail_pasajero': r.mail_pasajero,
-            'opinion': getattr(r, 'opinion', ''),
-            'experiencia': getattr(r, 'experiencia', '')
-        })
-    return {
-        'reservas': reservas_data,
-        'empresas': empresas,
-        'selected_opinion': selected_opinion
-    }
+def obtener_datos_marketing(selected_opinion, empresas, dias, selected_empresa_id='', cursor=None):
+    contexto = datos_cola_seguimiento('marketing', empresas, selected_opinion, dias, selected_empresa_id, cursor)
+    contexto['selected_opinion'] = selected_opinion
+    return contexto
 
 @app.route('/api/update_reserva_opinion_postventa', methods=['POST'])
 def update_reserva_opinion_postventa():
@@ -2199,7 +3869,88 @@ def update_reserva_opinion_postventa():
     db.session.commit()
     return jsonify({'success': True, 'message': 'Reserva actualizada correctamente.'})
 
+# Campos editables desde las listas de postventa/marketing -> opciones válidas (None: texto libre)
+CAMPOS_SEGUIMIENTO_RESERVA = {
+    'opinion': OPINION_OPTIONS,
+    'postventa': POSTVENTA_OPTIONS,
+    'estado_postventa': ESTADO_POSTVENTA_OPTIONS,
+    'experiencia': None,
+    'seguimiento': None,
+}
+MAX_CAMBIOS_POR_LOTE = 1000
+
+@app.route('/api/update_reservas_opinion_postventa', methods=['POST'])
+@login_required
+@rol_required('admin', 'master', 'controling')
+def update_reservas_opinion_postventa():
+    """
+    Guarda en lote los cambios de opinión/postventa: {"cambios": [{"reserva_id": 1, "opinion": "si"}, ...]}.
+    Cada campo se actualiza con un único UPDATE ... SET campo = CASE id WHEN ... END WHERE id IN (...),
+    todo en una transacción. Las reservas inexistentes o de otra empresa se informan en `omitidas`.
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'El cuerpo debe ser un objeto JSON.'}), 400
+    cambios = data.get('cambios')
+    if not isinstance(cambios, list) or not cambios:
+        return jsonify({'success': False, 'message': 'Se requiere una lista de cambios.'}), 400
+    if len(cambios) > MAX_CAMBIOS_POR_LOTE:
+        return jsonify({'success': False, 'message': f'Máximo {MAX_CAMBIOS_POR_LOTE} cambios por lote.'}), 400
+
+    # Agrupar por campo; si una reserva viene repetida, gana el último valor
+    valores_por_campo = {campo: {} for campo in CAMPOS_SEGUIMIENTO_RESERVA}
+    for cambio in cambios:
+        try:
+            reserva_id = int(cambio.get('reserva_id'))
+        except (AttributeError, TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Cada cambio requiere un reserva_id numérico.'}), 400
+        for campo, opciones in CAMPOS_SEGUIMIENTO_RESERVA.items():
+            valor = cambio.get(campo)
+            if valor is None:
+                continue
+            if opciones is not None:
+                valor = str(valor).lower()
+                if valor not in opciones:
+                    return jsonify({'success': False, 'message': f'Valor inválido para {campo} en la reserva {reserva_id}.'}), 400
+            valores_por_campo[campo][reserva_id] = valor
+
+    ids = set().union(*(valores.keys() for valores in valores_por_campo.values()))
+    if not ids:
+        return jsonify({'success': False, 'message': 'No hay campos para actualizar.'}), 400
+    permitidas = db.session.query(Reserva.id).filter(Reserva.id.in_(ids))
+    if current_user.rol == 'controling':
+        permitidas = permitidas.filter(Reserva.empresa_id == current_user.empresa_id)
+    permitidas = {fila.id for fila in permitidas}
+
+    for campo, valores in valores_por_campo.items():
+        valores = {reserva_id: valor for reserva_id, valor in valores.items() if reserva_id in permitidas}
+        if not valores:
+            continue
+        columna = getattr(Reserva, campo)
+        db.session.execute(
+            db.update(Reserva)
+            .where(Reserva.id.in_(valores))
+            .values({campo: db.cast(db.case(valores, value=Reserva.id), columna.type)})
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    return jsonify({
+        'success': True,
+        'message': f'{len(permitidas)} reserva(s) actualizada(s).',
+        'actualizadas': sorted(permitidas),
+        'omitidas': sorted(ids - permitidas),
+    })
+
+# Estados que se pueden cambiar en bloque desde estados_de_venta -> valores válidos
+TRANSICIONES_ESTADO_VENTA = {
+    'estado_pago': ESTADO_PAGO_OPTIONS,
+    'venta_cobrada': VENTA_COBRADA_OPTIONS,
+    'venta_emitida': VENTA_EMITIDA_OPTIONS,
+}
+ROLES_ESTADOS_DE_VENTA = ['ejecutivo', 'analista', 'controling']
+
 @app.route('/estados_de_venta')
+@lectura_en_replica
 @login_required
 @rol_required('admin', 'master', 'controling')
 @empresa_tiene_gestion_required
@@ -2219,31 +3970,49 @@ def estados_de_venta():
         year, month = today.year, today.month
         selected_mes_str = today.strftime('%Y-%m')
 
-    # Filtrar reservas por fecha de venta (no fecha de viaje)
-    reservas_query = Reserva.query.join(Usuario)
-    reservas_query = reservas_query.filter(
-        db.extract('year', Reserva.fecha_venta) == year,
-        db.extract('month', Reserva.fecha_venta) == month
-    )
-    if selected_empresa_id and current_user.rol in ['master', 'admin']:
-        reservas_query = reservas_query.filter(Usuario.empresa_id == int(selected_empresa_id))
-    elif current_user.rol == 'controling':
-        reservas_query = reservas_query.filter(Usuario.empresa_id == current_user.empresa_id)
+    # Mes cerrado: servir filas y contadores desde el snapshot
+    cierre = obtener_cierre_mes(empresa_en_alcance(selected_empresa_id), year, month)
+    if cierre:
+        estados_data = [{
+            'ejecutivo': d.ejecutivo,
+            'id': d.reserva_id,
+            'fecha_viaje': d.fecha_viaje.strftime('%Y-%m-%d') if d.fecha_viaje else '',
+            'producto': d.producto,
+            'destino': d.destino,
+            'localizadores': d.localizadores,
+            'nombre_pasajero': d.nombre_pasajero,
+            'telefono_pasajero': d.telefono_pasajero,
+            'mail_pasajero': d.mail_pasajero,
+            'estado_pago': d.estado_pago,
+            'venta_cobrada': d.venta_cobrada,
+            'venta_emitida': d.venta_emitida,
+        } for d in cierre.detalles]
+        resumen = {
+            'num_ventas': cierre.num_ventas,
+            'num_ventas_cobradas': cierre.num_ventas_cobradas,
+            'num_ventas_emitidas': cierre.num_ventas_emitidas,
+            'num_ventas_pagadas': cierre.num_ventas_pagadas
+        }
+        html = render_template('estados_de_venta.html',
+                             estados_data=estados_data,
+                             resumen=resumen,
+                             selected_mes_str=selected_mes_str,
+                             empresas=Empresa.query.all(),
+                             selected_empresa_id=selected_empresa_id,
+                             cierre=cierre)
+        return respuesta_periodo_cerrado(html, cierre)
 
+    # Filtrar reservas por fecha de venta (no fecha de viaje)
     # Incluir ejecutivos, analistas y controling
-    reservas_query = reservas_query.filter(Usuario.rol.in_(['ejecutivo', 'analista', 'controling']))
-
-    reservas = reservas_query.all()
+    reservas = reservas_del_periodo(
+        empresa_en_alcance(selected_empresa_id), year, month, roles=['ejecutivo', 'analista', 'controling']
+    )
     print(f"[DEBUG estados_de_venta] Total reservas filtradas: {len(reservas)}")
     for r in reservas:
         print(f"[DEBUG estados_de_venta] Reserva: id={r.id}, usuario_id={r.usuario_id}, nombre_ejecutivo={getattr(r, 'nombre_ejecutivo', None)}, username={(r.usuario.username if r.usuario else None)}, rol={(r.usuario.rol if r.usuario else None)}")
 
     # Nueva estructura: lista de reservas con los campos requeridos
     estados_data = []
-    num_ventas = 0
-    num_ventas_cobradas = 0
-    num_ventas_emitidas = 0
-    num_ventas_pagadas = 0
     for reserva in reservas:
         estados_data.append({
             'ejecutivo': reserva.nombre_ejecutivo or (reserva.usuario.username if reserva.usuario else 'N/A'),
@@ -2259,19 +4028,17 @@ def estados_de_venta():
             'venta_cobrada': getattr(reserva, 'venta_cobrada', ''),
             'venta_emitida': getattr(reserva, 'venta_emitida', ''),
         })
-        num_ventas += 1
-        if (getattr(reserva, 'venta_cobrada', '').strip().lower() == 'cobrada'):
-            num_ventas_cobradas += 1
-        if (getattr(reserva, 'venta_emitida', '').strip().lower() == 'emitida'):
-            num_ventas_emitidas += 1
-        if (getattr(reserva, 'estado_pago', '').strip().lower() == 'pagado'):
-            num_ventas_pagadas += 1
 
+    # Contadores calculados en SQL con los mismos filtros
+    conteo = obtener_resumen_ventas_mes(
+        year, month, empresa_en_alcance(selected_empresa_id),
+        roles=['ejecutivo', 'analista', 'controling']
+    )
     resumen = {
-        'num_ventas': num_ventas,
-        'num_ventas_cobradas': num_ventas_cobradas,
-        'num_ventas_emitidas': num_ventas_emitidas,
-        'num_ventas_pagadas': num_ventas_pagadas
+        'num_ventas': conteo['num_ventas'],
+        'num_ventas_cobradas': conteo['cobradas'],
+        'num_ventas_emitidas': conteo['emitidas'],
+        'num_ventas_pagadas': conteo['pagadas']
     }
 
     empresas = Empresa.query.all()
@@ -2281,11 +4048,317 @@ def estados_de_venta():
                          resumen=resumen,
                          selected_mes_str=selected_mes_str,
                          empresas=empresas,
-                         selected_empresa_id=selected_empresa_id)
+                         selected_empresa_id=selected_empresa_id,
+                         cierre=None)
 
+# =====================
+# COBRANZA ANTES DEL VIAJE
+# =====================
+def cobranza_pre_viaje(dias, empresa_id=None, usuario_id=None):
+    """
+    Salidas de los próximos `dias` días (desde hoy) con la venta sin cobrar o sin pagar,
+    agrupadas por ejecutivo. Recorre solo el índice parcial de reservas impagas por fecha_viaje.
+    Por reserva: por_cobrar (precio de venta si no está cobrada) y por_pagar (neto si no está pagada).
+    Devuelve una lista de {'usuario_id', 'ejecutivo', 'correo', 'reservas', 'por_cobrar', 'por_pagar'}.
+    """
+    hoy = datetime.now().date()
+    por_cobrar = db.case((Reserva.venta_cobrada == 'No Cobrada', db.func.coalesce(Reserva.precio_venta_total, 0)), else_=0)
+    por_pagar = db.case((Reserva.estado_pago == 'No Pagado', Reserva.precio_venta_neto), else_=0)
+    consulta = db.select(
+        Reserva.id, Reserva.fecha_viaje, Reserva.nombre_pasajero, Reserva.telefono_pasajero,
+        Reserva.destino, Reserva.producto, Reserva.localizadores, Reserva.estado_pago,
+        Reserva.venta_cobrada, Reserva.usuario_id, Usuario.nombre, Usuario.apellidos, Usuario.correo,
+        por_cobrar.label('por_cobrar'), por_pagar.label('por_pagar')
+    ).join(Usuario, Reserva.usuario_id == Usuario.id).where(
+        db.text(RESERVA_IMPAGA_SQL),
+        Reserva.fecha_viaje >= hoy,
+        Reserva.fecha_viaje <= hoy + timedelta(days=dias),
+    ).order_by(Reserva.fecha_viaje, Reserva.id)
+    if empresa_id:
+        consulta = consulta.where(Reserva.empresa_id == empresa_id)
+    if usuario_id:
+        consulta = consulta.where(Reserva.usuario_id == usuario_id)
+
+    grupos = {}
+    for fila in db.session.execute(consulta):
+        grupo = grupos.setdefault(fila.usuario_id, {
+            'usuario_id': fila.usuario_id,
+            'ejecutivo': f"{fila.nombre} {fila.apellidos}",
+            'correo': fila.correo,
+            'reservas': [],
+            'por_cobrar': Decimal('0'),
+            'por_pagar': Decimal('0'),
+        })
+        reserva = dict(fila._mapping)
+        reserva['dias_para_viaje'] = (fila.fecha_viaje - hoy).days
+        grupo['reservas'].append(reserva)
+        grupo['por_cobrar'] += safe_decimal(fila.por_cobrar)
+        grupo['por_pagar'] += safe_decimal(fila.por_pagar)
+    return sorted(grupos.values(), key=lambda g: g['ejecutivo'])
+
+def dias_cobranza_desde_request():
+    return min(max(request.args.get('dias', app.config['COBRANZA_DIAS_ANTES_VIAJE'], type=int), 0), 365)
+
+@app.route('/cobranza_pre_viaje')
+@lectura_en_replica
+@login_required
+@rol_required('admin', 'master', 'controling')
+@empresa_tiene_gestion_required
+def cobranza_pre_viaje_view():
+    """Salidas próximas impagas por ejecutivo, con los montos pendientes"""
+    dias = dias_cobranza_desde_request()
+    selected_empresa_id = request.args.get('empresa_id', '')
+    grupos = cobranza_pre_viaje(dias, empresa_en_alcance(selected_empresa_id))
+    return render_template('cobranza_pre_viaje.html',
+                           grupos=grupos,
+                           dias=dias,
+                           total_por_cobrar=sum((g['por_cobrar'] for g in grupos), Decimal('0')),
+                           total_por_pagar=sum((g['por_pagar'] for g in grupos), Decimal('0')),
+                           empresas=Empresa.query.all(),
+                           selected_empresa_id=selected_empresa_id)
+
+@app.route('/api/cobranza_pre_viaje')
+@lectura_en_replica
+@login_required
+@rol_required('admin', 'master', 'controling', 'ejecutivo', 'analista')
+def api_cobranza_pre_viaje():
+    """JSON de la cobranza previa al viaje; ejecutivos y analistas ven solo sus reservas."""
+    dias = dias_cobranza_desde_request()
+    if current_user.rol in ['ejecutivo', 'analista']:
+        grupos = cobranza_pre_viaje(dias, current_user.empresa_id, current_user.id)
+    else:
+        grupos = cobranza_pre_viaje(dias, empresa_en_alcance(request.args.get('empresa_id', '')))
+    for grupo in grupos:
+        grupo['por_cobrar'] = float(grupo['por_cobrar'])
+        grupo['por_pagar'] = float(grupo['por_pagar'])
+        for reserva in grupo['reservas']:
+            reserva['fecha_viaje'] = reserva['fecha_viaje'].isoformat()
+            reserva['por_cobrar'] = float(reserva['por_cobrar'] or 0)
+            reserva['por_pagar'] = float(reserva['por_pagar'] or 0)
+            for campo in ('nombre', 'apellidos', 'correo'):
+                reserva.pop(campo)
+    return jsonify({'success': True, 'dias': dias, 'ejecutivos': grupos})
+
+def texto_resumen_cobranza(grupo, dias):
+    lineas = [f"Hola {grupo['ejecutivo']},", '',
+              f"Estas ventas salen en los próximos {dias} días y tienen pagos pendientes:", '']
+    for r in grupo['reservas']:
+        pendientes = []
+        if r['venta_cobrada'] == 'No Cobrada':
+            pendientes.append(f"por cobrar ${formato_miles(r['por_cobrar'])}")
+        if r['estado_pago'] == 'No Pagado':
+            pendientes.append(f"por pagar ${formato_miles(r['por_pagar'])}")
+        lineas.append(f"- {r['fecha_viaje'].strftime('%d-%m-%Y')} (en {r['dias_para_viaje']} días) "
+                      f"{r['nombre_pasajero'] or ''} / {r['destino'] or ''}: {', '.join(pendientes)}")
+    lineas += ['', f"Total por cobrar: ${formato_miles(grupo['por_cobrar'])}",
+               f"Total por pagar: ${formato_miles(grupo['por_pagar'])}"]
+    return '\n'.join(lineas)
+
+@app.cli.command('resumen-cobranza')
+@click.option('--dias', type=int, default=None, help='Días hacia adelante (por defecto COBRANZA_DIAS_ANTES_VIAJE).')
+@click.option('--empresa-id', type=int, default=None, help='Solo las reservas de esta empresa.')
+@click.option('--enviar/--no-enviar', default=True, help='Enviar por correo o solo mostrar el resumen.')
+def resumen_cobranza_command(dias, empresa_id, enviar):
+    """Resumen diario de salidas impagas: un correo por ejecutivo (pensado para un cron diario)."""
+    dias = app.config['COBRANZA_DIAS_ANTES_VIAJE'] if dias is None else dias
+    grupos = cobranza_pre_viaje(dias, empresa_id)
+    enviar = enviar and bool(app.config['MAIL_SERVER'])
+    for grupo in grupos:
+        texto = texto_resumen_cobranza(grupo, dias)
+        if enviar and grupo['correo']:
+            msg = Message(f"Cobranza pendiente: {len(grupo['reservas'])} salida(s) próxima(s)",
+                          sender=app.config['MAIL_USERNAME'], recipients=[grupo['correo']])
+            msg.body = texto
+            mail.send(msg)
+        else:
+            click.echo(texto + '\n')
+    click.echo(f"{sum(len(g['reservas']) for g in grupos)} reserva(s) impaga(s) de {len(grupos)} ejecutivo(s)"
+               + (' notificados por correo.' if enviar else '.'))
+# =====================
+# ANTIGÜEDAD DE CUENTAS POR COBRAR
+# =====================
+# Tramo -> días desde la venta hasta los que llega (None: sin límite)
+TRAMOS_ANTIGUEDAD = (('0-30', 30), ('31-60', 60), ('61-90', 90), ('90+', None))
+TRAMO_SIN_FECHA = 'sin fecha'
+COLUMNAS_DETALLE_ANTIGUEDAD = (
+    'id', 'fecha_venta', 'fecha_viaje', 'nombre_pasajero', 'destino', 'producto',
+    'localizadores', 'nombre_ejecutivo', 'precio_venta_total',
+)
+
+# Resultado del día por alcance de empresa: {(fecha, empresa_id): filas}
+_cache_antiguedad = {}
+_cache_antiguedad_lock = threading.Lock()
+
+def expresion_tramo(columna, hoy):
+    """CASE que asigna a cada fecha de venta su tramo de antigüedad (las ventas futuras quedan en el primero)."""
+    casos = [(columna.is_(None), TRAMO_SIN_FECHA)]
+    for tramo, dias in TRAMOS_ANTIGUEDAD[:-1]:
+        casos.append((columna >= hoy - timedelta(days=dias), tramo))
+    return db.case(*casos, else_=TRAMOS_ANTIGUEDAD[-1][0])
+
+def condicion_tramo(columna, tramo, hoy):
+    """Filtro equivalente a expresion_tramo(...) == tramo, expresado como rango para usar índices."""
+    if tramo == TRAMO_SIN_FECHA:
+        return columna.is_(None)
+    anterior = None
+    for clave, dias in TRAMOS_ANTIGUEDAD:
+        if clave == tramo:
+            condiciones = []
+            if anterior is not None:
+                condiciones.append(columna < hoy - timedelta(days=anterior))
+            if dias is not None:
+                condiciones.append(columna >= hoy - timedelta(days=dias))
+            return db.and_(*condiciones)
+        anterior = dias
+    raise ValueError(f'Tramo desconocido: {tramo}')
+
+def calcular_antiguedad_cobranza(hoy, empresa_id=None):
+    """
+    Montos no cobrados por empresa, ejecutivo y tramo de días desde fecha_venta, en un solo
+    GROUP BY sobre las reservas vigentes y archivadas. Devuelve filas
+    {'empresa_id', 'usuario_id', 'tramo', 'cantidad', 'monto'}.
+    """
+    partes = []
+    for modelo in (Reserva, ReservaArchivada):
+        parte = db.select(
+            modelo.empresa_id, modelo.usuario_id,
+            expresion_tramo(modelo.fecha_venta, hoy).label('tramo'),
+            db.func.coalesce(modelo.precio_venta_total, 0).label('monto'),
+        ).where(modelo.venta_cobrada == 'No Cobrada')
+        if empresa_id:
+            parte = parte.where(modelo.empresa_id == empresa_id)
+        partes.append(parte)
+    pendientes = db.union_all(*partes).subquery()
+    consulta = db.select(
+        pendientes.c.empresa_id, pendientes.c.usuario_id, pendientes.c.tramo,
+        db.func.count().label('cantidad'), db.func.sum(pendientes.c.monto).label('monto'),
+    ).group_by(pendientes.c.empresa_id, pendientes.c.usuario_id, pendientes.c.tramo)
+    return [dict(fila._mapping) for fila in db.session.execute(consulta)]
+
+def antiguedad_cobranza(empresa_id=None, recalcular=False):
+    """
+    Reporte de antigüedad agrupado por empresa y ejecutivo. El cálculo se guarda en memoria
+    durante el día (por alcance de empresa); `recalcular` lo fuerza.
+    Devuelve (empresas, totales, tramos): cada empresa con sus ejecutivos y los montos por tramo.
+    """
+    hoy = datetime.now().date()
+    clave = (hoy, empresa_id)
+    with _cache_antiguedad_lock:
+        filas = None if recalcular else _cache_antiguedad.get(clave)
+    if filas is None:
+        filas = calcular_antiguedad_cobranza(hoy, empresa_id)
+        with _cache_antiguedad_lock:
+            for vieja in [c for c in _cache_antiguedad if c[0] != hoy]:
+                del _cache_antiguedad[vieja]
+            _cache_antiguedad[clave] = filas
+
+    tramos = [tramo for tramo, _ in TRAMOS_ANTIGUEDAD]
+    if any(fila['tramo'] == TRAMO_SIN_FECHA for fila in filas):
+        tramos.append(TRAMO_SIN_FECHA)
+    nombres_empresa = dict(db.session.query(Empresa.id, Empresa.nombre))
+    usuario_ids = {fila['usuario_id'] for fila in filas}
+    nombres_usuario = {
+        u.id: f"{u.nombre} {u.apellidos}"
+        for u in Usuario.query.filter(Usuario.id.in_(usuario_ids))
+    } if usuario_ids else {}
+
+    def vacio():
+        return {'montos': dict.fromkeys(tramos, Decimal('0')), 'cantidad': 0, 'total': Decimal('0')}
+
+    def sumar(destino, fila):
+        monto = safe_decimal(fila['monto'])
+        destino['montos'][fila['tramo']] += monto
+        destino['cantidad'] += fila['cantidad']
+        destino['total'] += monto
+
+    empresas, totales = {}, vacio()
+    for fila in filas:
+        empresa = empresas.setdefault(fila['empresa_id'], {
+            'empresa_id': fila['empresa_id'],
+            'empresa': nombres_empresa.get(fila['empresa_id'], 'Sin empresa'),
+            'ejecutivos': {}, **vacio(),
+        })
+        ejecutivo = empresa['ejecutivos'].setdefault(fila['usuario_id'], {
+            'usuario_id': fila['usuario_id'],
+            'ejecutivo': nombres_usuario.get(fila['usuario_id'], 'Sin usuario'),
+            **vacio(),
+        })
+        for destino in (ejecutivo, empresa, totales):
+            sumar(destino, fila)
+    for empresa in empresas.values():
+        empresa['ejecutivos'] = sorted(empresa['ejecutivos'].values(), key=lambda e: e['ejecutivo'])
+    return sorted(empresas.values(), key=lambda e: e['empresa']), totales, tramos
+
+@app.route('/reporte_antiguedad_cobranza')
+@lectura_en_replica
+@login_required
+@rol_required('admin', 'master', 'controling')
+@empresa_tiene_gestion_required
+def reporte_antiguedad_cobranza():
+    """Ventas no cobradas por tramos de antigüedad, por empresa y ejecutivo"""
+    selected_empresa_id = request.args.get('empresa_id', '')
+    empresas_reporte, totales, tramos = antiguedad_cobranza(
+        empresa_en_alcance(selected_empresa_id), recalcular=bool(request.args.get('recalcular'))
+    )
+    return render_template('reporte_antiguedad_cobranza.html',
+                           empresas_reporte=empresas_reporte,
+                           totales=totales,
+                           tramos=tramos,
+                           fecha_calculo=datetime.now().date(),
+                           empresas=Empresa.query.all(),
+                           selected_empresa_id=selected_empresa_id)
+
+@app.route('/exportar_antiguedad_cobranza')
+@lectura_en_replica
+@login_required
+@rol_required('admin', 'master', 'controling')
+@empresa_tiene_gestion_required
+def exportar_antiguedad_cobranza():
+    """Detalle (CSV) de las ventas no cobradas de una celda del reporte, enviado a medida que se lee."""
+    hoy = datetime.now().date()
+    empresa_id = empresa_en_alcance(request.args.get('empresa_id', ''))
+    usuario_id = request.args.get('usuario_id', type=int)
+    tramo = request.args.get('tramo', '')
+
+    consultas = []
+    for modelo in (Reserva, ReservaArchivada):
+        consulta = db.select(*(getattr(modelo, c) for c in COLUMNAS_DETALLE_ANTIGUEDAD)).where(
+            modelo.venta_cobrada == 'No Cobrada'
+        ).order_by(modelo.fecha_venta, modelo.id)
+        if empresa_id:
+            consulta = consulta.where(modelo.empresa_id == empresa_id)
+        if usuario_id:
+            consulta = consulta.where(modelo.usuario_id == usuario_id)
+        if tramo:
+            try:
+                consulta = consulta.where(condicion_tramo(modelo.fecha_venta, tramo, hoy))
+            except ValueError:
+                flash('Tramo de antigüedad inválido.', 'danger')
+                return redirect(url_for('reporte_antiguedad_cobranza'))
+        consultas.append(consulta)
+
+    def generar():
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        # BOM para que Excel reconozca el UTF-8
+        buffer.write('\ufeff')
+        escritor.writerow(list(COLUMNAS_DETALLE_ANTIGUEDAD) + ['dias_desde_venta'])
+        for consulta in consultas:
+            for fila in db.session.execute(consulta.execution_options(yield_per=500)):
+                escritor.writerow(list(fila) + [(hoy - fila.fecha_venta).days if fila.fecha_venta else ''])
+                if buffer.tell() > 64 * 1024:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        yield buffer.getvalue()
+
+    nombre = f"antiguedad_cobranza_{hoy.strftime('%Y%m%d')}{'_' + tramo.replace('+', 'mas').replace(' ', '_') if tramo else ''}.csv"
+    return Response(stream_with_context(generar()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={nombre}'})
 
 # NUEVO ENDPOINT AGRUPADO POR AÑO Y MESES
 @app.route('/balance_mensual')
+@lectura_en_replica
 @login_required
 @rol_required('admin', 'master', 'controling')
 @empresa_tiene_gestion_required
@@ -2294,45 +4367,75 @@ def balance_mensual():
     anio_param = request.args.get('anio', '')
     selected_empresa_id = request.args.get('empresa_id', '')
 
-    # Obtener años disponibles (de las reservas)
-    anios_disponibles = db.session.query(db.extract('year', Reserva.fecha_venta)).distinct().order_by(db.extract('year', Reserva.fecha_venta).desc()).all()
-    anios_disponibles = [int(a[0]) for a in anios_disponibles if a[0]]
+    # Obtener años disponibles (de las reservas, incluidas las archivadas)
+    anios_disponibles = set()
+    for modelo in (Reserva, ReservaArchivada):
+        anios_disponibles.update(
+            int(a[0]) for a in db.session.query(db.extract('year', modelo.fecha_venta)).distinct() if a[0]
+        )
+    anios_disponibles = sorted(anios_disponibles, reverse=True)
     anio_actual = datetime.now().year
     selected_anio = int(anio_param) if anio_param and anio_param.isdigit() else anio_actual
 
-    # Preparar datos por mes
-    balance_data = []
-    for mes in range(1, 13):
-        # Query de reservas del mes y año
-        query = Reserva.query.join(Usuario).filter(
-            db.extract('year', Reserva.fecha_venta) == selected_anio,
-            db.extract('month', Reserva.fecha_venta) == mes
+    # Meses cerrados de la empresa seleccionada para el año
+    cierres = {}
+    if selected_empresa_id:
+        cierres = {
+            c.periodo: c for c in CierreMes.query.filter(
+                CierreMes.empresa_id == int(selected_empresa_id),
+                CierreMes.periodo.like(f"{selected_anio:04d}-%")
+            )
+        }
+
+    # Totales de todos los meses en una sola consulta agrupada, con las comisiones guardadas
+    # (y otra sobre el archivo si el año lo necesita)
+    inicio_anio = datetime(selected_anio, 1, 1).date()
+    totales_por_mes = {}
+    for modelo in modelos_reserva('fecha_venta', inicio_anio):
+        mes_venta = db.extract('month', modelo.fecha_venta)
+        query = db.session.query(
+            mes_venta.label('mes'),
+            db.func.coalesce(db.func.sum(modelo.precio_venta_total), 0).label('precio_venta_total'),
+            db.func.coalesce(db.func.sum(modelo.precio_venta_neto), 0).label('suma_neto'),
+            db.func.coalesce(db.func.sum(modelo.comision_agencia), 0).label('ingresos_agentes'),
+            db.func.coalesce(db.func.sum(modelo.comision_ejecutivo), 0).label('egresos_comision')
+        ).filter(
+            modelo.fecha_venta >= inicio_anio,
+            modelo.fecha_venta < datetime(selected_anio + 1, 1, 1).date()
         )
         if selected_empresa_id:
-            query = query.filter(
-                Usuario.empresa_id == int(selected_empresa_id),
+            query = query.join(Usuario, modelo.usuario_id == Usuario.id).filter(
+                modelo.empresa_id == int(selected_empresa_id),
                 Usuario.rol.in_(['ejecutivo', 'controling', 'analista'])
             )
-        reservas = query.all()
-
-        # Ingresos por agentes = suma de comisión agencia
-        ingresos_agentes = 0
-        egresos_comision = 0
-        precio_venta_total = 0
-        suma_neto = 0
-        for r in reservas:
-            comision_ejecutivo, comision_agencia, _, _, _ = calcular_comisiones(r, r.usuario)
-            ingresos_agentes += float(comision_agencia or 0)
-            egresos_comision += float(comision_ejecutivo or 0)
-            precio_venta_total += float(getattr(r, 'precio_venta_total', 0) or 0)
-            suma_neto += float(getattr(r, 'hotel_neto', 0) or 0)
-            suma_neto += float(getattr(r, 'vuelo_neto', 0) or 0)
-            suma_neto += float(getattr(r, 'traslado_neto', 0) or 0)
-            suma_neto += float(getattr(r, 'seguro_neto', 0) or 0)
-            suma_neto += float(getattr(r, 'circuito_neto', 0) or 0)
-            suma_neto += float(getattr(r, 'crucero_neto', 0) or 0)
-            suma_neto += float(getattr(r, 'excursion_neto', 0) or 0)
-            suma_neto += float(getattr(r, 'paquete_neto', 0) or 0)
+        for fila in query.group_by(mes_venta).all():
+            acumulado = totales_por_mes.setdefault(int(fila.mes), dict.fromkeys(
+                ('precio_venta_total', 'suma_neto', 'ingresos_agentes', 'egresos_comision'), 0.0
+            ))
+            for campo in acumulado:
+                acumulado[campo] += float(getattr(fila, campo) or 0)
+
+    # Preparar datos por mes
+    balance_data = []
+    for mes in range(1, 13):
+        cierre = cierres.get(f"{selected_anio:04d}-{mes:02d}")
+        if cierre:
+            balance_data.append({
+                'numero': mes,
+                'nombre': obtener_nombre_mes(mes),
+                'precio_venta_neto': float(cierre.precio_venta_neto or 0),
+                'ingresos_agentes': float(cierre.ingresos_agentes or 0),
+                'ingresos_externos': 0,
+                'egresos_comision': float(cierre.egresos_comision or 0),
+                'egresos_administracion': 0,
+                'otros_egresos': 0
+            })
+            continue
+        fila = totales_por_mes.get(mes, {})
+        ingresos_agentes = fila.get('ingresos_agentes', 0)
+        egresos_comision = fila.get('egresos_comision', 0)
+        precio_venta_total = fila.get('precio_venta_total', 0)
+        suma_neto = fila.get('suma_neto', 0)
         ingreso_neto = precio_venta_total - suma_neto
 
         # Los siguientes campos pueden ser editables y persistidos en BD, pero aquí los dejamos en 0 por defecto
@@ -2353,15 +4456,20 @@ def balance_mensual():
         })
 
     empresas = Empresa.query.all()
-    return render_template('balance_mensual.html',
+    html = render_template('balance_mensual.html',
         balance_data=balance_data,
         anios_disponibles=anios_disponibles,
         selected_anio=selected_anio,
         empresas=empresas,
         selected_empresa_id=selected_empresa_id
     )
+    # Año completamente cerrado: el balance ya no cambia
+    if len(cierres) == 12:
+        return respuesta_periodo_cerrado(html, *cierres.values())
+    return html
 
 @app.route('/liquidaciones')
+@lectura_en_replica
 @login_required
 @rol_required('admin', 'master', 'controling')
 @empresa_tiene_gestion_required
@@ -2397,16 +4505,9 @@ def liquidaciones():
     usuarios = usuarios_query.order_by(Usuario.nombre, Usuario.apellidos).all()
 
     # Obtener reservas del mes y empresa
-    reservas_query = Reserva.query.join(Usuario).filter(
-        db.extract('year', Reserva.fecha_venta) == año,
-        db.extract('month', Reserva.fecha_venta) == mes
+    reservas = reservas_del_periodo(
+        selected_empresa_id, año, mes, roles=roles_liquidaciones if selected_empresa_id else None
     )
-    if selected_empresa_id:
-        reservas_query = reservas_query.filter(
-            Usuario.empresa_id == int(selected_empresa_id),
-            Usuario.rol.in_(roles_liquidaciones)
-        )
-    reservas = reservas_query.all()
 
     # Agrupar reservas por usuario
     reservas_por_usuario = {}
@@ -2416,6 +4517,15 @@ def liquidaciones():
             reservas_por_usuario[key] = []
         reservas_por_usuario[key].append(reserva)
 
+    # Snapshots de liquidaciones ya cerradas para el periodo
+    periodo = f"{año:04d}-{mes:02d}"
+    cerradas = {
+        l.usuario_id: l for l in Liquidacion.query.filter(
+            Liquidacion.periodo == periodo,
+            Liquidacion.usuario_id.in_([u.id for u in usuarios])
+        )
+    } if usuarios else {}
+
     liquidaciones_data = []
     totales = {
         'precio_venta_total': 0,
@@ -2441,11 +4551,12 @@ def liquidaciones():
             'total_pagar': 0
         }
         for reserva in reservas_usuario:
-            comision_ejecutivo, comision_agencia, ganancia_total, _, _ = calcular_comisiones(reserva, reserva.usuario)
             data['precio_venta_total'] += reserva.precio_venta_total or 0
             data['precio_venta_neto'] += reserva.precio_venta_neto or 0
-            data['comision_ejecutivo'] += comision_ejecutivo or 0
-            data['comision_agencia'] += comision_agencia or 0
+            data['comision_ejecutivo'] += reserva.comision_ejecutivo or 0
+            data['comision_agencia'] += reserva.comision_agencia or 0
+            # Bonos sugeridos: los de las reservas del mes, como en el cierre por CLI y ver_liquidacion
+            data['bonos'] += reserva.bonos or 0
             if reserva.estado_pago == 'Pagado':
                 data['estado_pago'] = 'Pagado'
         data['total_pagar'] = (
@@ -2454,6 +4565,13 @@ def liquidaciones():
             + (data['sueldo'] or 0)
             - (data['descuentos'] or 0)
         )
+        liquidacion = cerradas.get(usuario.id)
+        data['cerrada'] = liquidacion is not None
+        if liquidacion:
+            data['sueldo'] = liquidacion.sueldo or 0
+            data['bonos'] = liquidacion.bonos or 0
+            data['descuentos'] = liquidacion.descuentos or 0
+            data['total_pagar'] = liquidacion.total_liquido or 0
         totales['precio_venta_total'] += data['precio_venta_total']
         totales['precio_venta_neto'] += data['precio_venta_neto']
         totales['comision_ejecutivo'] += data['comision_ejecutivo']
@@ -2467,7 +4585,160 @@ def liquidaciones():
                          selected_mes_str=selected_mes_str,
                          meses_anteriores=meses_anteriores,
                          empresas=empresas,
-                         selected_empresa_id=selected_empresa_id)
+                         selected_empresa_id=selected_empresa_id,
+                         periodo_cerrado=bool(liquidaciones_data) and all(d['cerrada'] for d in liquidaciones_data))
+
+@app.route('/liquidaciones/cerrar', methods=['POST'])
+@login_required
+@rol_required('admin', 'master', 'controling')
+@empresa_tiene_gestion_required
+def cerrar_liquidaciones():
+    """Cierra el periodo: guarda un snapshot de liquidación por ejecutivo con los ajustes del formulario"""
+    mes_param = request.form.get('mes', '')
+    selected_empresa_id = request.form.get('empresa_id', '')
+    if current_user.rol == 'controling':
+        selected_empresa_id = str(current_user.empresa_id or '')
+    try:
+        año, mes = map(int, mes_param.split(' (')[0].split('-'))
+    except ValueError:
+        flash('Formato de mes inválido.', 'danger')
+        return redirect(url_for('liquidaciones'))
+
+    # Ajustes por usuario enviados desde la tabla (bonos_<id>, descuentos_<id>)
+    ajustes = {}
+    for campo, valor in request.form.items():
+        for prefijo in ('bonos_', 'descuentos_'):
+            if campo.startswith(prefijo) and campo[len(prefijo):].isdigit():
+                ajustes.setdefault(int(campo[len(prefijo):]), {})[prefijo[:-1]] = valor
+
+    creadas = cerrar_periodo_liquidaciones(año, mes, selected_empresa_id or None, ajustes)
+    flash(f'Periodo {año:04d}-{mes:02d} cerrado: {creadas} liquidaciones guardadas.', 'success')
+    return redirect(url_for('liquidaciones', mes=mes_param, empresa_id=selected_empresa_id))
+
+@app.cli.command('cerrar-liquidaciones')
+@click.argument('periodo')
+@click.option('--empresa-id', type=int, default=None, help='Cerrar solo los usuarios de esta empresa.')
+def cerrar_liquidaciones_command(periodo, empresa_id):
+    """Cierra las liquidaciones del periodo YYYY-MM."""
+    año, mes = map(int, periodo.split('-'))
+    creadas = cerrar_periodo_liquidaciones(año, mes, empresa_id)
+    click.echo(f"Periodo {periodo} cerrado: {creadas} liquidaciones guardadas.")
+
+# =====================
+# ADMIN / MÉTRICAS
+# =====================
+@app.route('/admin/metricas_pool')
+@login_required
+@rol_required('admin', 'master')
+def metricas_pool():
+    """Estado y métricas del pool de conexiones de este proceso (JSON)."""
+    with _metricas_pool_lock:
+        metricas = dict(_metricas_pool)
+    metricas['espera_media_s'] = metricas['espera_total_s'] / metricas['checkouts'] if metricas['checkouts'] else 0.0
+    pool = db.engine.pool
+    metricas['pool'] = pool.__class__.__name__
+    if isinstance(pool, QueuePool):
+        metricas.update(tamano=pool.size(), en_uso=pool.checkedout(), overflow=pool.overflow())
+    return jsonify({'success': True, 'pid': os.getpid(), **metricas})
+
+# =====================
+# ADMIN / CIERRE DE MES
+# =====================
+@app.route('/admin/cerrar_mes', methods=['POST'])
+@login_required
+@rol_required('admin', 'master')
+def cerrar_mes():
+    """Cierra un mes para una empresa (o para todas): congela sus reportes y bloquea sus reservas"""
+    mes_param = request.form.get('mes', '')
+    empresa_param = request.form.get('empresa_id', '')
+    try:
+        año, mes = map(int, mes_param.split('-'))
+    except ValueError:
+        flash('Formato de mes inválido.', 'danger')
+        return redirect(url_for('reporte_detalle_ventas'))
+
+    hoy = datetime.now()
+    if (año, mes) >= (hoy.year, hoy.month):
+        flash('Solo se pueden cerrar meses ya terminados.', 'danger')
+        return redirect(url_for('reporte_detalle_ventas', mes=mes_param, empresa_id=empresa_param))
+
+    if empresa_param:
+        empresa_ids = [int(empresa_param)]
+    else:
+        empresa_ids = [e.id for e in Empresa.query.all()]
+    cerradas = sum(1 for empresa_id in empresa_ids if cerrar_mes_empresa(empresa_id, año, mes, current_user.id))
+    flash(f'Mes {mes_param} cerrado para {cerradas} empresa(s).', 'success')
+    return redirect(url_for('reporte_detalle_ventas', mes=mes_param, empresa_id=empresa_param))
+
+@app.cli.command('cerrar-mes')
+@click.argument('periodo')
+@click.option('--empresa-id', type=int, default=None, help='Cerrar solo esta empresa.')
+def cerrar_mes_command(periodo, empresa_id):
+    """Cierra el mes YYYY-MM para una empresa o para todas."""
+    año, mes = map(int, periodo.split('-'))
+    empresa_ids = [empresa_id] if empresa_id else [e.id for e in Empresa.query.all()]
+    cerradas = sum(1 for eid in empresa_ids if cerrar_mes_empresa(eid, año, mes))
+    click.echo(f"Mes {periodo} cerrado para {cerradas} empresa(s).")
+
+@app.cli.command('columnas-generadas-reserva')
+def columnas_generadas_reserva_cmd():
+    """Convierte precio_venta_neto y ganancia_total en columnas generadas en bases existentes."""
+    convertidas = convertir_columnas_generadas_reserva()
+    if convertidas:
+        click.echo(f"Columnas convertidas: {', '.join(convertidas)}.")
+    else:
+        click.echo("Las columnas ya eran generadas.")
+
+@app.cli.command('archivar-reservas')
+@click.option('--meses', type=int, default=None, help='Archivar ventas de más de estos meses (por defecto RESERVAS_ARCHIVO_MESES).')
+def archivar_reservas_command(meses):
+    """Mueve las reservas antiguas y sus comprobantes al archivo."""
+    corte = fecha_corte_archivo(meses)
+    archivadas = archivar_reservas(corte)
+    click.echo(f"{archivadas} reserva(s) con venta anterior a {corte} archivada(s).")
+
+@app.cli.command('particionar-reservas')
+def particionar_reservas_command():
+    """Convierte la tabla reserva en tabla particionada por mes de venta (PostgreSQL)."""
+    try:
+        particionada = particionar_tabla_reserva()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    if particionada:
+        click.echo("Tabla reserva particionada por mes de fecha_venta.")
+    else:
+        click.echo("La tabla reserva ya estaba particionada.")
+
+@app.cli.command('crear-particiones-reserva')
+@click.option('--meses-adelante', type=int, default=None, help='Meses futuros a preparar.')
+def crear_particiones_reserva_command(meses_adelante):
+    """Crea las particiones mensuales que falten, incluidas las de los próximos meses."""
+    if not reserva_esta_particionada():
+        raise click.ClickException("La tabla reserva no está particionada.")
+    creadas = crear_particiones_reserva(meses_adelante=meses_adelante)
+    db.session.commit()
+    click.echo(f"{creadas} partición(es) creada(s).")
+
+@app.cli.command('desacoplar-particion-reserva')
+@click.argument('periodo')
+def desacoplar_particion_reserva_command(periodo):
+    """Separa la partición del mes YYYY-MM de la tabla reserva."""
+    año, mes = map(int, periodo.split('-'))
+    click.echo(f"Partición {desacoplar_particion_reserva(año, mes)} desacoplada.")
+
+@app.cli.command('asignar-empresa-reservas')
+def asignar_empresa_reservas_command():
+    """Rellena Reserva.empresa_id con la empresa del usuario dueño de cada reserva."""
+    actualizadas = asignar_empresa_reservas()
+    click.echo(f"Empresa asignada en {actualizadas} reserva(s).")
+
+@app.cli.command('recalcular-comisiones')
+@click.option('--usuario-id', type=int, default=None, help='Recalcular solo las reservas de este usuario.')
+@click.option('--lote', type=int, default=None, help='Cantidad de reservas por lote.')
+def recalcular_comisiones_command(usuario_id, lote):
+    """Recalcula las comisiones guardadas de las reservas (excepto meses cerrados)."""
+    actualizadas = recalcular_comisiones_reservas(usuario_id, lote)
+    click.echo(f"Comisiones recalculadas en {actualizadas} reserva(s).")
 
 # =====================
 # RESERVAS
@@ -2478,6 +4749,10 @@ def gestionar_reservas():
     if request.method == 'POST':
         reserva_id = request.form.get('reserva_id')
         file = request.files.get('archivo_pdf')
+        fecha_venta = parsear_fecha_formulario(request.form.get('fecha_venta'))
+        if not fecha_venta:
+            flash('La fecha de venta es obligatoria.', 'danger')
+            return redirect(url_for('gestionar_reservas'))
 
 
         if reserva_id:
@@ -2485,6 +4760,10 @@ def gestionar_reservas():
             if not reserva or not puede_editar_reserva(reserva):
                 flash('No autorizado.', 'danger')
                 return redirect(url_for('gestionar_reservas'))
+            empresa_id = reserva.usuario.empresa_id if reserva.usuario else None
+            if reserva_bloqueada(reserva) or mes_cerrado(empresa_id, fecha_venta):
+                flash('El mes de venta está cerrado; la reserva no se puede modificar.', 'danger')
+                return redirect(url_for('admin_reservas'))
 
             set_reserva_fields(reserva, request.form)
             # Forzar que estos campos no se modifiquen desde el formulario
@@ -2504,15 +4783,21 @@ def gestionar_reservas():
                 reserva.comprobante_pdf = reserva.comprobante_pdf
 
         else:
+            if mes_cerrado(current_user.empresa_id, fecha_venta):
+                flash('El mes de venta está cerrado; no se pueden agregar reservas.', 'danger')
+                return redirect(url_for('gestionar_reservas'))
             nueva_reserva = Reserva(
-                usuario_id=current_user.id,
-                opinion='no',
-                postventa='no',
-                estado_postventa='not ok'
+                usuario=current_user._get_current_object(),
+                empresa_id=current_user.empresa_id
             )
             db.session.add(nueva_reserva)
-            db.session.flush()  # Asegura que nueva_reserva tenga un ID asignado
             set_reserva_fields(nueva_reserva, request.form)
+            # El formulario no trae el seguimiento: valores iniciales (como al editar)
+            nueva_reserva.opinion = nueva_reserva.opinion or 'no'
+            nueva_reserva.postventa = nueva_reserva.postventa or 'no'
+            nueva_reserva.estado_postventa = nueva_reserva.estado_postventa or 'not ok'
+            # El INSERT va con fecha_venta (obligatoria en la tabla particionada); asigna el ID al comprobante
+            db.session.flush()
 
             nombre_archivo, contenido_pdf, error_mensaje = guardar_comprobante(file, nueva_reserva)
             if error_mensaje:
@@ -2554,11 +4839,9 @@ def gestionar_reservas():
         if reserva_a_editar and puede_editar_reserva(reserva_a_editar):
             # Recalcular y asignar valores calculados antes de mostrar el formulario
             if reserva_a_editar.usuario:
-                comision_ejecutivo, comision_agencia, ganancia_total, _, precio_venta_neto = calcular_comisiones(reserva_a_editar, reserva_a_editar.usuario)
-                reserva_a_editar.precio_venta_neto = precio_venta_neto
+                comision_ejecutivo, comision_agencia, _, _, _ = calcular_comisiones(reserva_a_editar, reserva_a_editar.usuario)
                 reserva_a_editar.comision_ejecutivo = comision_ejecutivo
                 reserva_a_editar.comision_agencia = comision_agencia
-                reserva_a_editar.ganancia_total = ganancia_total
             editar_reserva = reserva_a_editar
 
     return render_template(
@@ -2590,7 +4873,7 @@ def ver_pdf_db(reserva_id):
 @app.route('/comprobante/<int:reserva_id>')
 @login_required
 def descargar_comprobante(reserva_id):
-    reserva = Reserva.query.get_or_404(reserva_id)
+    reserva = Reserva.query.get(reserva_id) or ReservaArchivada.query.get_or_404(reserva_id)
 
     # Verifica permisos: solo admin/master o dueño de la reserva
     if current_user.rol not in ('admin', 'master', 'controling') and reserva.usuario_id != current_user.id:
@@ -2614,6 +4897,9 @@ def eliminar_reserva(id):
     if not puede_editar_reserva(reserva):
         flash('No autorizado.', 'danger')
         return redirect(url_for('gestionar_reservas'))
+    if reserva_bloqueada(reserva):
+        flash('El mes de venta está cerrado; la reserva no se puede eliminar.', 'danger')
+        return redirect(url_for('admin_reservas'))
 
     # Eliminar el archivo de comprobante si existe
     if reserva.comprobante_venta:
@@ -2668,6 +4954,295 @@ def reservas_usuarios():
         pagination=reservas_paginated
     )
 # =====================
+# BÚSQUEDA DE PRODUCTOS
+# =====================
+BUSQUEDA_POR_PAGINA = 20
+INDICES_TEXTO_OBSOLETOS = (
+    'ix_proveedor_servicio', 'ix_proveedor_condiciones_comerciales', 'ix_contrato_descripcion',
+    'ix_contrato_condiciones', 'ix_catalogo_descripcion', 'ix_catalogo_que_incluye'
+)
+
+def actualizar_indices_busqueda():
+    """
+    Borra los índices B-tree de las columnas Text de proveedores, contratos y catálogos
+    y crea los índices GIN de texto completo (solo PostgreSQL). No confirma la transacción.
+    """
+    conexion = db.session.connection()
+    for nombre in INDICES_TEXTO_OBSOLETOS:
+        conexion.exec_driver_sql(f"DROP INDEX IF EXISTS {nombre}")
+    if es_postgresql():
+        for modelo in (Proveedor, Contrato, Catalogo):
+            for indice in modelo.__table__.indexes:
+                if indice.name.endswith('_busqueda'):
+                    indice.create(conexion, checkfirst=True)
+
+def preparar_borrado_logico():
+    """
+    Bases existentes: marca como activos los registros con activo NULL (quedarían ocultos por el
+    alcance por defecto) y crea los índices parciales de filas activas. No confirma la transacción.
+    """
+    conexion = db.session.connection()
+    for modelo in (Proveedor, Contrato, Catalogo):
+        db.session.execute(db.update(modelo).where(modelo.activo.is_(None)).values(activo=True))
+        for indice in modelo.__table__.indexes:
+            if '_activo_' in indice.name:
+                indice.create(conexion, checkfirst=True)
+
+def consulta_busqueda(modelo, tipo, campos, texto, empresa_id=None):
+    """SELECT (tipo, id, nombre, rango) de los registros de `modelo` que coinciden con `texto`."""
+    if es_postgresql():
+        vector = db.literal_column(f"({vector_busqueda_sql(*campos)})")
+        consulta = db.func.websearch_to_tsquery(db.literal_column("'spanish'"), texto)
+        rango = db.func.ts_rank(vector, consulta)
+        condiciones = [vector.op('@@')(consulta)]
+    else:
+        # SQLite: sin índice de texto completo; cada palabra debe aparecer en algún campo
+        texto_sql = db.func.coalesce(getattr(modelo, campos[0]), '')
+        for campo in campos[1:]:
+            texto_sql = texto_sql + ' ' + db.func.coalesce(getattr(modelo, campo), '')
+        palabras = texto.split()
+        condiciones = [texto_sql.icontains(palabra, autoescape=True) for palabra in palabras]
+        rango = sum(db.case((modelo.nombre.icontains(palabra, autoescape=True), 2), else_=1) for palabra in palabras)
+    if empresa_id:
+        if modelo is Proveedor:
+            condiciones.append(Proveedor.empresa_id == empresa_id)
+        else:
+            condiciones.append(modelo.proveedor_id.in_(
+                db.select(Proveedor.id).where(Proveedor.empresa_id == empresa_id)
+            ))
+    return db.select(
+        db.literal(tipo).label('tipo'), modelo.id.label('id'),
+        modelo.nombre.label('nombre'), rango.label('rango')
+    ).where(*condiciones)
+
+def buscar_productos(texto, empresa_id=None, pagina=1, por_pagina=BUSQUEDA_POR_PAGINA):
+    """
+    Busca `texto` en proveedores, contratos y catálogos. Devuelve (resultados, total): una página
+    de dicts {tipo, objeto, rango} ordenados por relevancia y el total de coincidencias.
+    """
+    fuentes = {
+        'proveedor': (Proveedor, CAMPOS_BUSQUEDA_PROVEEDOR),
+        'contrato': (Contrato, CAMPOS_BUSQUEDA_CONTRATO),
+        'catalogo': (Catalogo, CAMPOS_BUSQUEDA_CATALOGO),
+    }
+    union = db.union_all(*[
+        consulta_busqueda(modelo, tipo, campos, texto, empresa_id)
+        for tipo, (modelo, campos) in fuentes.items()
+    ]).subquery()
+    total = db.session.execute(db.select(db.func.count()).select_from(union)).scalar()
+    filas = db.session.execute(
+        db.select(union).order_by(union.c.rango.desc(), union.c.nombre, union.c.tipo, union.c.id)
+        .limit(por_pagina).offset((pagina - 1) * por_pagina)
+    ).all()
+
+    # Cargar los objetos de la página con una consulta por tipo
+    objetos = {}
+    for tipo, (modelo, _) in fuentes.items():
+        ids = [fila.id for fila in filas if fila.tipo == tipo]
+        if ids:
+            objetos.update({(tipo, obj.id): obj for obj in modelo.query.filter(modelo.id.in_(ids))})
+    resultados = [
+        {'tipo': fila.tipo, 'objeto': objetos[(fila.tipo, fila.id)], 'rango': fila.rango}
+        for fila in filas if (fila.tipo, fila.id) in objetos
+    ]
+    return resultados, total
+
+@app.route('/buscar_productos')
+@login_required
+@rol_required('admin', 'master', 'controling', 'analista')
+@empresa_tiene_productos_required
+def buscar_productos_view():
+    """Búsqueda de texto completo en proveedores, contratos y catálogos, paginada por relevancia."""
+    texto = request.args.get('q', '').strip()[:200]
+    pagina = max(request.args.get('page', 1, type=int), 1)
+    resultados, total = [], 0
+    if texto:
+        # Controling solo ve productos de su empresa, igual que en los listados
+        empresa_id = current_user.empresa_id if current_user.rol == 'controling' else None
+        resultados, total = buscar_productos(texto, empresa_id, pagina)
+    paginas = max((total + BUSQUEDA_POR_PAGINA - 1) // BUSQUEDA_POR_PAGINA, 1)
+    return render_template('buscar_productos.html', q=texto, resultados=resultados,
+                           total=total, pagina=pagina, paginas=paginas)
+
+# =====================
+# LISTADOS DE PRODUCTOS
+# =====================
+LISTADO_POR_PAGINA = 50
+LISTADO_MAX_POR_PAGINA = 200
+
+# Listado -> (modelo, columna de fecha que define la vigencia)
+LISTADOS_PRODUCTOS = {
+    'proveedores': (Proveedor, 'fecha_vigencia'),
+    'contratos': (Contrato, 'fecha_fin'),
+    'catalogos': (Catalogo, 'fecha_fin'),
+}
+FACETAS_PRODUCTOS = {
+    'tipo_proveedor': 'Tipo de proveedor',
+    'donde_opera': 'Dónde opera',
+    'pais_ciudad': 'País / Ciudad',
+    'estado': 'Estado',
+    'activo': 'Activo',
+    'vigencia': 'Vigencia',
+}
+VENTANAS_VIGENCIA = {
+    'vencido': 'Vencido',
+    '30d': 'Vence en 30 días',
+    '90d': 'Vence en 31 a 90 días',
+    'mas_90d': 'Vigente más de 90 días',
+    'sin_fecha': 'Sin fecha',
+}
+
+def condicion_vigencia(columna, ventana, hoy):
+    """Rango de fechas de una ventana de vigencia (comparaciones simples, aprovechan el índice de la fecha)."""
+    en_30, en_90 = hoy + timedelta(days=30), hoy + timedelta(days=90)
+    return {
+        'vencido': columna < hoy,
+        '30d': db.and_(columna >= hoy, columna < en_30),
+        '90d': db.and_(columna >= en_30, columna < en_90),
+        'mas_90d': columna >= en_90,
+        'sin_fecha': columna.is_(None),
+    }[ventana]
+
+def expresion_faceta(modelo, campo_vigencia, faceta, hoy):
+    """Expresión SQL por la que se agrupa una faceta."""
+    if faceta in ('tipo_proveedor', 'donde_opera', 'pais_ciudad'):
+        return getattr(Proveedor, faceta)
+    if faceta == 'vigencia':
+        columna = getattr(modelo, campo_vigencia)
+        return db.case(*[(condicion_vigencia(columna, v, hoy), v) for v in VENTANAS_VIGENCIA])
+    return getattr(modelo, faceta)
+
+def condicion_faceta(modelo, campo_vigencia, faceta, valor, hoy):
+    if faceta == 'vigencia':
+        return condicion_vigencia(getattr(modelo, campo_vigencia), valor, hoy)
+    if faceta == 'activo':
+        return modelo.activo == (valor == 'si')
+    return expresion_faceta(modelo, campo_vigencia, faceta, hoy) == valor
+
+def filtros_listado(args):
+    """Facetas elegidas en la URL; se ignoran valores de vigencia o activo desconocidos."""
+    filtros = {faceta: args.get(faceta, '').strip() for faceta in FACETAS_PRODUCTOS if args.get(faceta, '').strip()}
+    if filtros.get('vigencia') not in (None, *VENTANAS_VIGENCIA):
+        filtros.pop('vigencia')
+    if filtros.get('activo') not in (None, 'si', 'no'):
+        filtros.pop('activo')
+    return filtros
+
+def listar_productos(tipo, filtros=None, cursor=None, limite=LISTADO_POR_PAGINA, empresa_id=None):
+    """
+    Página de proveedores, contratos o catálogos ordenada por (nombre, id), con paginación por
+    cursor (keyset) y conteos por faceta. Cada faceta se cuenta con los demás filtros aplicados,
+    para mostrar cuántos resultados quedarían al elegir cada valor. Contratos y catálogos se unen
+    a su proveedor en la misma consulta (facetas de proveedor y sin consultas por fila).
+    Sin la faceta activo se listan solo los registros activos; activo=no muestra los eliminados.
+    Devuelve {'items', 'facetas', 'siguiente'}; `siguiente` es el cursor de la página siguiente o None.
+    """
+    modelo, campo_vigencia = LISTADOS_PRODUCTOS[tipo]
+    filtros = filtros or {}
+    hoy = datetime.now().date()
+
+    def base(*columnas):
+        # El filtro de activos se aplica aquí de forma explícita para poder contar ambos valores
+        consulta = db.select(*columnas).select_from(modelo).execution_options(incluir_inactivos=True)
+        if modelo is not Proveedor:
+            consulta = consulta.join(modelo.proveedor)
+        if empresa_id:
+            consulta = consulta.where(Proveedor.empresa_id == empresa_id)
+        return consulta
+
+    condiciones = {
+        faceta: condicion_faceta(modelo, campo_vigencia, faceta, valor, hoy)
+        for faceta, valor in filtros.items()
+    }
+    condiciones.setdefault('activo', condicion_faceta(modelo, campo_vigencia, 'activo', 'si', hoy))
+
+    consulta = base(modelo).where(*condiciones.values()).order_by(modelo.nombre, modelo.id)
+    if modelo is not Proveedor:
+        consulta = consulta.options(db.contains_eager(modelo.proveedor), db.defer(modelo.comprobante_pdf))
+    if cursor:
+        nombre, ultimo_id = serializer.loads(cursor, salt='cursor-listado')
+        consulta = consulta.where(db.tuple_(modelo.nombre, modelo.id) > (nombre, ultimo_id))
+    items = db.session.execute(consulta.limit(limite + 1)).scalars().all()
+    siguiente = None
+    if len(items) > limite:
+        items = items[:limite]
+        siguiente = serializer.dumps([items[-1].nombre, items[-1].id], salt='cursor-listado')
+
+    facetas = {}
+    for faceta in FACETAS_PRODUCTOS:
+        expresion = expresion_faceta(modelo, campo_vigencia, faceta, hoy)
+        otras = [cond for nombre, cond in condiciones.items() if nombre != faceta]
+        filas = db.session.execute(
+            base(expresion, db.func.count(modelo.id)).where(*otras).group_by(expresion)
+        ).all()
+        conteos = {}
+        for valor, cantidad in filas:
+            if valor is None:
+                continue
+            if faceta == 'activo':
+                valor = 'si' if valor else 'no'
+            conteos[valor] = conteos.get(valor, 0) + cantidad
+        facetas[faceta] = sorted(conteos.items(), key=lambda par: (-par[1], str(par[0])))
+    return {'items': items, 'facetas': facetas, 'siguiente': siguiente}
+
+def listado_productos_desde_request(tipo):
+    """Lee filtros, cursor y límite de la URL y aplica el alcance por empresa del usuario."""
+    limite = min(max(request.args.get('limite', LISTADO_POR_PAGINA, type=int), 1), LISTADO_MAX_POR_PAGINA)
+    filtros = filtros_listado(request.args)
+    empresa_id = current_user.empresa_id if current_user.rol == 'controling' else None
+    listado = listar_productos(tipo, filtros, request.args.get('cursor') or None, limite, empresa_id)
+    listado['filtros'] = filtros
+    return listado
+
+def producto_a_dict(obj):
+    """Columnas del registro listas para JSON (sin el PDF, que se descarga por su ruta)."""
+    datos = {}
+    for col in obj.__table__.columns:
+        if isinstance(col.type, db.LargeBinary):
+            continue
+        valor = getattr(obj, col.key)
+        if isinstance(valor, Decimal):
+            valor = float(valor)
+        elif hasattr(valor, 'isoformat'):
+            valor = valor.isoformat()
+        datos[col.key] = valor
+    if not isinstance(obj, Proveedor):
+        datos['tiene_comprobante'] = bool(obj.tiene_comprobante)
+        datos['proveedor'] = obj.proveedor.nombre if obj.proveedor else None
+    return datos
+
+@app.route('/api/productos/<any(proveedores, contratos, catalogos):tipo>')
+@lectura_en_replica
+@login_required
+@rol_required('admin', 'master', 'controling', 'analista')
+@empresa_tiene_productos_required
+def api_listado_productos(tipo):
+    """Listado JSON con filtros por faceta, conteos y cursor: ?tipo_proveedor=...&vigencia=30d&cursor=..."""
+    try:
+        listado = listado_productos_desde_request(tipo)
+    except BadSignature:
+        return jsonify({'success': False, 'message': 'Cursor inválido.'}), 400
+    return jsonify({
+        'success': True,
+        'items': [producto_a_dict(obj) for obj in listado['items']],
+        'facetas': {faceta: dict(conteos) for faceta, conteos in listado['facetas'].items()},
+        'filtros': listado['filtros'],
+        'siguiente': listado['siguiente'],
+    })
+
+def render_listado_productos(tipo, plantilla):
+    try:
+        listado = listado_productos_desde_request(tipo)
+    except BadSignature:
+        flash('El enlace de paginación no es válido; se muestra la primera página.', 'warning')
+        return redirect(url_for(request.endpoint, **filtros_listado(request.args)))
+    return render_template(
+        plantilla, **{tipo: listado['items']},
+        facetas=listado['facetas'], filtros=listado['filtros'], siguiente=listado['siguiente'],
+        nombres_facetas=FACETAS_PRODUCTOS, ventanas_vigencia=VENTANAS_VIGENCIA
+    )
+
+# =====================
 # PROVEEDORES
 # =====================
 @app.route('/proveedores')
@@ -2675,15 +5250,9 @@ def reservas_usuarios():
 @rol_required('admin', 'master', 'controling', 'analista')
 @empresa_tiene_productos_required
 def proveedores():
-    """Página para ver todos los proveedores"""
-    if current_user.rol == 'controling':
-        # Controling solo ve proveedores de su empresa
-        proveedores = Proveedor.query.filter_by(empresa_id=current_user.empresa_id).all()
-    else:
-        # Admin y master ven todos los proveedores
-        proveedores = Proveedor.query.all()
-    
-    return render_template('proveedores.html', proveedores=proveedores)
+    """Página para ver los proveedores, con filtros por faceta y paginación por cursor"""
+    # Controling solo ve proveedores de su empresa; admin, master y analista ven todos
+    return render_listado_productos('proveedores', 'proveedores.html')
 
 @app.route('/proveedores/nuevo', methods=['GET', 'POST'])
 @login_required
@@ -2826,7 +5395,7 @@ def eliminar_proveedor(id):
         flash('No autorizado para eliminar este proveedor.', 'danger')
         return redirect(url_for('proveedores'))
     
-    # Verificar si el proveedor tiene contratos asociados
+    # Verificar si el proveedor tiene contratos asociados (activos)
     if hasattr(proveedor, 'contratos') and proveedor.contratos:
         flash('No se puede eliminar el proveedor porque tiene contratos asociados.', 'danger')
         return redirect(url_for('proveedores'))
@@ -2836,12 +5405,14 @@ def eliminar_proveedor(id):
         flash('No se puede eliminar el proveedor porque tiene catálogos asociados.', 'danger')
         return redirect(url_for('proveedores'))
     
-    db.session.delete(proveedor)
+    # Borrado lógico: deja de aparecer en listados, búsquedas y exportaciones
+    proveedor.delete()
     db.session.commit()
     flash('Proveedor eliminado correctamente.', 'success')
     return redirect(url_for('proveedores'))
 
 @app.route('/exportar_proveedores')
+@lectura_en_replica
 @login_required
 @rol_required('admin', 'master', 'controling', 'analista')
 @empresa_tiene_productos_required
@@ -2896,15 +5467,9 @@ def exportar_proveedores():
 @rol_required('admin', 'master', 'controling', 'analista')
 @empresa_tiene_productos_required
 def contratos():
-    """Página para ver todos los contratos"""
-    if current_user.rol == 'controling':
-        # Controling solo ve contratos de proveedores de su empresa
-        contratos = Contrato.query.join(Proveedor).filter(Proveedor.empresa_id == current_user.empresa_id).all()
-    else:
-        # Admin, master y analista ven todos los contratos
-        contratos = Contrato.query.all()
-    
-    return render_template('contratos.html', contratos=contratos)
+    """Página para ver los contratos, con filtros por faceta y paginación por cursor"""
+    # Controling solo ve contratos de proveedores de su empresa; admin, master y analista ven todos
+    return render_listado_productos('contratos', 'contratos.html')
 
 @app.route('/contratos/nuevo', methods=['GET', 'POST'])
 @login_required
@@ -3071,21 +5636,14 @@ def eliminar_contrato(id):
         flash('No autorizado para eliminar este contrato.', 'danger')
         return redirect(url_for('contratos'))
     
-    # Eliminar el archivo de comprobante si existe
-    if contrato.comprobante_venta:
-        ruta_comprobante = os.path.join(app.config['UPLOAD_FOLDER'], contrato.comprobante_venta)
-        if os.path.exists(ruta_comprobante):
-            try:
-                os.remove(ruta_comprobante)
-            except Exception as e:
-                print(f"Error al eliminar archivo: {e}")
-    
-    db.session.delete(contrato)
+    # Borrado lógico: el comprobante se conserva por si se restaura
+    contrato.delete()
     db.session.commit()
     flash('Contrato eliminado correctamente.', 'success')
     return redirect(url_for('contratos'))
 
 @app.route('/exportar_contratos')
+@lectura_en_replica
 @login_required
 @rol_required('admin', 'master', 'controling', 'analista')
 @empresa_tiene_productos_required
@@ -3133,15 +5691,9 @@ def exportar_contratos():
 @rol_required('admin', 'master', 'controling', 'analista')
 @empresa_tiene_productos_required
 def catalogos():
-    """Página para ver todos los catálogos"""
-    if current_user.rol == 'controling':
-        # Controling solo ve catálogos de proveedores de su empresa
-        catalogos = Catalogo.query.join(Proveedor).filter(Proveedor.empresa_id == current_user.empresa_id).all()
-    else:
-        # Admin, master y analista ven todos los catálogos
-        catalogos = Catalogo.query.all()
-    
-    return render_template('catalogos.html', catalogos=catalogos)
+    """Página para ver los catálogos, con filtros por faceta y paginación por cursor"""
+    # Controling solo ve catálogos de proveedores de su empresa; admin, master y analista ven todos
+    return render_listado_productos('catalogos', 'catalogos.html')
 
 @app.route('/catalogos/nuevo', methods=['GET', 'POST'])
 @login_required
@@ -3314,21 +5866,14 @@ def eliminar_catalogo(id):
         flash('No autorizado para eliminar este catálogo.', 'danger')
         return redirect(url_for('catalogos'))
     
-    # Eliminar el archivo de comprobante si existe
-    if catalogo.comprobante_venta:
-        ruta_comprobante = os.path.join(app.config['UPLOAD_FOLDER'], catalogo.comprobante_venta)
-        if os.path.exists(ruta_comprobante):
-            try:
-                os.remove(ruta_comprobante)
-            except Exception as e:
-                print(f"Error al eliminar archivo: {e}")
-    
-    db.session.delete(catalogo)
+    # Borrado lógico: el comprobante se conserva por si se restaura
+    catalogo.delete()
     db.session.commit()
     flash('Catálogo eliminado correctamente.', 'success')
     return redirect(url_for('catalogos'))
 
 @app.route('/exportar_catalogos')
+@lectura_en_replica
 @login_required
 @rol_required('admin', 'master', 'controling', 'analista')
 @empresa_tiene_productos_required
@@ -3421,6 +5966,7 @@ def ver_comprobante_catalogo(id):
 # EXPORTACIONES A EXCEL
 # =====================
 @app.route('/exportar_usuarios')
+@lectura_en_replica
 @login_required
 @rol_required('admin', 'master','controling')
 def exportar_usuarios():
@@ -3464,9 +6010,16 @@ def exportar_usuarios():
     )
 
 @app.route('/exportar_reservas') 
+@lectura_en_replica
 @login_required
 def exportar_reservas():
     reservas = Reserva.query.all() if current_user.rol in ('admin', 'master') else Reserva.query.filter_by(usuario_id=current_user.id).all()
+    # Las reservas archivadas solo se exportan si se piden (?incluir_archivo=1)
+    if request.args.get('incluir_archivo'):
+        archivo = ReservaArchivada.query
+        if current_user.rol not in ('admin', 'master'):
+            archivo = archivo.filter_by(usuario_id=current_user.id)
+        reservas += archivo.all()
 
     data = []
     for r in reservas:
@@ -3529,7 +6082,276 @@ def exportar_reservas():
     )
 
 
+# =====================
+# IMPORTACIÓN DE RESERVAS
+# =====================
+# Encabezados de /exportar_reservas que se importan -> columna de Reserva. El resto (ID, empresa,
+# neto, ganancia, comisiones, comprobante) se ignora: se derivan del usuario o se calculan.
+ENCABEZADOS_IMPORTACION_RESERVA = {
+    'Fecha de viaje': 'fecha_viaje',
+    'Fecha fin viaje': 'fecha_fin_viaje',
+    'Fecha de venta': 'fecha_venta',
+    'Producto': 'producto',
+    'Modalidad de pago': 'modalidad_pago',
+    'Nombre de pasajero': 'nombre_pasajero',
+    'Teléfono de pasajero': 'telefono_pasajero',
+    'Mail Pasajero': 'mail_pasajero',
+    'Precio venta total': 'precio_venta_total',
+    'Hotel neto': 'hotel_neto',
+    'Vuelo neto': 'vuelo_neto',
+    'Traslado neto': 'traslado_neto',
+    'Seguro neto': 'seguro_neto',
+    'Circuito neto': 'circuito_neto',
+    'Crucero neto': 'crucero_neto',
+    'Excursion neto': 'excursion_neto',
+    'Paquete neto': 'paquete_neto',
+    'Bonos': 'bonos',
+    'Localizadores': 'localizadores',
+    'Nombre ejecutivo': 'nombre_ejecutivo',
+    'Correo ejecutivo': 'correo_ejecutivo',
+    'Destino': 'destino',
+    'Comentarios': 'comentarios',
+    'Estado de pago': 'estado_pago',
+    'Venta cobrada': 'venta_cobrada',
+    'Venta emitida': 'venta_emitida',
+    'Opinion': 'opinion',
+    'Postventa': 'postventa',
+    'Estado postventa': 'estado_postventa',
+    'Experiencia': 'experiencia',
+    'Seguimiento': 'seguimiento',
+}
+# La exportación de admin_reservas usa los nombres de columna: se aceptan como alias de los encabezados
+ALIAS_IMPORTACION_RESERVA = {campo: encabezado for encabezado, campo in ENCABEZADOS_IMPORTACION_RESERVA.items()}
+ALIAS_IMPORTACION_RESERVA['usuario_id'] = 'Usuario ID'
+IMPORTACION_LOTE = 1000
+IMPORTACION_MAX_ERRORES_VISTA = 500
+
+def leer_archivo_reservas(archivo, nombre):
+    """DataFrame (todo como texto u objeto) de un XLSX o CSV con el formato de /exportar_reservas."""
+    if nombre.lower().endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(archivo, dtype=object)
+    elif nombre.lower().endswith('.csv'):
+        df = pd.read_csv(archivo, sep=None, engine='python', dtype=str, encoding='utf-8-sig', keep_default_na=False)
+    else:
+        raise ValueError('El archivo debe ser .xlsx o .csv.')
+    df.columns = [str(c).strip() for c in df.columns]
+    return df
+
+def texto_serie(serie):
+    """Serie como texto sin espacios extremos; vacíos y NaN quedan como ''."""
+    return serie.where(serie.notna(), '').astype(str).str.strip()
+
+def fechas_serie(serie):
+    """
+    Convierte una columna a fechas probando cada formato aceptado sobre toda la columna.
+    Devuelve (fechas como datetime64, máscara de valores no vacíos que no se pudieron leer).
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie, pd.Series(False, index=serie.index)
+    # Las celdas de Excel llegan como datetime; el resto se lee como texto
+    texto = serie.map(lambda v: v.strftime('%Y-%m-%d') if hasattr(v, 'strftime') else v)
+    texto = texto_serie(texto).str.slice(0, 10)
+    fechas = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns]')
+    for fmt in FORMATOS_FECHA_FORMULARIO:
+        pendientes = fechas.isna() & (texto != '')
+        if not pendientes.any():
+            break
+        fechas[pendientes] = pd.to_datetime(texto[pendientes], format=fmt, errors='coerce')
+    return fechas, fechas.isna() & (texto != '')
+
+def montos_serie(serie):
+    """
+    Convierte una columna de montos ('$ 1.234.567', '1.234,50', 1234.5) a float en una pasada.
+    Vacío es 0 (como safe_decimal). Devuelve (montos, máscara de valores no numéricos).
+    """
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.fillna(0).astype(float), pd.Series(False, index=serie.index)
+    texto = texto_serie(serie).str.replace(r'[\$\s]', '', regex=True)
+    con_coma = texto.str.contains(',', regex=False)
+    # Con coma decimal: los puntos son miles. Sin coma: puntos seguidos de tres dígitos son miles.
+    texto = texto.where(~con_coma, texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    texto = texto.where(con_coma, texto.str.replace(r'\.(?=\d{3}(?:\.|$))', '', regex=True))
+    montos = pd.to_numeric(texto, errors='coerce')
+    return montos.fillna(0).astype(float), montos.isna() & (texto != '')
+
+def importar_reservas(df, usuario_defecto, forzar_usuario=False, empresa_id=None, solo_validar=False):
+    """
+    Importa reservas desde un DataFrame con los encabezados de /exportar_reservas (o los nombres de
+    columna de /exportar_reservas_admin; el resto de sus columnas, como id o comisiones, se ignora).
+    Valida y convierte cada columna de una vez según PLAN_RESERVA (fechas, montos, opciones,
+    largos, los mismos que usa el formulario de reservas), calcula las
+    comisiones con el porcentaje de cada usuario y agrega las filas válidas en lotes de
+    IMPORTACION_LOTE (executemany) dentro de una sola transacción. Las filas con errores no se
+    insertan. El usuario de cada fila sale de 'Usuario ID' o 'Usuario' (username), o es
+    `usuario_defecto`; con `forzar_usuario` todas son de `usuario_defecto`, y con `empresa_id`
+    solo se aceptan usuarios de esa empresa.
+    Devuelve {'filas', 'validas', 'insertadas', 'errores': [{'fila', 'columna', 'valor', 'mensaje'}]}.
+    """
+    df = df.rename(columns={
+        columna: encabezado for columna, encabezado in ALIAS_IMPORTACION_RESERVA.items()
+        if columna in df.columns and encabezado not in df.columns
+    })
+    if 'Fecha de venta' not in df.columns:
+        raise ValueError('Falta la columna "Fecha de venta" (usa el formato de la exportación de reservas).')
+    errores = []
+    invalidas = pd.Series(False, index=df.index)
+
+    def marcar(mascara, encabezado, mensaje, valores):
+        nonlocal invalidas
+        mascara = mascara.reindex(df.index, fill_value=False).fillna(False).astype(bool)
+        invalidas |= mascara
+        for indice in df.index[mascara]:
+            errores.append({'fila': int(indice) + 2, 'columna': encabezado,
+                            'valor': '' if pd.isna(valores[indice]) else str(valores[indice]), 'mensaje': mensaje})
+
+    datos = pd.DataFrame(index=df.index)
+    plan = PLAN_RESERVA
+    for encabezado, campo in ENCABEZADOS_IMPORTACION_RESERVA.items():
+        if encabezado not in df.columns:
+            continue
+        serie = df[encabezado]
+        if campo in plan.fechas:
+            datos[campo], malas = fechas_serie(serie)
+            marcar(malas, encabezado, 'Fecha inválida', serie)
+        elif campo in plan.numericos:
+            datos[campo], malas = montos_serie(serie)
+            marcar(malas, encabezado, 'Monto inválido', serie)
+        elif campo in plan.opciones:
+            texto = texto_serie(serie)
+            enums = plan.opciones[campo]
+            datos[campo] = texto.str.lower().map({opcion.lower(): opcion for opcion in enums})
+            marcar(datos[campo].isna() & (texto != ''), encabezado,
+                   f"Valor no permitido (opciones: {', '.join(enums)})", serie)
+            datos[campo] = datos[campo].fillna(Reserva.__table__.columns[campo].default.arg)
+        else:
+            datos[campo] = texto_serie(serie)
+            largo = plan.largos.get(campo)
+            if largo:
+                marcar(datos[campo].str.len() > largo, encabezado, f'Más de {largo} caracteres', serie)
+    marcar(datos['fecha_venta'].isna() & ~invalidas, 'Fecha de venta', 'La fecha de venta es obligatoria', df['Fecha de venta'])
+
+    # Usuario de cada fila (una consulta para todos los usuarios nombrados en el archivo)
+    if forzar_usuario:
+        datos['usuario_id'] = usuario_defecto.id
+        usuarios = {usuario_defecto.id: usuario_defecto}
+    else:
+        ids = pd.to_numeric(texto_serie(df['Usuario ID']), errors='coerce') if 'Usuario ID' in df.columns \
+            else pd.Series(float('nan'), index=df.index)
+        nombres = texto_serie(df['Usuario']) if 'Usuario' in df.columns else pd.Series('', index=df.index)
+        consulta = Usuario.query.filter(db.or_(
+            Usuario.id.in_([int(i) for i in ids.dropna().unique()] + [usuario_defecto.id]),
+            Usuario.username.in_([n for n in nombres.unique() if n]),
+        ))
+        if empresa_id:
+            consulta = consulta.filter(Usuario.empresa_id == empresa_id)
+        usuarios = {u.id: u for u in consulta}
+        por_username = {u.username: u.id for u in usuarios.values()}
+        resuelto = ids.where(ids.isin(list(usuarios)), nombres.map(por_username))
+        nombrado = ids.notna() | (nombres != '')
+        marcar(resuelto.isna() & nombrado, 'Usuario', 'Usuario inexistente o de otra empresa',
+               nombres.where(nombres != '', ids))
+        datos['usuario_id'] = resuelto.where(nombrado, usuario_defecto.id if usuario_defecto.id in usuarios else None)
+        marcar(datos['usuario_id'].isna() & ~nombrado, 'Usuario', 'Falta el usuario de la reserva', nombres)
+    datos = datos[~invalidas].copy()
+    datos['usuario_id'] = datos['usuario_id'].astype(int)
+    datos['empresa_id'] = datos['usuario_id'].map({uid: u.empresa_id for uid, u in usuarios.items()})
+
+    # Ejecutivo por defecto: el del usuario
+    for campo, valor in (('nombre_ejecutivo', lambda u: f"{u.nombre} {u.apellidos}"), ('correo_ejecutivo', lambda u: u.correo)):
+        defecto = datos['usuario_id'].map({uid: valor(u) for uid, u in usuarios.items()})
+        datos[campo] = datos[campo].where(datos[campo] != '', defecto) if campo in datos else defecto
+
+    # Meses cerrados: una consulta por los periodos de las empresas del archivo
+    datos['periodo'] = datos['fecha_venta'].dt.strftime('%Y-%m')
+    cerrados = {
+        (c.empresa_id, c.periodo) for c in CierreMes.query.filter(
+            CierreMes.empresa_id.in_([int(e) for e in datos['empresa_id'].dropna().unique()]),
+            CierreMes.periodo.in_(list(datos['periodo'].unique())),
+        )
+    } if len(datos) else set()
+    if cerrados:
+        en_cierre = pd.Series([(e, p) in cerrados for e, p in zip(datos['empresa_id'], datos['periodo'])], index=datos.index)
+        marcar(en_cierre, 'Fecha de venta', 'El mes de venta está cerrado', df['Fecha de venta'])
+        datos = datos[~en_cierre]
+
+    # Comisiones de todas las filas a la vez (misma fórmula que calcular_comisiones)
+    for campo in COLUMNAS_NETO_RESERVA + ('precio_venta_total', 'bonos'):
+        if campo not in datos:
+            datos[campo] = 0.0
+    ganancia = datos['precio_venta_total'] - datos[list(COLUMNAS_NETO_RESERVA)].sum(axis=1)
+    porcentaje = datos['usuario_id'].map({uid: float(safe_decimal(u.comision)) / 100 for uid, u in usuarios.items()})
+    datos['comision_ejecutivo'] = (ganancia * porcentaje).round(2)
+    datos['comision_agencia'] = (ganancia - datos['comision_ejecutivo']).round(2)
+
+    resultado = {'filas': len(df), 'validas': len(datos), 'insertadas': 0,
+                 'errores': sorted(errores, key=lambda e: e['fila'])}
+    if solo_validar or not len(datos):
+        return resultado
+
+    datos = datos.drop(columns='periodo')
+    for campo in ('fecha_viaje', 'fecha_fin_viaje', 'fecha_venta'):
+        if campo in datos:
+            datos[campo] = datos[campo].dt.date
+    datos = datos.astype(object).where(datos.notna(), None)
+    registros = datos.to_dict('records')
+    tabla = Reserva.__table__
+    for inicio in range(0, len(registros), IMPORTACION_LOTE):
+        db.session.execute(tabla.insert(), registros[inicio:inicio + IMPORTACION_LOTE])
+    db.session.commit()
+    resultado['insertadas'] = len(registros)
+    return resultado
+
+@app.route('/importar_reservas', methods=['GET', 'POST'])
+@login_required
+@rol_required('admin', 'master', 'controling', 'ejecutivo', 'analista')
+def importar_reservas_view():
+    """Importar reservas desde un XLSX/CSV con el formato de la exportación"""
+    resultado = None
+    if request.method == 'POST':
+        archivo = request.files.get('archivo')
+        if not archivo or not archivo.filename:
+            flash('Selecciona un archivo .xlsx o .csv.', 'danger')
+            return redirect(url_for('importar_reservas_view'))
+        try:
+            df = leer_archivo_reservas(archivo, archivo.filename)
+            resultado = importar_reservas(
+                df, current_user,
+                forzar_usuario=current_user.rol in ['ejecutivo', 'analista'],
+                empresa_id=current_user.empresa_id if current_user.rol == 'controling' else None,
+                solo_validar=bool(request.form.get('solo_validar')),
+            )
+        except (ValueError, csv.Error, pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+            flash(f'No se pudo leer el archivo: {e}', 'danger')
+            return redirect(url_for('importar_reservas_view'))
+        if resultado['insertadas']:
+            flash(f"{resultado['insertadas']} reserva(s) importada(s).", 'success')
+        elif not resultado['errores']:
+            flash(f"Archivo válido: {resultado['validas']} reserva(s) listas para importar.", 'info')
+    return render_template('importar_reservas.html', resultado=resultado,
+                           max_errores=IMPORTACION_MAX_ERRORES_VISTA)
+
+@app.cli.command('importar-reservas')
+@click.argument('archivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--usuario', 'username', required=True, help='Usuario de las filas sin "Usuario ID" ni "Usuario".')
+@click.option('--solo-validar', is_flag=True, help='Revisar el archivo sin insertar.')
+def importar_reservas_command(archivo, username, solo_validar):
+    """Importa reservas desde un XLSX/CSV con el formato de /exportar_reservas."""
+    usuario = Usuario.query.filter_by(username=username).first()
+    if not usuario:
+        raise click.BadParameter(f'No existe el usuario {username}.', param_hint='--usuario')
+    inicio = time.perf_counter()
+    try:
+        resultado = importar_reservas(leer_archivo_reservas(archivo, archivo), usuario, solo_validar=solo_validar)
+    except (ValueError, csv.Error, pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+        raise click.ClickException(f'No se pudo leer el archivo: {e}')
+    for error in resultado['errores']:
+        click.echo(f"Fila {error['fila']} [{error['columna']}] {error['mensaje']}: {error['valor']}")
+    click.echo(f"{resultado['filas']} fila(s), {resultado['validas']} válida(s), "
+               f"{resultado['insertadas']} insertada(s), {len(resultado['errores'])} error(es) "
+               f"en {time.perf_counter() - inicio:.1f} s.")
+
 @app.route('/exportar_reporte_detalle_ventas')
+@lectura_en_replica
 @login_required
 @rol_required('admin', 'master')
 def exportar_reporte_detalle_ventas():
@@ -3546,21 +6368,15 @@ def exportar_reporte_detalle_ventas():
         today = datetime.now()
         year, month = today.year, today.month
         selected_mes_str = today.strftime('%Y-%m')
-    reservas_query = Reserva.query.join(Usuario)
-    reservas_query = reservas_query.filter(
-        db.extract('year', Reserva.fecha_venta) == year,
-        db.extract('month', Reserva.fecha_venta) == month,
-        Usuario.rol.in_(['ejecutivo', 'analista', 'controling'])
+    reservas = reservas_del_periodo(
+        empresa_en_alcance(selected_empresa_id), year, month, roles=['ejecutivo', 'analista', 'controling']
     )
-    if selected_empresa_id and current_user.rol in ['master', 'admin']:
-        reservas_query = reservas_query.filter(Usuario.empresa_id == int(selected_empresa_id))
-    elif current_user.rol == 'controling':
-        reservas_query = reservas_query.filter(Usuario.empresa_id == current_user.empresa_id)
-    reservas = reservas_query.all()
     # Generar datos_comisiones igual que en la vista y exportar todos los campos de la tabla
     datos_comisiones = []
     for reserva in reservas:
-        comision_ejecutivo, comision_agencia, ganancia_total, comision_ejecutivo_porcentaje, _ = calcular_comisiones(reserva, reserva.usuario)
+        comision_ejecutivo = reserva.comision_ejecutivo or 0
+        comision_agencia = reserva.comision_agencia or 0
+        ganancia_total = reserva.ganancia_total or 0
         bonos = reserva.bonos or 0.0
         # Obtener nombre del ejecutivo
         if getattr(reserva, 'nombre_ejecutivo', None):
@@ -3599,6 +6415,7 @@ def exportar_reporte_detalle_ventas():
     )
 
 @app.route('/exportar_reservas_usuario')
+@lectura_en_replica
 @login_required
 def exportar_reservas_usuario():
     # Obtener mes seleccionado
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark del paso formulario -> modelo al guardar una reserva.
+
+Compara la forma anterior de set_model_fields (recorrer e inspeccionar las columnas del
+modelo en cada guardado y probar los formatos de fecha con strptime) con el plan
+precalculado (PLAN_RESERVA) que usan ahora set_reserva_fields y la importación. Antes de
+medir comprueba que ambos dejan los mismos valores en el objeto.
+
+Uso:
+    python bench_formularios.py [--repeticiones 20000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+
+
+def set_model_fields_anterior(G, obj, form, exclude=None, date_fields=None):
+    """set_model_fields tal como era antes de los planes: introspección en cada llamada."""
+    db = G.db
+    exclude = exclude or set()
+    campos_float, campos_str = [], []
+    for col in obj.__table__.columns:
+        if col.name in exclude:
+            continue
+        if isinstance(col.type, (db.Float, db.Numeric)):
+            campos_float.append(col.name)
+        elif isinstance(col.type, (db.String, db.Text, db.Enum)):
+            campos_str.append(col.name)
+    for campo in campos_float:
+        setattr(obj, campo, G.safe_decimal(form.get(campo, 0)))
+    for campo in campos_str:
+        setattr(obj, campo, form.get(campo, '').strip())
+    for campo in date_fields or []:
+        valor = (form.get(campo, '') or '').strip()
+        fecha = None
+        for fmt in G.FORMATOS_FECHA_FORMULARIO:
+            try:
+                fecha = datetime.strptime(valor, fmt).date()
+                break
+            except Exception:
+                continue
+        setattr(obj, campo, fecha)
+
+
+def formulario_reserva():
+    return {
+        'fecha_venta': '2025-07-15', 'fecha_viaje': '2025-12-01', 'fecha_fin_viaje': '2025-12-10',
+        'producto': 'Bench', 'precio_venta_total': '1000', 'hotel_neto': '400', 'vuelo_neto': '250,5',
+        'nombre_pasajero': ' Pasajero Bench ', 'destino': 'Caribe',
+        'estado_pago': 'No Pagado', 'venta_cobrada': 'No Cobrada', 'venta_emitida': 'No Emitida',
+        'opinion': 'no', 'postventa': 'no', 'estado_postventa': 'not ok',
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeticiones', type=int, default=20000)
+    args = parser.parse_args()
+
+    # Ginebra crea su base al importarse: se deja en un directorio temporal
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tmp, 'bench.db'))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import Ginebra as G
+
+    plan = G.PLAN_RESERVA
+    exclude = {'empresa_id', 'usuario_id', 'usuario', 'comprobante_pdf', 'comprobante_venta',
+               'comision_ejecutivo', 'comision_agencia', 'ganancia_total', 'precio_venta_neto'}
+    date_fields = ['fecha_venta', 'fecha_fin_viaje', 'fecha_viaje']
+    form = formulario_reserva()
+
+    anterior, nuevo = G.Reserva(), G.Reserva()
+    set_model_fields_anterior(G, anterior, form, exclude, date_fields)
+    plan.aplicar(nuevo, form)
+    campos = plan.numericos + plan.textos + plan.fechas
+    distintos = [c for c in campos if getattr(anterior, c) != getattr(nuevo, c)]
+    if distintos:
+        sys.exit(f"Los resultados difieren en: {', '.join(distintos)}")
+
+    casos = (
+        ('introspección por llamada', lambda: set_model_fields_anterior(G, G.Reserva(), form, exclude, date_fields)),
+        ('plan precalculado', lambda: plan.aplicar(G.Reserva(), form)),
+        ('plan, solo valores (lote)', lambda: plan.valores(form)),
+    )
+    print(f"{len(campos)} campos por reserva, {args.repeticiones} guardados por caso")
+    print(f"{'caso':<30}{'µs/guardado':>14}")
+    for nombre, funcion in casos:
+        mejor = min(timeit.repeat(funcion, number=args.repeticiones, repeat=3))
+        print(f"{nombre:<30}{mejor / args.repeticiones * 1e6:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
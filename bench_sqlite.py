@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Benchmark de concurrencia lectura/escritura sobre SQLite.
+
+Simula un worker de gunicorn con varios hilos (worker gthread): cada hilo usa su propio
+cliente de la app, los lectores piden /api/resumen_estados_venta y los escritores crean
+reservas con POST /reservas. Corre el mismo escenario con el perfil de producción
+(WAL, synchronous=NORMAL, mmap...) y con el perfil básico de SQLite, cada uno en un
+proceso y una base temporal propios, e imprime la comparación.
+
+Uso:
+    python bench_sqlite.py [--hilos 8] [--escritores 2] [--segundos 10] [--reservas 5000]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+from decimal import Decimal
+
+PERFILES = ('produccion', 'basico')
+
+
+def preparar_datos(G, num_reservas):
+    """Crea una empresa, un usuario controling y `num_reservas` reservas repartidas en el año."""
+    db = G.db
+    db.create_all()
+    empresa = G.Empresa(nombre='Bench', tiene_gestion='si', tiene_productos='si')
+    db.session.add(empresa)
+    db.session.flush()
+    usuario = G.Usuario(username='bench', nombre='Bench', apellidos='Ejecutivo', correo='bench@x',
+                          rol='controling', comision=Decimal('10'), empresa_id=empresa.id)
+    usuario.password = 'bench'
+    db.session.add(usuario)
+    db.session.flush()
+    db.session.add_all([
+        G.Reserva(
+            usuario_id=usuario.id, empresa_id=empresa.id, fecha_venta=date(2025, 1 + i % 12, 1 + i % 28),
+            producto='Bench', precio_venta_total=Decimal('1000'), hotel_neto=Decimal('400'),
+            comision_ejecutivo=Decimal('60'), comision_agencia=Decimal('540'),
+            estado_pago='Pagado' if i % 2 else 'No Pagado'
+        )
+        for i in range(num_reservas)
+    ])
+    db.session.commit()
+
+
+def formulario_reserva(i):
+    return {
+        'fecha_venta': f"2025-{1 + i % 12:02d}-15", 'fecha_viaje': '2025-12-01', 'fecha_fin_viaje': '2025-12-10',
+        'producto': 'Bench', 'precio_venta_total': '1000', 'hotel_neto': '400',
+        'estado_pago': 'No Pagado', 'venta_cobrada': 'No Cobrada', 'venta_emitida': 'No Emitida',
+        'opinion': 'no', 'postventa': 'no', 'estado_postventa': 'not ok',
+    }
+
+
+def correr_hilo(app, es_escritor, fin, resultados, indice):
+    cliente = app.test_client()
+    cliente.post('/login', data={'username': 'bench', 'password': 'bench'})
+    latencias, errores, i = [], 0, 0
+    while time.monotonic() < fin:
+        inicio = time.monotonic()
+        if es_escritor:
+            respuesta = cliente.post('/reservas', data=formulario_reserva(indice * 100000 + i))
+        else:
+            respuesta = cliente.get(f"/api/resumen_estados_venta?mes=2025-{1 + i % 12:02d}")
+        latencias.append(time.monotonic() - inicio)
+        if respuesta.status_code >= 400:
+            errores += 1
+        i += 1
+    resultados[indice] = (es_escritor, latencias, errores)
+
+
+def ejecutar_perfil(hilos, escritores, segundos, num_reservas):
+    """Proceso hijo: la configuración se lee al importar Ginebra, por eso cada perfil corre aparte."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import Ginebra as G
+    app = G.app
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        preparar_datos(G, num_reservas)
+
+    fin = time.monotonic() + segundos
+    resultados = [None] * hilos
+    trabajadores = [
+        threading.Thread(target=correr_hilo, args=(app, i < escritores, fin, resultados, i))
+        for i in range(hilos)
+    ]
+    for hilo in trabajadores:
+        hilo.start()
+    for hilo in trabajadores:
+        hilo.join()
+
+    resumen = {}
+    for tipo, es_escritor in (('lecturas', False), ('escrituras', True)):
+        latencias = [l for e, lat, _ in resultados if e == es_escritor for l in lat]
+        errores = sum(err for e, _, err in resultados if e == es_escritor)
+        cuantiles = statistics.quantiles(latencias, n=100) if len(latencias) > 1 else [0] * 99
+        resumen[tipo] = {
+            'ops_por_seg': len(latencias) / segundos,
+            'p50_ms': cuantiles[49] * 1000,
+            'p95_ms': cuantiles[94] * 1000,
+            'errores': errores,
+        }
+    print(json.dumps(resumen))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hilos', type=int, default=8)
+    parser.add_argument('--escritores', type=int, default=2)
+    parser.add_argument('--segundos', type=float, default=10)
+    parser.add_argument('--reservas', type=int, default=5000)
+    parser.add_argument('--perfil-hijo', choices=PERFILES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.perfil_hijo:
+        ejecutar_perfil(args.hilos, args.escritores, args.segundos, args.reservas)
+        return
+
+    print(f"{args.hilos} hilos ({args.escritores} escritores), {args.segundos:g} s, {args.reservas} reservas iniciales")
+    print(f"{'perfil':<12}{'tipo':<12}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errores':>10}")
+    for perfil in PERFILES:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                SQLITE_PERFIL=perfil,
+                DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'),
+                LIQUIDACION_PDF_CACHE_DIR=os.path.join(tmp, 'cache'),
+                COMPROBANTES_ARCHIVO_FOLDER=os.path.join(tmp, 'archivo'),
+            )
+            salida = subprocess.run(
+                [sys.executable, __file__, '--perfil-hijo', perfil, '--hilos', str(args.hilos),
+                 '--escritores', str(args.escritores), '--segundos', str(args.segundos),
+                 '--reservas', str(args.reservas)],
+                env=env, capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+        for tipo, datos in json.loads(salida).items():
+            print(f"{perfil:<12}{tipo:<12}{datos['ops_por_seg']:>10.1f}{datos['p50_ms']:>10.1f}"
+                  f"{datos['p95_ms']:>10.1f}{datos['errores']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,8 @@
 from Ginebra import db, Usuario, app
 
 with app.app_context():
-    db.drop_all()
-    db.create_all()
+    db.drop_all(bind_key=None)
+    db.create_all(bind_key=None)
 
     admin = Usuario(
         username='erobles',
@@ -4,14 +4,17 @@ Crea las tablas y el usuario master automáticamente.
 """
 import os
 from sqlalchemy import text
-from Ginebra import app, db, Usuario
+from Ginebra import (
+    app, db, Usuario, Reserva, ReservaArchivada, Factura, asignar_empresa_reservas, convertir_columnas_generadas_reserva,
+    actualizar_indices_busqueda, preparar_borrado_logico, es_postgresql, particionar_tabla_reserva, crear_particiones_reserva
+)
 
 def init_database():
     with app.app_context():
         # Si existe la variable RESET_DB, eliminar todo y recrear
         if os.environ.get('RESET_DB') == 'true':
             print("⚠ RESET_DB activado - Eliminando todas las tablas...")
-            db.drop_all()
+            db.drop_all(bind_key=None)
             
             # Eliminar los tipos ENUM huérfanos de PostgreSQL
             try:
@@ -23,9 +26,40 @@ def init_database():
                 print(f"• No se pudieron eliminar ENUMs: {e}")
                 db.session.rollback()
         
-        # Crear todas las tablas
-        db.create_all()
+        # Crear todas las tablas (solo en la base principal; la réplica, si existe, se replica sola)
+        db.create_all(bind_key=None)
         print("✓ Tablas de base de datos creadas")
+
+        # Bases anteriores: precio_venta_neto y ganancia_total pasan a columnas generadas
+        convertidas = convertir_columnas_generadas_reserva()
+        if convertidas:
+            print(f"✓ Columnas generadas en reserva: {', '.join(convertidas)}")
+
+        # Índices de texto completo de proveedores, contratos y catálogos (reemplazan los B-tree de columnas Text)
+        actualizar_indices_busqueda()
+        db.session.commit()
+        print("✓ Índices de búsqueda actualizados")
+        preparar_borrado_logico()
+        db.session.commit()
+        print("✓ Borrado lógico: registros sin estado activados e índices parciales creados")
+
+        # create_all no agrega índices a tablas existentes
+        for indice in (*Reserva.__table__.indexes, *ReservaArchivada.__table__.indexes, *Factura.__table__.indexes):
+            indice.create(db.engine, checkfirst=True)
+        actualizadas = asignar_empresa_reservas()
+        print(f"✓ Empresa asignada en {actualizadas} reserva(s)")
+
+        # Particionado mensual de reservas (opcional, solo PostgreSQL)
+        if app.config['RESERVA_PARTICIONADA'] and es_postgresql():
+            try:
+                if particionar_tabla_reserva():
+                    print("✓ Tabla reserva migrada a tabla particionada")
+                creadas = crear_particiones_reserva()
+                db.session.commit()
+                print(f"✓ {creadas} partición(es) de reserva creada(s)")
+            except RuntimeError as e:
+                # Reservas sin fecha_venta: la tabla sigue sin particionar hasta completarlas
+                print(f"• Particionado pendiente: {e}")
         
         # Crear usuario master si no existe
         if not Usuario.query.filter_by(username='mcontreras').first():
@@ -17,7 +17,7 @@ def init_database():
     
     with app.app_context():
         # Crear todas las tablas
-        db.create_all()
+        db.create_all(bind_key=None)
         print("✓ Tablas creadas correctamente")
         
         # Crear usuario master si no existe
@@ -0,0 +1,97 @@
+// Cambio de estados en bloque en estados_de_venta.html
+// Aplica estado de venta / cobrada / emitida a las ventas seleccionadas (o a todo el mes)
+// con una sola llamada y actualiza las celdas y los contadores sin recargar la página.
+
+document.addEventListener('DOMContentLoaded', function() {
+    const panel = document.getElementById('transicion-estados');
+    if (!panel) return;
+    const seleccionarTodas = document.getElementById('seleccionar-todas');
+    const contador = document.getElementById('num-seleccionadas');
+
+    function seleccionadas() {
+        return Array.from(document.querySelectorAll('.seleccion-venta:checked')).map(c => c.value);
+    }
+
+    function actualizarContador() {
+        contador.textContent = seleccionadas().length;
+    }
+
+    seleccionarTodas.addEventListener('change', function() {
+        document.querySelectorAll('.seleccion-venta').forEach(c => { c.checked = seleccionarTodas.checked; });
+        actualizarContador();
+    });
+    document.body.addEventListener('change', function(e) {
+        if (e.target.matches('.seleccion-venta')) actualizarContador();
+    });
+
+    function leerCambios() {
+        const cambios = {};
+        panel.querySelectorAll('select[data-campo]').forEach(s => {
+            if (s.value) cambios[s.dataset.campo] = s.value;
+        });
+        return cambios;
+    }
+
+    function pintarFilas(ids, cambios) {
+        const filas = ids
+            ? ids.map(id => document.querySelector(`tr[data-reserva-id="${id}"]`)).filter(Boolean)
+            : Array.from(document.querySelectorAll('tr[data-reserva-id]'));
+        filas.forEach(fila => {
+            Object.entries(cambios).forEach(([campo, valor]) => {
+                const celda = fila.querySelector(`td[data-estado="${campo}"]`);
+                if (celda) celda.textContent = valor;
+            });
+        });
+    }
+
+    function pintarResumen(resumen) {
+        Object.entries(resumen).forEach(([clave, valor]) => {
+            const elemento = document.getElementById('resumen-' + clave);
+            if (elemento) elemento.textContent = valor;
+        });
+    }
+
+    panel.querySelectorAll('button[data-alcance]').forEach(boton => {
+        boton.addEventListener('click', function() {
+            const cambios = leerCambios();
+            if (!Object.keys(cambios).length) {
+                alert('Elige al menos un estado a cambiar.');
+                return;
+            }
+            const todas = boton.dataset.alcance === 'todas';
+            const ids = todas ? null : seleccionadas();
+            if (!todas && !ids.length) {
+                alert('Selecciona al menos una venta.');
+                return;
+            }
+            if (todas && !confirm('¿Aplicar el cambio a todas las ventas del mes?')) return;
+
+            boton.disabled = true;
+            fetch('/api/estados_de_venta/transicion', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-Requested-With': 'XMLHttpRequest'
+                },
+                body: JSON.stringify({
+                    mes: panel.dataset.mes,
+                    empresa_id: panel.dataset.empresaId,
+                    ids: ids || [],
+                    todas: todas,
+                    cambios: cambios
+                })
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.success) {
+                    pintarFilas(ids, data.cambios);
+                    pintarResumen(data.resumen);
+                } else {
+                    alert('Error al guardar: ' + (data.message || ''));
+                }
+            })
+            .catch(err => alert('Error de red al guardar.'))
+            .finally(() => { boton.disabled = false; });
+        });
+    });
+});
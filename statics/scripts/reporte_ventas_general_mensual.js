@@ -25,7 +25,7 @@ const datosVentaEmitida = {
   }]
 };
 // Renderizar los gráficos
-new Chart(document.getElementById('graficoEstadoPago'), {
+const graficoEstadoPago = new Chart(document.getElementById('graficoEstadoPago'), {
   type: 'pie',
   data: datosEstadoPago,
   options: {
@@ -36,7 +36,7 @@ new Chart(document.getElementById('graficoEstadoPago'), {
     }
   }
 });
-new Chart(document.getElementById('graficoVentaCobrada'), {
+const graficoVentaCobrada = new Chart(document.getElementById('graficoVentaCobrada'), {
   type: 'pie',
   data: datosVentaCobrada,
   options: {
@@ -47,7 +47,7 @@ new Chart(document.getElementById('graficoVentaCobrada'), {
     }
   }
 });
-new Chart(document.getElementById('graficoVentaEmitida'), {
+const graficoVentaEmitida = new Chart(document.getElementById('graficoVentaEmitida'), {
   type: 'pie',
   data: datosVentaEmitida,
   options: {
@@ -58,3 +58,37 @@ new Chart(document.getElementById('graficoVentaEmitida'), {
     }
   }
 });
+
+// Formato de miles con punto (igual que el filtro formato_miles)
+function formatoMiles(valor) {
+  return Math.round(valor || 0).toString().replace(/\B(?=(\d{3})+(?!\d))/g, '.');
+}
+
+// Actualizar gráficos y totales al cambiar los filtros, sin recargar la página
+function actualizarResumen() {
+  const mes = document.getElementById('mes');
+  const empresa = document.getElementById('empresa_id');
+  if (!window.urlResumenEstadosVenta || !mes || !mes.value) return;
+  const params = new URLSearchParams({ mes: mes.value });
+  if (empresa && empresa.value) params.append('empresa_id', empresa.value);
+  fetch(`${window.urlResumenEstadosVenta}?${params.toString()}`)
+    .then(response => response.json())
+    .then(data => {
+      if (!data.success) return;
+      graficoEstadoPago.data.datasets[0].data = data.datos_estado_pago;
+      graficoVentaCobrada.data.datasets[0].data = data.datos_venta_cobrada;
+      graficoVentaEmitida.data.datasets[0].data = data.datos_venta_emitida;
+      graficoEstadoPago.update();
+      graficoVentaCobrada.update();
+      graficoVentaEmitida.update();
+      document.getElementById('ganancia_total_mes').textContent = '$' + formatoMiles(data.ganancia_total);
+      document.getElementById('comision_total_ejecutivos').textContent = '$' + formatoMiles(data.comision_ejecutivos);
+      document.getElementById('comision_total_agencia').textContent = '$' + formatoMiles(data.comision_agencia);
+    })
+    .catch(error => console.error('Error al actualizar el resumen:', error));
+}
+
+['mes', 'empresa_id'].forEach(id => {
+  const elemento = document.getElementById(id);
+  if (elemento) elemento.addEventListener('change', actualizarResumen);
+});
@@ -1,100 +1,100 @@
 // Script para actualizar opinión y postventa de reservas vía API
-// Usar en control_gestion_clientes.html y marketing.html
+// Usar en control_gestion_clientes.html, postventa.html y marketing.html
+//
+// Los cambios no se envían uno por uno: se acumulan por reserva y campo y, tras una pausa
+// sin ediciones, se guardan todos juntos en un solo POST al endpoint de lote.
+
+const URL_LOTE_OPINION_POSTVENTA = '/api/update_reservas_opinion_postventa';
+const ESPERA_GUARDADO_MS = 800;
+const CAMPOS_SEGUIMIENTO = ['estado_postventa', 'opinion', 'postventa', 'experiencia', 'seguimiento'];
 
 document.addEventListener('DOMContentLoaded', function() {
-    // Delegación para todos los selects de opinión y postventa
-    document.body.addEventListener('change', function(e) {
-        if (
-            e.target.matches('select[name^="opinion_"]') ||
-            e.target.matches('select[name^="postventa_"]') ||
-            e.target.matches('select[name^="estado_postventa_"]')
-        ) {
-            const select = e.target;
-            const reservaId = select.name.split('_').pop();
-            const row = select.closest('tr');
-            let payload = { reserva_id: reservaId };
-            if (row) {
-                const opinionSelect = row.querySelector('select[name^="opinion_"]');
-                if (opinionSelect) payload.opinion = opinionSelect.value;
-                const postventaSelect = row.querySelector('select[name^="postventa_"]');
-                if (postventaSelect) payload.postventa = postventaSelect.value;
-                const experienciaInput = row.querySelector('input[name^="experiencia_"]');
-                if (experienciaInput) payload.experiencia = experienciaInput.value;
-                const estadoPostventaSelect = row.querySelector('select[name^="estado_postventa_"]');
-                if (estadoPostventaSelect) payload.estado_postventa = estadoPostventaSelect.value;
-                const seguimientoInput = row.querySelector('input[name^="seguimiento_"]');
-                if (seguimientoInput) payload.seguimiento = seguimientoInput.value;
+    // reservaId -> { campo: valor }, y los elementos editados para marcarlos al guardar
+    let pendientes = new Map();
+    let elementosPendientes = new Set();
+    let temporizador = null;
+
+    // "estado_postventa_15" -> { campo: 'estado_postventa', reservaId: '15' }
+    function leerCampo(elemento) {
+        const nombre = elemento.name || '';
+        const campo = CAMPOS_SEGUIMIENTO.find(c => nombre.startsWith(c + '_'));
+        if (!campo) return null;
+        const reservaId = nombre.slice(campo.length + 1);
+        return /^\d+$/.test(reservaId) ? { campo, reservaId } : null;
+    }
+
+    function marcar(elementos, clase, duracion) {
+        elementos.forEach(el => {
+            el.classList.add(clase);
+            setTimeout(() => el.classList.remove(clase), duracion);
+        });
+    }
+
+    function encolar(elemento) {
+        const datos = leerCampo(elemento);
+        if (!datos) return;
+        const cambio = pendientes.get(datos.reservaId) || {};
+        cambio[datos.campo] = elemento.value;
+        pendientes.set(datos.reservaId, cambio);
+        elementosPendientes.add(elemento);
+        clearTimeout(temporizador);
+        temporizador = setTimeout(guardar, ESPERA_GUARDADO_MS);
+    }
+
+    function tomarLote() {
+        const cambios = Array.from(pendientes, ([reservaId, campos]) => ({ reserva_id: reservaId, ...campos }));
+        const elementos = Array.from(elementosPendientes);
+        pendientes = new Map();
+        elementosPendientes = new Set();
+        clearTimeout(temporizador);
+        return { cambios, elementos };
+    }
+
+    function guardar() {
+        const { cambios, elementos } = tomarLote();
+        if (!cambios.length) return;
+        fetch(URL_LOTE_OPINION_POSTVENTA, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-Requested-With': 'XMLHttpRequest'
+            },
+            body: JSON.stringify({ cambios })
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                const omitidas = new Set((data.omitidas || []).map(String));
+                marcar(elementos.filter(el => !omitidas.has(leerCampo(el).reservaId)), 'is-valid', 1000);
+                marcar(elementos.filter(el => omitidas.has(leerCampo(el).reservaId)), 'is-invalid', 2000);
+            } else {
+                marcar(elementos, 'is-invalid', 2000);
+                alert('Error al guardar: ' + (data.message || ''));
             }
-            fetch('/api/update_reserva_opinion_postventa', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'X-Requested-With': 'XMLHttpRequest'
-                },
-                body: JSON.stringify(payload)
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    select.classList.add('is-valid');
-                    setTimeout(() => select.classList.remove('is-valid'), 1000);
-                } else {
-                    select.classList.add('is-invalid');
-                    setTimeout(() => select.classList.remove('is-invalid'), 2000);
-                    alert('Error al guardar: ' + (data.message || ''));
-                }
-            })
-            .catch(err => {
-                select.classList.add('is-invalid');
-                setTimeout(() => select.classList.remove('is-invalid'), 2000);
-                alert('Error de red al guardar.');
-            });
-        }
-    });
+        })
+        .catch(err => {
+            marcar(elementos, 'is-invalid', 2000);
+            alert('Error de red al guardar.');
+        });
+    }
 
-    // Guardar experiencia o seguimiento al perder foco
+    // Selects: al cambiar. Textos: al perder el foco.
+    document.body.addEventListener('change', function(e) {
+        if (e.target.matches('select')) encolar(e.target);
+    });
     document.body.addEventListener('blur', function(e) {
-        if (e.target.matches('input[name^="experiencia_"]') || e.target.matches('input[name^="seguimiento_"]')) {
-            const input = e.target;
-            const [field, reservaId] = input.name.split('_');
-            const row = input.closest('tr');
-            let payload = { reserva_id: reservaId };
-            if (row) {
-                const opinionSelect = row.querySelector('select[name^="opinion_"]');
-                if (opinionSelect) payload.opinion = opinionSelect.value;
-                const postventaSelect = row.querySelector('select[name^="postventa_"]');
-                if (postventaSelect) payload.postventa = postventaSelect.value;
-                const experienciaInput = row.querySelector('input[name^="experiencia_"]');
-                if (experienciaInput) payload.experiencia = experienciaInput.value;
-                const estadoPostventaSelect = row.querySelector('select[name^="estado_postventa_"]');
-                if (estadoPostventaSelect) payload.estado_postventa = estadoPostventaSelect.value;
-                const seguimientoInput = row.querySelector('input[name^="seguimiento_"]');
-                if (seguimientoInput) payload.seguimiento = seguimientoInput.value;
-            }
-            fetch('/api/update_reserva_opinion_postventa', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'X-Requested-With': 'XMLHttpRequest'
-                },
-                body: JSON.stringify(payload)
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    input.classList.add('is-valid');
-                    setTimeout(() => input.classList.remove('is-valid'), 1000);
-                } else {
-                    input.classList.add('is-invalid');
-                    setTimeout(() => input.classList.remove('is-invalid'), 2000);
-                    alert('Error al guardar: ' + (data.message || ''));
-                }
-            })
-            .catch(err => {
-                input.classList.add('is-invalid');
-                setTimeout(() => input.classList.remove('is-invalid'), 2000);
-                alert('Error de red al guardar.');
-            });
+        if (e.target.matches('input, textarea') && e.target.value !== e.target.defaultValue) {
+            // Lo guardado pasa a ser el nuevo valor de referencia
+            e.target.defaultValue = e.target.value;
+            encolar(e.target);
         }
     }, true);
+
+    // Al salir de la página, enviar lo pendiente sin esperar la pausa
+    window.addEventListener('pagehide', function() {
+        const { cambios } = tomarLote();
+        if (!cambios.length) return;
+        const cuerpo = new Blob([JSON.stringify({ cambios })], { type: 'application/json' });
+        navigator.sendBeacon(URL_LOTE_OPINION_POSTVENTA, cuerpo);
+    });
 });